@@ -1,10 +1,24 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import datetime, json, os, pickle, re, requests, sys, traceback
+import datetime, io, itertools, json, os, pickle, queue, re, requests, resource, sys, threading, traceback
 import matplotlib.pyplot as plt
 import numpy as np
-from bs4 import BeautifulSoup
+from cpialias import AliasIndex
+from cpicompress import getPlainName, openInput
+from cpidelta import ChunkStore, fingerprintFile, diffManifests, loadManifest, saveManifest, iterDelta, applyEntries
+from cpigraph import CsrGraph
+from cpiids import IdRegistry, isCidCode
+from cpilines import countLines
+from cpinames import saveNameIndex, loadNameIndex
+from cpipubchem import PUG_REST_URL, BatchSizer, getPugUrl, getPostData, fetchAll, parseRecords, parseResponse
+from cpisample import loadSample, extrapolateTime
+from cpiscan import scanLinks
+from cpishard import shardByTaxon
+from cpitable import LinksTable
+from cpistore import saveMappedDic, loadMappedDic, MappedDic
+from cpiio import FILE_ORIGINS, loadColumns, loadColumnsParallel, iterColumns, decodeColumn
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from IPython import get_ipython
 from mlFunctions import tic, toc, beep, ts, alarm1, run_from_ipython, getNumLines
 from progress.bar import ChargingBar
@@ -53,6 +67,12 @@ elif OS == 'linux':
 # Use latex in matplotlib
 # plt.rc('text', usetex=True) # False by default
 
+# Incremental builders (see makeDicsIncremental): the dictionaries each one makes, and the column types of its input file (None to infer them)
+ACTIONS_DTYPES = FILE_ORIGINS['actions']['dtypes']
+INCREMENTAL_BUILDERS = {'cpi': (['cpiDic', 'cpiRDic'], None),
+                        'links': (['ctopDic', 'ptocDic', 'pairsToLinksDic'], ACTIONS_DTYPES),
+                        'protSyns': (['protSynsDic', 'protSynsRDic'], None)}
+
 '''
 Notes
 '''
@@ -75,6 +95,16 @@ def isCid(string):
         # print(x)
         return False
 
+def getPeakMemory():
+    '''
+    Returns the peak resident memory of this process so far, in bytes.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if OS == 'darwin':
+        return peak # reported in bytes on macOS
+    else:
+        return peak * 1024 # reported in kilobytes on Linux
+
 def loadPickle(DIR, pickleName):
     '''
     Loads a pickled object
@@ -89,6 +119,36 @@ def loadPickle(DIR, pickleName):
         pickleObj = pickle.load(handle)
     return pickleObj
 
+def saveDic(dic, DIR, dicName, storeFormat='pickle'):
+    '''
+    Saves a dictionary made by one of the 'make' functions.
+
+    INPUT:  DIR, string, the directory to write to.
+            dicName, a string, the name of the dictionary, e.g., 'protSynsDic'.
+            storeFormat, a string. 'pickle' writes 'DIR dicName.pickle'. 'mapped' writes the directory 'DIR dicName' in the memory-mapped format of cpistore.py, which can be opened instantly and shared between processes. 'index' writes the same with the name index of cpinames.py, for reverse dictionaries like chemSynsRDic and protSynsRDic, which adds case-insensitive and prefix look-ups.
+    '''
+    if storeFormat == 'pickle':
+        pname = '%s%s.pickle' % (DIR, dicName)
+        with open(pname, 'wb') as handle:
+            pickle.dump(dic, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    elif storeFormat == 'mapped':
+        saveMappedDic(dic, DIR + dicName)
+    elif storeFormat == 'index':
+        saveNameIndex(dic, DIR + dicName)
+    else:
+        raise ValueError('storeFormat must be \'pickle\', \'mapped\' or \'index\', not %s.' % storeFormat)
+
+def loadDic(DIR, dicName):
+    '''
+    Loads a dictionary saved with saveDic. The memory-mapped format is used if it exists, otherwise the pickle is loaded.
+    '''
+    if os.path.isfile(DIR + dicName + '/foldOrder.npy'):
+        return loadNameIndex(DIR + dicName)
+    elif os.path.isdir(DIR + dicName):
+        return loadMappedDic(DIR + dicName)
+    else:
+        return loadPickle(DIR, dicName)
+
 def getQuickModeLimit(quickModeLimit, maximum):
     '''
     Makes sure the quickModeLimit is not less than the maximum number of iterables.
@@ -116,6 +176,32 @@ def getQuickModeLimit(quickModeLimit, maximum):
 
     return quickModeLimit
 
+def getSampleSize(fpath, sampleMode, quickModeLimit):
+    '''
+    Returns the size of a quickMode sample (see cpisample.loadSample) from a quickModeLimit. A 'hash' sample takes the fraction of the rows as is. The 'reservoir' and 'offsets' samples take a number of rows, so a float limit is taken as a fraction of the rows of the file, as in getQuickModeLimit.
+    '''
+    if sampleMode == 'hash':
+        return quickModeLimit
+    return getQuickModeLimit(quickModeLimit, countLines(fpath) - 1)
+
+def getChemProtColumns(table, registry=None):
+    '''
+    Returns the chemicals and proteins of a links or actions table (see cpiio.loadColumns) as two parallel arrays, one entry per row. In the actions file the chemical can be in either of the first two columns, so each row is flipped as needed.
+
+    If an IdRegistry is given the arrays hold integer codes, otherwise they hold strings.
+    '''
+    names = table['header'][:2]
+    if registry is None:
+        labels = np.array(table['vocab'], dtype=object)
+        labelIsCid = np.fromiter((isCid(label) for label in table['vocab']), dtype=np.bool_, count=len(labels))
+        A, B = labels[table['columns'][names[0]]], labels[table['columns'][names[1]]]
+        aIsCid = labelIsCid[table['columns'][names[0]]]
+    else:
+        ids = registry.encodeVocab(table, names)
+        A, B = ids[names[0]], ids[names[1]]
+        aIsCid = isCidCode(A)
+    return np.where(aIsCid, A, B), np.where(aIsCid, B, A)
+
 def loadFile(DIR, dataDir, fname, withHeaders=False, verbose=0, quickMode=False, quickModeLimit = 10):
     '''
     Reads tab-delimited file and returns it as a list of lists. Scroll to bottom of Docstring for loading times.
@@ -156,15 +242,13 @@ def loadFile(DIR, dataDir, fname, withHeaders=False, verbose=0, quickMode=False,
         timeStamp = ts()
         print('\n[%s] Getting progres bar length.' % str(timeStamp))
     if not quickMode and verbose:
-        with open(fpath) as f:
-            lines0 = (f.readline().splitlines()[0] for line in f)
-            count = sum(1 for line in lines0)
+        count = countLines(fpath) - 1 # the header is not split
     if verbose > 0:
         Toc = toc(Tic)
         TicSum += Toc
 
     # Main block
-    with open(fpath) as f:
+    with io.TextIOWrapper(openInput(fpath)) as f:
 
         # Read file
         if verbose > 0:
@@ -214,225 +298,194 @@ def makeCpiDic():
     '''
     pass
 
-def makeCidList(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv', verbose=0, quickMode=False, quickModeLimit=.1):
+def makeCpiDics(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv', outputs=('cidList', 'cpiDic', 'cpiRDic', 'scoreStats'), verbose=0, quickMode=False, quickModeLimit=.1, registry=None, numProcs=1):
     '''
-    Docstring
+    Builds several structures from a links or actions file in a single read, see cpiscan.py. makeCidList and makeCpiDic each read the file, so building the CID list and both dictionaries from one call costs one read instead of two or three.
+
+    INPUT:  fname, a simple links, detailed links or actions file. The type is detected from the header (see cpiio.FILE_ORIGINS).
+            outputs, a list of consumer names ('cidList', 'cpiDic', 'cpiRDic', 'scoreStats', 'linkScores', 'cpiGraph') and cpiscan.ScanConsumer objects. With the detailed links file, 'scoreStats' and 'linkScores' include the evidence scores.
+            registry, an IdRegistry (see cpiids.py), optional. If given, CIDs and proteins are integer codes instead of strings. Needed for 'cpiGraph'.
+            numProcs, integer. If greater than 1 the file is split into shards that are parsed in parallel by that many processes (see cpiio.loadColumnsParallel). quickMode always runs on a single process.
+    OUTPUT: results, a dictionary { output name : result }, e.g. results['cpiDic']
+
+    >>> results = makeCpiDics(DIR, dataDir, outDir)
+    >>> cidList, cpiDic, cpiRDic = results['cidList'], results['cpiDic'], results['cpiRDic']
     '''
     # verbose start
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Running \'makeCidList\' function.' % str(timeStamp))
+        print('\n[%s] Running \'makeCpiDics\' function.' % str(timeStamp))
         TicSum = datetime.timedelta(0,0,0)
         Tic = tic()
     fpath = dataDir + fname
 
-    # Get progress bar length
+    # Validate quickModeLimit
+    maxRows = None
+    if quickMode:
+        maxRows = getQuickModeLimit(quickModeLimit, countLines(fpath) - 1)
+
+    # Parallel mode
+    table = None
+    if numProcs > 1 and not quickMode:
+        if verbose > 0:
+            timeStamp = ts()
+            print('\n[%s] Parsing file with %d processes.' % (str(timeStamp), numProcs))
+        table = loadColumnsParallel(fpath, numProcs=numProcs)
+        if verbose > 0:
+            Toc = toc(Tic)
+            TicSum += Toc
+
+    # Main block
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Getting progress bar length.' % str(timeStamp))
+        print('\n[%s] Scanning file for %s.' % (str(timeStamp), ', '.join(str(getattr(output, 'name', output)) for output in outputs)))
+        spinner = Spinner('')
         Tic = tic()
+    else:
+        spinner = None
+    results = scanLinks(fpath, outputs, registry=registry, maxRows=maxRows, table=table, progress=spinner)
     if verbose > 0:
-        count = getNumLines(fpath, verbose = 0)
-    if verbose > 0:
+        spinner.finish()
         Toc = toc(Tic)
         TicSum += Toc
 
-    # Validate quickModeLimit
-    if quickMode:
-        quickModeLimit = getQuickModeLimit(quickModeLimit, count)
+    # Verbose finish
+    if verbose > 0:
+        timeStamp = ts()
+        print('\n[%s] Done running \'makeCpiDics\' function.\nTotal elapsed time was %s (h:mm:ss)\nPeak memory use was %0.1f MB' % (str(timeStamp), str(TicSum), getPeakMemory() / 2**20))
 
-    # Main block
-    with open(fpath, 'r') as f:
+    return results
 
-        # create generator
-        if quickMode:
-            lineGenerator = (f.readline() for _ in range(quickModeLimit))
-        else:
-            lineGenerator = (f.readline() for _ in range(count))
-        headers=next(lineGenerator)
+def makeCidList(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv', verbose=0, quickMode=False, quickModeLimit=.1, registry=None, numProcs=1):
+    '''
+    Returns the list of unique CIDs in a links or actions file, in order of first appearance.
+
+    If an IdRegistry (see cpiids.py) is given as 'registry', the CIDs are returned as integer codes instead of strings. See makeCpiDics for the other arguments, and to build the CID list together with cpiDic and cpiRDic in one read.
+    '''
+    return makeCpiDics(DIR, dataDir, outDir, fname, ['cidList'], verbose, quickMode, quickModeLimit, registry, numProcs)['cidList']
+
+def makeCpiDic(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv', verbose=0, quickMode=False, quickModeLimit=.1, registry=None, numProcs=1):
+    '''
+    Returns the CID-to-proteins and protein-to-CIDs dictionaries of a links or actions file, (cpiDic, cpiRDic).
 
-        # initialize list
-        cidList = []
-        cpiDic = {}
+    If an IdRegistry (see cpiids.py) is given as 'registry', the CIDs and proteins are stored as integer codes instead of strings. See makeCpiDics for the other arguments.
+    '''
+    results = makeCpiDics(DIR, dataDir, outDir, fname, ['cpiDic', 'cpiRDic'], verbose, quickMode, quickModeLimit, registry, numProcs)
+    return results['cpiDic'], results['cpiRDic']
 
-        # The loop depends on the file being used.
-        # fileOrigin = getFileOrigin(fname) # not implemented
-        fileOrigin = 'simpleLinks'
+def makeCpiGraph(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv', verbose=0, quickMode=False, quickModeLimit=.1, registry=None, sampleMode=None):
+    '''
+    Builds the chemical-protein interaction graph as a CsrGraph (see cpigraph.py). This replaces the cpiDic and cpiRDic dictionaries of makeCpiDic for large species: both directions are kept as flat integer arrays, and the combined_score of every link is kept as well.
 
-        # Verbose prelude to if block
+    INPUT:  quickModeLimit, with quickMode, the fraction of the rows (a float) or the number of rows (an integer) to read (see getQuickModeLimit).
+            registry, an IdRegistry, optional. A new one is made if not given.
+            sampleMode, string, optional. With quickMode, builds the graph from a random sample of the file instead of its first 'quickModeLimit' rows: 'hash' keeps every link of a fraction 'quickModeLimit' of the chemicals, 'reservoir' and 'offsets' keep 'quickModeLimit' links, or that fraction of the links if it is a float (see cpisample.py and getSampleSize). With verbose, the time of a full build is extrapolated from the sample.
+    OUTPUT: cpiGraph, a CsrGraph. Save it with cpiGraph.save(outDir + '9606cpiGraph') and load it memory-mapped with CsrGraph.load.
+            registry, the IdRegistry used to encode the CIDs and proteins of cpiGraph.
+    '''
+    # verbose start
+    if verbose > 0:
+        timeStamp = ts()
+        print('\n[%s] Running \'makeCpiGraph\' function.' % str(timeStamp))
+        TicSum = datetime.timedelta(0,0,0)
+        Tic = tic()
+    fpath = dataDir + fname
+    if registry is None:
+        registry = IdRegistry()
+
+    # Load file
+    sampleInfo = None
+    if quickMode and sampleMode is not None:
+        table, sampleInfo = loadSample(fpath, sampleMode, getSampleSize(fpath, sampleMode, quickModeLimit), keyColumns=['chemical'])
         if verbose > 0:
             timeStamp = ts()
-            print('\n[%s] Splitting lines.' % str(timeStamp))
-            Tic = tic()
-        if verbose > 0:
-            if quickMode:
-                bar = ChargingBar('', max = quickModeLimit)
-            else:
-                bar = ChargingBar('', max = count)
-        # If block
-        if fileOrigin == 'simpleLinks':
-            for line in lineGenerator:
-                cid, c2, c3  = line.split()
-                cidList.append(cid)
-                if verbose > 0:
-                    bar.next()
-        elif fileOrigin == 'detailedLinks':
-            for line in lineGenerator:
-                cid, c2, c3, c4, c5, c6, c7 = line.split()
-                cidList.append(cid)
-                if verbose > 0:
-                    bar.next()
-        elif fileOrigin == 'actions':
-            for line in lineGenerator:
-                a, b, c3, c4, c5, c6 = line.split()
-                if isCid(a):
-                    cidList.append(a)
-                elif isCid(b):
-                    cidList.append(b)
-                else:
-                    print('This should not be happening!')
-                    sys.exit(0)
-                if verbose > 0:
-                    bar.next()
+            print('\n[%s] Sampled %d of %d links (%0.2f%%) with the \'%s\' method.' % (str(timeStamp), sampleInfo['numRows'], sampleInfo['totalRows'], 100 * sampleInfo['fraction'], sampleMode))
+    else:
+        if quickMode:
+            maxRows = getQuickModeLimit(quickModeLimit, countLines(fpath) - 1)
+        else:
+            maxRows = None
+        table = loadColumns(fpath, maxRows=maxRows)
     if verbose > 0:
-        bar.finish()
         Toc = toc(Tic)
         TicSum += Toc
 
-    # Create set from list
+    # Build graph
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Creating set from list.' % str(timeStamp))
+        print('\n[%s] Building CSR graph.' % str(timeStamp))
         Tic = tic()
-    cidList = list(set(cidList))
+    cpiGraph = CsrGraph.fromTable(table, registry)
     if verbose > 0:
-            Toc = toc(Tic)
-            TicSum += Toc
+        Toc = toc(Tic)
+        TicSum += Toc
+        if sampleInfo is not None:
+            print('Building the graph of the whole file would take about %s (h:mm:ss).' % str(datetime.timedelta(seconds=extrapolateTime(Toc.total_seconds(), sampleInfo))))
 
     # Verbose finish
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Done running \'makeCidList\' function.\nTotal elapsed time was %s (h:mm:ss)' % (str(timeStamp), str(TicSum)))
+        print('\n[%s] Done running \'makeCpiGraph\' function.\nTotal elapsed time was %s (h:mm:ss)' % (str(timeStamp), str(TicSum)))
 
-    # return statement
-    withHeaders = False
-    if withHeaders:
-        return headers, cidList
-    else:
-        return cidList
+    return cpiGraph, registry
 
-def makeCpiDic(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv', verbose=0, quickMode=False, quickModeLimit=.1):
+def saveSpeciesGraph(DIR, shardDir, outDir, fname, taxon):
     '''
-    The code is a clone of makeCidList, but the if-block inside the for loop is different.
+    Builds the CsrGraph of one species file made by shardByTaxon, and saves it to outDir + '<taxon>cpiGraph' with its registry at outDir + '<taxon>registry.pickle'. Used by the worker processes of makeSpeciesGraphs.
     '''
-    # verbose start
+    cpiGraph, registry = makeCpiGraph(DIR, shardDir, outDir, fname='%d.%s' % (taxon, getPlainName(fname)))
+    cpiGraph.save(outDir + '%dcpiGraph' % taxon)
+    registry.save(outDir + '%dregistry.pickle' % taxon)
+    return len(cpiGraph)
+
+def makeSpeciesGraphs(DIR, dataDir, outDir, fname='protein_chemical.links.v5.0.tsv', actionsFname=None, taxa=None, verbose=0, numProcs=None, shardSize=2**26):
+    '''
+    Builds the chemical-protein interaction graphs of all species in one job, from the all-species STITCH files instead of the downloads of each species.
+
+    The links file, and the actions file if 'actionsFname' is given, are each read once and split into species files in outDir + 'species/', e.g. '9606.protein_chemical.links.v5.0.tsv' (see cpishard.py). The functions for the human files, like makeLinksDic, can be run on these. The STITCH downloads can be given as they are, e.g. fname='protein_chemical.links.v5.0.tsv.gz' (see cpicompress.py); the species files are not compressed. Then the graph of every species is built in a process pool and saved as with makeCpiGraph, to outDir + '9606cpiGraph' and outDir + '9606registry.pickle' for humans.
+
+    INPUT:  taxa, a collection of integer taxa, optional. Only these species are processed.
+            numProcs, integer, the number of worker processes. Defaults to the number of CPUs. Every worker holds the table of one species, so memory use is about numProcs times that of the largest species.
+            shardSize, integer, the number of bytes read by a worker at a time (see shardByTaxon).
+    OUTPUT: shards, a dictionary { taxon : {'fpath' : path of the species links file, 'numRows' : number of rows, 'numEdges' : number of edges in the graph} }
+    '''
+    # Verbose start
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Running prototype for \'makeCpiDic\' function.' % str(timeStamp))
+        print('\n[%s] Running \'makeSpeciesGraphs\' function.' % str(timeStamp))
         TicSum = datetime.timedelta(0,0,0)
         Tic = tic()
-    fpath = dataDir + fname
+    if numProcs is None:
+        numProcs = os.cpu_count()
+    shardDir = outDir + 'species/'
 
-    # Get progress bar length
+    # Split files by species
+    shards, numSkipped = shardByTaxon(dataDir + fname, shardDir, taxa=taxa, numProcs=numProcs, shardSize=shardSize)
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Getting progress bar length.' % str(timeStamp))
-        Tic = tic()
-    if verbose > 0:
-        count = getNumLines(fpath, verbose = 0)
+        print('\n[%s] Split \'%s\' into %d species files, skipped %d rows without a protein.' % (str(timeStamp), fname, len(shards), numSkipped))
+    if actionsFname is not None:
+        actionShards, numSkipped = shardByTaxon(dataDir + actionsFname, shardDir, taxa=taxa, numProcs=numProcs, shardSize=shardSize)
+        if verbose > 0:
+            timeStamp = ts()
+            print('\n[%s] Split \'%s\' into %d species files, skipped %d rows without a protein.' % (str(timeStamp), actionsFname, len(actionShards), numSkipped))
     if verbose > 0:
         Toc = toc(Tic)
         TicSum += Toc
 
-    # Validate quickModeLimit
-    if quickMode:
-        quickModeLimit = getQuickModeLimit(quickModeLimit, count)
-
-    # Main block
-    with open(fpath, 'r') as f:
-
-        # create generator
-        if quickMode:
-            lineGenerator = (f.readline() for _ in range(quickModeLimit))
-        else:
-            lineGenerator = (f.readline() for _ in range(count))
-        headers=next(lineGenerator)
-
-        # initialize list
-        cpiDic = {}
-        cpiRDic = {}
-
-        # The loop depends on the file being used.
-        # fileOrigin = getFileOrigin(fname) # not implemented
-        fileOrigin = 'simpleLinks'
-
-        # Verbose prelude to if block
-        if verbose > 0:
-            timeStamp = ts()
-            print('\n[%s] Splitting lines.' % str(timeStamp))
-            Tic = tic()
-        if verbose > 0:
-            if quickMode:
-                bar = ChargingBar('', max = quickModeLimit)
-            else:
-                bar = ChargingBar('', max = count)
-        # If block
-        if fileOrigin == 'simpleLinks':
-            for line in lineGenerator:
-                cid, c2, c3  = line.split()
-                try:
-                    cpiDic[cid].append(c2)
-                except KeyError:
-                    cpiDic[cid] = [c2]
-                # RDic
-                try:
-                    cpiRDic[c2].append(cid)
-                except KeyError:
-                    cpiRDic[c2] = [cid]
-                if verbose > 0:
-                    bar.next()
-        elif fileOrigin == 'detailedLinks':
-            for line in lineGenerator:
-                cid, c2, c3, c4, c5, c6, c7 = line.split()
-                try:
-                    cpiDic[cid].append(c2)
-                except KeyError:
-                    cpiDic[cid] = [c2]
-                # RDic
-                try:
-                    cpiRDic[c2].append(cid)
-                except KeyError:
-                    cpiRDic[c2] = [cid]
-                if verbose > 0:
-                    bar.next()
-        elif fileOrigin == 'actions':
-            for line in lineGenerator:
-                a, b, c3, c4, c5, c6 = line.split()
-                if isCid(a):
-                    try:
-                        cpiDic[a].append(b)
-                    except KeyError:
-                        cpiDic[a] = [b]
-                    # RDic
-                    try:
-                        cpiRDic[b].append(a)
-                    except KeyError:
-                        cpiRDic[b] = [a]
-                elif isCid(b):
-                    try:
-                        cpiDic[b].append(a)
-                    except KeyError:
-                        cpiDic[b] = [a]
-                    # RDic
-                    try:
-                        cpiRDic[a].append(b)
-                    except KeyError:
-                        cpiRDic[a] = [b]
-                else:
-                    print('This should not be happening!')
-                    sys.exit(0)
-                if verbose > 0:
-                    bar.next()
+    # Build graphs, largest species first so the pool is not left waiting on one large species at the end
+    if verbose > 0:
+        timeStamp = ts()
+        print('\n[%s] Building CSR graphs of %d species.' % (str(timeStamp), len(shards)))
+        bar = ChargingBar('Building graphs', max=len(shards), suffix = '%(percent).1f%% - %(eta)ds')
+        Tic = tic()
+    taxonOrder = sorted(shards, key=lambda taxon: shards[taxon]['numRows'], reverse=True)
+    with ProcessPoolExecutor(max_workers=numProcs) as pool:
+        futures = {pool.submit(saveSpeciesGraph, DIR, shardDir, outDir, fname, taxon): taxon for taxon in taxonOrder}
+        for future in as_completed(futures):
+            shards[futures[future]]['numEdges'] = future.result()
+            if verbose > 0:
+                bar.next()
     if verbose > 0:
         bar.finish()
         Toc = toc(Tic)
@@ -441,22 +494,25 @@ def makeCpiDic(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv
     # Verbose finish
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Done running protoype for \'makeCpiDic\' function.\nTotal elapsed time was %s (h:mm:ss)' % (str(timeStamp), str(TicSum)))
+        print('\n[%s] Done running \'makeSpeciesGraphs\' function.\nTotal elapsed time was %s (h:mm:ss)' % (str(timeStamp), str(TicSum)))
 
-    # return statement
-    withHeaders = False
-    if withHeaders:
-        return headers, cpiDic
-    else:
-        return cpiDic
+    return shards
 
-def downloadCidSyns(cidList, mineType='synonyms', alarm=alarm1, verbose=0):
+def downloadCidSyns(cidList, mineType='synonyms', alarm=alarm1, verbose=0, cache=None, baseUrl=PUG_REST_URL, rate=5, maxInFlight=5, method='get', sizer=None):
     '''
     Download all synonyms for a given list of PubChem Compound ID (CID) numbers using PubChem's PUG REST utility. It takes less than 10 minutes to download all the synonyms for the STITCH CPI database on residential broadband.
 
+    This is a generator. Responses are downloaded in a background thread and parsed incrementally by cpipubchem.parseRecords as they arrive, and their records are yielded one at a time, so only a few chunks are held in memory however long 'cidList' is.
+
     INPUT:  cidList, a list, the list of CIDs.
             alarm, an object (default: alarm = alarm1). This object will be called at the end of the function, when all the synonyms are finished downloading. By default \'alarm1\' is called, which is a series of high and low pitch tones executed in Bash using the operating system.
-    OUTPUT: requestResults, a BeautifulSoup4 object.
+            cache, a cpipubchem.ResponseCache, optional. Only CIDs missing from the cache are downloaded, and each chunk is cached as soon as it arrives, so an interrupted run picks up where it stopped. Cached CIDs are yielded first.
+            baseUrl, a string, the PUG REST address. Can point to a local server for testing.
+            rate, float, the maximum number of requests per second. PubChem's usage policy allows 5.
+            maxInFlight, integer, the number of concurrent requests (see cpipubchem.fetchAll).
+            method, a string, 'get' or 'post'. GET requests carry 190 CIDs in the URL. POST requests carry the CIDs in the request body, in batches sized from the latency and size of earlier responses, which takes an order of magnitude fewer requests.
+            sizer, a cpipubchem.BatchSizer, optional. Chooses the POST batch sizes and records every batch's size and latency in sizer.history. A new one is made if not given.
+    OUTPUT: a generator of records (cid, [synonym1, synonym2, ...]) for synonyms, or (cid, (AtomStereoCount, ...)) for properties. 'cid' is the CID number as an integer.
     '''
     # verbose start
     if verbose > 0:
@@ -472,75 +528,109 @@ def downloadCidSyns(cidList, mineType='synonyms', alarm=alarm1, verbose=0):
 
     cidList = [int(cid[-8:]) for cid in cidList]
 
-    chunkSize = 190 # chunkSize is the number of length-9 CIDs (plus comma) that can fit into a URL, minus the approximately 100 other characters for the PUG request to PubChem servers.
-    numChunks = np.ceil(len(cidList)/chunkSize)
+    # Only download CIDs that are not cached
+    if cache is not None:
+        downloadList = cache.missing(mineType, cidList)
+        downloadSet = set(downloadList)
+        bodies = cache.get(mineType, [cid for cid in cidList if cid not in downloadSet])
+        for cid, body in bodies.items():
+            if body: # empty for CIDs PubChem has no record for
+                yield from parseRecords(body, mineType)
+        del bodies
+    else:
+        downloadList = cidList
 
-    requestResults = []
+    method = method.lower()
+    chunkSize = 190 # chunkSize is the number of length-9 CIDs (plus comma) that can fit into a URL, minus the approximately 100 other characters for the PUG request to PubChem servers.
+    if method == 'post' and sizer is None:
+        sizer = BatchSizer()
 
     # Loop miscellanea
     if verbose > 0:
         timeStamp = ts()
         print('\n[%s] Downloading CID information.' % str(timeStamp))
-        bar = ChargingBar('', max = numChunks)
-    i = 0 # iterations, number of server requests
-    j1 = 0 # index dummy variable
-    Tic = tic()
-
-    # Loop
-    for num in np.arange(numChunks):
-        j0 = j1 # starting position index
-        j1 = int(min( len(cidList), (num+1) * chunkSize)) # ending position index
-        tempList = cidList[j0:j1]
-        cidChunk = ','.join([str(element) for element in tempList])
-        if mineType == 'synonyms':
-            URL = 'https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/'+cidChunk+'/synonyms/XML'
-        elif mineType == 'properties':
-            URL = 'https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/'+cidChunk+'/property/AtomStereoCount,DefinedAtomStereoCount,UndefinedAtomStereoCount,BondStereoCount,DefinedBondStereoCount,UndefinedBondStereoCount/XML'
-        R = requests.get(URL, headers = Headers)
-        soup = BeautifulSoup(R.text, 'lxml')
-        if mineType == 'synonyms':
-            Found = soup.findAll('information')
-        elif mineType == 'properties':
-            Found = soup.findAll('properties')
-        requestResults.extend(Found) # append results for processing later
-
-        # PubChem requires that no more than 5 requests be made per second
-        i += 1
-        Toc = toc(Tic, mute=True)
-        if Toc.total_seconds() <= 1:
-            if i == 5:
-                time.sleep(1)
-                i = 0
-                Tic = tic()
-                TicSum += Toc
-            elif i < 5:
-                pass
-            elif i > 5:
-                print('This isn\'t supposed to happen!')
-        elif Toc.total_seconds() > 1:
-            i = 1
-            Tic = tic()
-            TicSum += Toc
+        bar = ChargingBar('', max = len(downloadList))
+        Tic = tic()
+
+    # Requests, one per chunk of CIDs. POST chunks are sized when they are made, so they follow the sizer.
+    def getRequests():
+        j0 = 0
+        while j0 < len(downloadList):
+            if method == 'post':
+                tempList = downloadList[j0:j0+sizer.size]
+                cidChunk = ','.join([str(element) for element in tempList])
+                yield tempList, getPugUrl(None, mineType, baseUrl), getPostData(cidChunk)
+            else:
+                tempList = downloadList[j0:j0+chunkSize]
+                cidChunk = ','.join([str(element) for element in tempList])
+                yield tempList, getPugUrl(cidChunk, mineType, baseUrl)
+            j0 += len(tempList)
+
+    # Parse each response in the worker thread that downloaded it
+    def parse(R):
+        records, complete = parseResponse(R.content, mineType)
+        return R.status_code, R.latency, len(R.content), records, complete
+
+    # Hand over the records of each response as it arrives
+    chunkQueue = queue.Queue(maxsize=2 * maxInFlight)
+    def onResponse(tempList, result):
+        status, latency, numBytes, records, complete = result
+        if sizer is not None:
+            sizer.update(len(tempList), latency, numBytes, status)
+        if cache is not None and (status == 404 or status == 200 and complete):
+            # 404 means PubChem has none of the CIDs. Other errors are not cached, so those CIDs are tried again next run.
+            bodies = {cid: '' for cid in tempList}
+            for cid, values, body in records:
+                bodies[cid] = body
+            cache.put(mineType, bodies)
+        elif cache is not None and status == 200:
+            # The response was cut off or is not XML. Only the records read in full are cached, and the other CIDs are tried again next run.
+            cache.put(mineType, {cid: body for cid, values, body in records})
+        chunkQueue.put([(cid, values) for cid, values, body in records])
 
         # Progress bar
         if verbose > 0:
-            bar.next()
+            bar.next(len(tempList))
+
+    # PubChem requires that no more than 5 requests be made per second
+    def download():
+        try:
+            if method == 'post':
+                queueSize = 1 # make each batch only when a request slot is free, so it is sized from the latest responses
+            else:
+                queueSize = None
+            fetchAll(getRequests(), onResponse, rate=rate, maxInFlight=maxInFlight, queueSize=queueSize, headers=Headers, parse=parse)
+            chunkQueue.put(None)
+        except BaseException as error:
+            chunkQueue.put(error)
+    thread = threading.Thread(target=download, daemon=True)
+    thread.start()
+    while True:
+        records = chunkQueue.get()
+        if records is None:
+            break
+        if isinstance(records, BaseException):
+            raise records
+        yield from records
+    thread.join()
     if verbose > 0:
         bar.finish()
-    if verbose > 0:
         Toc = toc(Tic)
         TicSum += Toc
+        if sizer is not None and len(sizer.history) > 0:
+            print('\nBatches: %(numBatches)d, mean size: %(meanBatchSize).0f CIDs, mean latency: %(meanLatency).2f s, max latency: %(maxLatency).2f s' % sizer.summary())
     if verbose > 1:
         alarm()
 
+    if cache is not None:
+        cache.evict()
+
     # Verbose finish
     if verbose > 0:
         timeStamp = ts()
         print('\n[%s] Done running \'downloadCidSyns\' function.\nTotal elapsed time was %s (h:mm:ss)' % (str(timeStamp), str(TicSum)))
 
-    return requestResults
-
-def makeChemSynsDic(DIR, outDir, cidList, modeType='synonyms', verbose=0):
+def makeChemSynsDic(DIR, outDir, cidList, modeType='synonyms', verbose=0, storeFormat='pickle', cache=None, method='get', sizer=None):
     '''
     Creates a dictionary of CID (compound ID) synonyms. Synonyms are acquired by
     using the PUG REST utility from PubChem (NIH). Requires internet connection.
@@ -551,22 +641,18 @@ def makeChemSynsDic(DIR, outDir, cidList, modeType='synonyms', verbose=0):
             cidList, a list, the list of CIDs.
     OUTPUT: chemSynsDic, a dic, the dictionary of CID synonyms (i.e., CID -> chemical name).
             chemSynsRDic, a dic, the dictionary of chemical name synonyms (i.e., chemical name -> CID).
+
+    The dictionaries are saved to outDir in the format given by 'storeFormat' (see saveDic). If a cpipubchem.ResponseCache is given as 'cache', only CIDs missing from it are downloaded. 'method' and 'sizer' choose between GET and batched POST requests (see downloadCidSyns).
     '''
     # verbose start
     modeType = modeType.lower()
 
-    # Download synonyms
-    requestResults = downloadCidSyns(cidList, mineType=modeType, verbose=verbose-1)
-
-    # Process html results to list of strings
+    # Download synonyms and build the dictionaries from the records as they arrive
     chemSynsDic = {}
     chemSynsRDic = {}
-    for result in requestResults:
-        cid = result.cid.text
-        if modeType == 'synonyms':
-            resultList = [syn.text for syn in result.findAll('synonym')]
-        if modeType == 'properties':
-            resultList = [syn.text for syn in result.findAll(['atomstereocount','definedatomstereocount','undefinedatomstereocount','bondstereocount','definedbondstereocount','undefinedbondstereocount'])]
+    for cid, resultList in downloadCidSyns(cidList, mineType=modeType, verbose=verbose-1, cache=cache, method=method, sizer=sizer):
+        cid = str(cid)
+        resultList = list(resultList)
         try:
             chemSynsDic[cid].extend(resultList)
         except KeyError:
@@ -576,22 +662,25 @@ def makeChemSynsDic(DIR, outDir, cidList, modeType='synonyms', verbose=0):
             for synonym in resultList:
                 try:
                     chemSynsRDic[synonym].append(cid)
-                else:
-                    chemSynsRDic[synonym] = cid
-                
-    # Pickle dictionaries
-    pname = outDir + 'chemSynsDic.pickle'
-    with open(pname, 'wb') as handle:
-        pickle.dump(chemSynsDic, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    pname = outDir + 'chemSynsRDic.pickle'
-    with open(pname, 'wb') as handle:
-        pickle.dump(chemSynsRDic, handle, protocol=pickle.HIGHEST_PROTOCOL)
+                except KeyError:
+                    chemSynsRDic[synonym] = [cid]
+
+    # Save dictionaries
+    saveDic(chemSynsDic, outDir, 'chemSynsDic', storeFormat)
+    saveDic(chemSynsRDic, outDir, 'chemSynsRDic', storeFormat)
 
     return chemSynsDic, chemSynsRDic
 
-def makeProtSynsDic(DIR, dataDir='STITCH Data', fname='/9606.protein.aliases.v10.5.txt', verbose=0, quickMode=False, quickModeLimit=250000):
+def makeProtSynsDic(DIR, dataDir='STITCH Data', fname='/9606.protein.aliases.v10.5.txt', verbose=0, quickMode=False, quickModeLimit=250000, table=None, registry=None, numProcs=1, storeFormat='pickle'):
     '''
-    Docstring
+    Creates the protein synonyms dictionary and its reverse look-up dictionary from the STRING aliases file. The dictionaries are in the format
+        protSynsDic  = { protein : [(alias1, source1), (alias2, source2), ...] }
+        protSynsRDic = { alias : [(protein1, source1), (protein2, source2), ...] }
+
+    INPUT:  table, a dictionary, optional. The aliases file as returned by cpiio.loadColumns. If not given, the file at DIR + dataDir + fname is loaded.
+            registry, an IdRegistry, optional. If given, proteins are stored as integer codes instead of strings (see cpiids.py).
+            numProcs, integer. If greater than 1, the file is parsed in parallel shards by that many processes (see cpiio.loadColumnsParallel).
+            storeFormat, a string, 'pickle' or 'mapped'. The format the dictionaries are saved in (see saveDic).
     '''
 
     # Verbose start
@@ -600,122 +689,141 @@ def makeProtSynsDic(DIR, dataDir='STITCH Data', fname='/9606.protein.aliases.v10
         timeStamp = ts()
         print('\n[%s] Running \'makeProtSynsDic\' function.' % str(timeStamp))
 
-    protsyns = loadFile(DIR=DIR, dataDir=dataDir, fname=fname, withHeaders=False, verbose=verbose, quickMode=quickMode, quickModeLimit = quickModeLimit)
-    # v10.5.txt has 48,366,210 lines that are read in 1h 15m.
+    if table is None:
+        if quickMode:
+            maxRows = getQuickModeLimit(quickModeLimit, countLines(DIR + dataDir + fname) - 1)
+        else:
+            maxRows = None
+        if verbose > 0:
+            timeStamp = ts()
+            print('\n[%s] Loading file into columns.' % str(timeStamp))
+            Tic = tic()
+        if numProcs > 1 and not quickMode:
+            table = loadColumnsParallel(DIR + dataDir + fname, numProcs=numProcs)
+        else:
+            table = loadColumns(DIR + dataDir + fname, maxRows=maxRows)
+        if verbose > 0:
+            Toc = toc(Tic)
+            TicSum += Toc
+    names, aliases, sources = [decodeColumn(table, name) for name in table['header'][:3]]
+    if registry is not None:
+        name = table['header'][0]
+        names = registry.encodeVocab(table, [name])[name]
 
-    # create set of protein names and aliases
+    # Populate dictionaries
+    # Equal strings are shared between rows, so each alias and source string is stored once.
     if verbose > 0:
         timeStamp = ts()
-        text = '\n[%s] Creating sets of protein names and aliases.' % str(timeStamp)
-        print(text)
-        count = len(protsyns)
+        print('\n[%s] Populating protein synonym and alias dictionaries.' % str(timeStamp))
+        count = len(names)
         bar = ChargingBar('', max = count)
         Tic = tic()
-    prots = []
-    aliases = []
-    for row in protsyns:
-        name, alias = row[0], row[1]
-        prots.append(name)
-        aliases.append(alias)
+    protSynsDic = {}
+    protSynsRDic = {}
+    for name, alias, source in zip(names.tolist(), aliases.tolist(), sources.tolist()): # line format is : name alias source
+        try:
+            protSynsDic[name].append((alias, source))
+        except KeyError:
+            protSynsDic[name] = [(alias, source)]
+        try:
+            protSynsRDic[alias].append((name, source))
+        except KeyError:
+            protSynsRDic[alias] = [(name, source)]
         if verbose > 0:
             bar.next()
-    prots = set(prots)
-    aliases = set(aliases)
     if verbose > 0:
         bar.finish()
         Toc = toc(Tic)
         TicSum += Toc
 
-    # Prime dictionary of protein name aliases
+    # Save dictionaries
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Priming protein synonyms dictionary.' % str(timeStamp))
-        count = len(prots)
-        bar = ChargingBar('', max = count)
+        print('\n[%s] Saving dictionaries.' % str(timeStamp))
         Tic = tic()
-    protSynsDic = {}
-    for prot in prots:
-        protSynsDic[prot] = []
-        if verbose > 0:
-            bar.next()
+    saveDic(protSynsDic, DIR, 'protSynsDic', storeFormat)
+    saveDic(protSynsRDic, DIR, 'protSynsRDic', storeFormat)
     if verbose > 0:
-        print('')
         Toc = toc(Tic)
         TicSum += Toc
-        bar.finish()
 
-    # Priming reverse look-up dictionary
+    # Verbose exit
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Priming protein synonym reverse look-up dictionary.' % str(timeStamp))
-        count = len(aliases)
-        bar = ChargingBar('', max = count)
-        Tic = tic()
-    protSynsRDic = {}
-    for alias in aliases:
-        protSynsRDic[alias] = []
-        bar.next()
-    if verbose > 0:
-        print('')
-        Toc = toc(Tic)
-        TicSum += Toc
-        bar.finish()
+        print('\n[%s] Done running \'makeProtSynsDic\' function.\nTotal elapsed time was %s (h:mm:ss)' % (str(timeStamp), str(TicSum)))
+    if not quickMode and verbose:
+        beep()
 
-    # Populate dictionaries
-    # this takes the most time. For all proteins, it takes 1 hour per percentage point.
+    return protSynsDic, protSynsRDic
+
+def makeProtSynsIndex(DIR, dataDir='STITCH Data', fname='/9606.protein.aliases.v10.5.txt', verbose=0, quickMode=False, quickModeLimit=250000, table=None, numProcs=1):
+    '''
+    Builds the protein aliases as an AliasIndex (see cpialias.py). This replaces protSynsDic and protSynsRDic of makeProtSynsDic for large species: every protein, alias and source string is stored once, both directions are flat integer arrays, and look-ups give the same (alias, source) and (protein, source) lists as the dictionaries.
+
+    INPUT:  table, numProcs, see makeProtSynsDic.
+    OUTPUT: protSynsIndex, an AliasIndex. Save it with protSynsIndex.save(DIR + 'protSynsIndex') and load it memory-mapped with AliasIndex.load.
+    '''
+    # Verbose start
     if verbose > 0:
+        TicSum = datetime.timedelta(0,0,0)
         timeStamp = ts()
-        print('\n[%s] Populating protein synonym and alias dictionaries.' % str(timeStamp))
-        count = len(protsyns)
-        bar = ChargingBar('', max = count)
-        Tic = tic()
-    for line in protsyns:
-        name, alias, source = line[0], line[1], line[2] # line format is : name alias source
-        protSynsDic[name].append((alias, source))
-        protSynsRDic[alias].append((name, source))
+        print('\n[%s] Running \'makeProtSynsIndex\' function.' % str(timeStamp))
+
+    if table is None:
+        if quickMode:
+            maxRows = getQuickModeLimit(quickModeLimit, countLines(DIR + dataDir + fname) - 1)
+        else:
+            maxRows = None
         if verbose > 0:
-            bar.next()
-    if verbose > 0:
-        bar.finish()
-        Toc = toc(Tic)
-        TicSum += Toc
+            timeStamp = ts()
+            print('\n[%s] Loading file into columns.' % str(timeStamp))
+            Tic = tic()
+        if numProcs > 1 and not quickMode:
+            table = loadColumnsParallel(DIR + dataDir + fname, numProcs=numProcs)
+        else:
+            table = loadColumns(DIR + dataDir + fname, maxRows=maxRows)
+        if verbose > 0:
+            Toc = toc(Tic)
+            TicSum += Toc
 
-    # Pickle dictionaries
+    # Build index
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Pickling dictionaries.' % str(timeStamp))
+        print('\n[%s] Building alias index.' % str(timeStamp))
         Tic = tic()
-    pname = DIR + 'protSynsDic.pickle'
-    with open(pname, 'wb') as handle:
-        pickle.dump(protSynsDic, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    pname = DIR + 'protSynsRDic.pickle'
-    with open(pname, 'wb') as handle:
-        pickle.dump(protSynsRDic, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    Toc = toc(Tic)
-    TicSum += Toc
+    protSynsIndex = AliasIndex.fromTable(table)
+    if verbose > 0:
+        Toc = toc(Tic)
+        TicSum += Toc
 
     # Verbose exit
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Done running \'makeProtSynsDic\' function.\nTotal elapsed time was %s (h:mm:ss)' % (str(timeStamp), str(TicSum)))
-    if not quickMode and verbose:
-        beep()
+        print('\n[%s] Done running \'makeProtSynsIndex\' function.\nTotal elapsed time was %s (h:mm:ss)' % (str(timeStamp), str(TicSum)))
 
-    return protSynsDic, protSynsRDic
+    return protSynsIndex
 
-def makeLinksDic(DIR, dataDir='STITCH Data/', fname='9606.actions.v5.0.tsv', verbose=0, quickMode=False, quickModeLimit=1000):
+def makeLinksDic(DIR, dataDir='STITCH Data/', fname='9606.actions.v5.0.tsv', verbose=0, quickMode=False, quickModeLimit=None, table=None, registry=None, chunkSize=2**25, numProcs=1, storeFormat='pickle', sampleMode=None):
     '''
     'links' means interactions.
 
-    Inputs (5):
+    The actions file is read chunk by chunk (see cpiio.iterColumns) and the dictionaries are filled in a single pass, so the rows of the file are never all in memory at once.
+
+    Inputs (10):
       1. fname,
       2. DIR,
       3. verbose,
       4. quickMode,
-      5. quickModeLimit,
+      5. quickModeLimit, with quickMode, the number of rows to read, or the fraction of the rows if it is a float (see getQuickModeLimit). Defaults to 1000 rows, or to a .01 fraction of the pairs with sampleMode='hash'.
+      6. table, optional. The actions file as returned by cpiio.loadColumns. If not given, the file at DIR + dataDir + fname is streamed.
+      7. registry, optional. An IdRegistry (see cpiids.py). If given, CIDs and proteins are stored as integer codes instead of strings.
+      8. chunkSize, the number of bytes read per chunk.
+      9. numProcs, the number of processes. If greater than 1, the file is parsed in parallel shards (see cpiio.loadColumnsParallel) and the merged columns are used as 'table'.
+      10. storeFormat, 'pickle' or 'mapped'. The format the dictionaries are saved in (see saveDic).
+      11. sampleMode, optional. With quickMode, uses a random sample of the file instead of its first 'quickModeLimit' rows (see cpisample.py). 'hash' keeps both directions of a fraction 'quickModeLimit' of the (A, B) pairs, 'reservoir' and 'offsets' keep 'quickModeLimit' rows.
 
     Output (3):
-      Saves three dictionary objects as pickles.
+      Saves three dictionary objects as pickles, or in the memory-mapped format.
       1. ptocDic,
       2. ctopDic,
       3. pairsToLinksDic,
@@ -724,142 +832,327 @@ def makeLinksDic(DIR, dataDir='STITCH Data/', fname='9606.actions.v5.0.tsv', ver
     TicSum = datetime.timedelta(0,0,0)
 
     timeStamp = ts()
-    print('\n[%s] Running prototype for \'makeLinksDic\' function.' % str(timeStamp))
+    print('\n[%s] Running \'makeLinksDic\' function.' % str(timeStamp))
+    if quickModeLimit is None:
+        if sampleMode == 'hash':
+            quickModeLimit = .01
+        else:
+            quickModeLimit = 1000
 
-    # Load file
-    listOfLinks = loadFile(DIR, dataDir, fname, withHeaders=False, verbose=verbose, quickMode=quickMode, quickModeLimit = quickModeLimit)
+    # Parallel mode
+    if table is None and numProcs > 1 and not quickMode:
+        if verbose > 0:
+            timeStamp = ts()
+            print('\n[%s] Parsing file with %d processes.' % (str(timeStamp), numProcs))
+            Tic = tic()
+        table = loadColumnsParallel(DIR + dataDir + fname, dtypes=ACTIONS_DTYPES, numProcs=numProcs, chunkSize=chunkSize)
+        if verbose > 0:
+            Toc = toc(Tic)
+            TicSum += Toc
 
-    # Create set of proteins, CIDs, and links
+    # Sample
+    if table is None and quickMode and sampleMode is not None:
+        table, sampleInfo = loadSample(DIR + dataDir + fname, sampleMode, getSampleSize(DIR + dataDir + fname, sampleMode, quickModeLimit), dtypes=ACTIONS_DTYPES, keyColumns=['item_id_a', 'item_id_b'])
+        if verbose > 0:
+            timeStamp = ts()
+            print('\n[%s] Sampled %d of %d rows (%0.2f%%) with the \'%s\' method.' % (str(timeStamp), sampleInfo['numRows'], sampleInfo['totalRows'], 100 * sampleInfo['fraction'], sampleMode))
+
+    # Chunk generator
+    if table is None:
+        if quickMode:
+            maxRows = getQuickModeLimit(quickModeLimit, countLines(DIR + dataDir + fname) - 1)
+        else:
+            maxRows = None
+        vocab = {}
+        dtypes = ACTIONS_DTYPES
+        chunks = iterColumns(DIR + dataDir + fname, dtypes=dtypes, vocab=vocab, chunkSize=chunkSize, maxRows=maxRows)
+    else:
+        vocab = table['vocab']
+        chunks = [table['columns']]
+
+    # Identifiers are kept as strings, or as integer codes if a registry is given
+    if registry is None:
+        encode = str
+    else:
+        encode = registry.encode
+
+    # Populate dictionaries
     if verbose > 0:
         timeStamp = ts()
-        text = '\n[%s] Creating sets of protein names, CIDs, CID-protein pairs, and interaction types (links).' % str(timeStamp)
-        print(text)
-        count = len(listOfLinks)
-        bar = ChargingBar('', max = count)
+        print('\n[%s] Populating protein-to-CIDs, CID-to-proteins, and (CID-protein pair)-to-(link type) dictionaries.' % str(timeStamp))
+        spinner = Spinner('')
         Tic = tic()
-    setProts = []
-    setCids = []
-    setPairs = []
-    setLinks = []
-    for line in listOfLinks:
-        A, B, link, action, bool, score = line[0], line[1], line[2], line[3], line[4], line[5]
-        if isCid(A):
-            setCids.append(A)
-        else:
-            setProts.append(A)
-        setPairs.append((A,B))
-        setLinks.append(link)
+    ctopDic = {}
+    ptocDic = {}
+    pairsToLinksDic = {}
+    labels = np.empty(0, dtype=object) # vocabulary code --> string
+    ids = np.empty(0, dtype=object) # vocabulary code --> stored identifier, None until first used as an identifier
+    idIsCid = np.empty(0, dtype=np.bool_)
+    scoreStrings = np.empty(0, dtype=object)
+    for chunk in chunks:
+
+        # Grow the look-up arrays with the strings first seen in this chunk
+        if len(labels) < len(vocab):
+            newLabels = np.array(list(itertools.islice(vocab, len(labels), None)), dtype=object)
+            labels = np.concatenate([labels, newLabels])
+            ids = np.concatenate([ids, np.full(len(newLabels), None, dtype=object)])
+            idIsCid = np.concatenate([idIsCid, np.zeros(len(newLabels), dtype=np.bool_)])
+        columnA, columnB = chunk['item_id_a'], chunk['item_id_b']
+        used = np.unique(np.concatenate([columnA, columnB]))
+        for code in used[np.equal(ids[used], None)].tolist():
+            ids[code] = encode(labels[code])
+            idIsCid[code] = isCid(labels[code])
+
+        scores = chunk['score']
+        if scores.max(initial=0) >= len(scoreStrings):
+            scoreStrings = np.array([str(score) for score in range(scores.max() + 1)], dtype=object)
+
+        columns = [ids[columnA].tolist(), ids[columnB].tolist()]
+        columns.extend([labels[chunk[name]].tolist() for name in ['mode', 'action', 'a_is_acting']])
+        columns.append(scoreStrings[scores].tolist())
+        columns.append(idIsCid[columnA].tolist())
+        for A, B, link, action, bool, score, AIsCid in zip(*columns):
+            if AIsCid:
+                try:
+                    ctopDic[A].append(B)
+                except KeyError:
+                    ctopDic[A] = [B]
+            else:
+                try:
+                    ptocDic[A].append(B)
+                except KeyError:
+                    ptocDic[A] = [B]
+            try:
+                pairsToLinksDic[(A,B)].append((link, action, bool, score))
+            except KeyError:
+                pairsToLinksDic[(A,B)] = [(link, action, bool, score)]
         if verbose > 0:
-            bar.next()
-    setProts = set(setProts)
-    setCids = set(setCids)
-    setPairs = set(setPairs)
-    setLinks = set(setLinks)
+            spinner.next()
     if verbose > 0:
-        bar.finish()
+        spinner.finish()
         Toc = toc(Tic)
         TicSum += Toc
 
-    # Prime protein-to-CID dictionary
+    # Save dictionaries
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Priming protein-to-CID dictionary.' % str(timeStamp))
-        count = len(setProts)
-        bar = ChargingBar('', max = count)
+        print('\n[%s] Saving dictionaries.' % str(timeStamp))
         Tic = tic()
-    ptocDic = {}
-    for prot in setProts:
-        ptocDic[prot] = []
-        if verbose > 0:
-            bar.next()
+    saveDic(ptocDic, DIR, 'ptocDic', storeFormat)
+    saveDic(ctopDic, DIR, 'ctopDic', storeFormat)
+    saveDic(pairsToLinksDic, DIR, 'pairsToLinksDic', storeFormat)
     if verbose > 0:
-        print('')
         Toc = toc(Tic)
         TicSum += Toc
-        bar.finish()
 
-    # Prime CID-to-proteins dictionary
+    # Verbose exit
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Priming CID-to-proteins dictionary.' % str(timeStamp))
-        count = len(setCids)
-        bar = ChargingBar('', max = count)
+        print('\n[%s] Done running \'makeLinksDic\' function.\nTotal elapsed time was %s (h:mm:ss)\nPeak memory use was %0.1f MB' % (str(timeStamp), str(TicSum), getPeakMemory() / 2**20))
+    if not quickMode and verbose:
+        beep()
+
+    # Return statement
+    return ctopDic, ptocDic, pairsToLinksDic
+
+
+def makeLinksTable(DIR, dataDir, outDir, fname='9606.actions.v5.0.tsv', verbose=0, quickMode=False, quickModeLimit=1000, registry=None, numProcs=1):
+    '''
+    Builds the actions file as a LinksTable (see cpitable.py), the columnar version of pairsToLinksDic of makeLinksDic. Filtered queries on mode, score, action and a_is_acting are vectorized instead of a loop over every tuple of pairsToLinksDic.
+
+    INPUT:  registry, an IdRegistry, optional. A new one is made if not given.
+            numProcs, the number of processes used to parse the file (see cpiio.loadColumnsParallel).
+    OUTPUT: linksTable, a LinksTable. Save it with linksTable.save(outDir + '9606linksTable') and load it memory-mapped with LinksTable.load.
+            registry, the IdRegistry used to encode the CIDs and proteins of linksTable.
+    '''
+    # verbose start
+    if verbose > 0:
+        timeStamp = ts()
+        print('\n[%s] Running \'makeLinksTable\' function.' % str(timeStamp))
+        TicSum = datetime.timedelta(0,0,0)
         Tic = tic()
-    ctopDic = {}
-    for cid in setCids:
-        ctopDic[cid] = []
-        bar.next()
+    fpath = dataDir + fname
+    if registry is None:
+        registry = IdRegistry()
+
+    # Load file
+    if quickMode:
+        maxRows = getQuickModeLimit(quickModeLimit, countLines(fpath) - 1)
+        table = loadColumns(fpath, dtypes=ACTIONS_DTYPES, maxRows=maxRows)
+    elif numProcs > 1:
+        table = loadColumnsParallel(fpath, dtypes=ACTIONS_DTYPES, numProcs=numProcs)
+    else:
+        table = loadColumns(fpath, dtypes=ACTIONS_DTYPES)
     if verbose > 0:
-        print('')
         Toc = toc(Tic)
         TicSum += Toc
-        bar.finish()
 
-    # Prime (CID-protein pair)-to-(link type) dictionary
+    # Build table
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Priming (CID-protein pair)-to-(link type) dictionary.' % str(timeStamp))
-        count = len(setPairs)
-        bar = ChargingBar('', max = count)
+        print('\n[%s] Building links table.' % str(timeStamp))
         Tic = tic()
-    pairsToLinksDic = {}
-    for pair in setPairs:
-        pairsToLinksDic[pair] = []
-        bar.next()
+    linksTable = LinksTable.fromTable(table, registry)
     if verbose > 0:
-        print('')
         Toc = toc(Tic)
         TicSum += Toc
-        bar.finish()
 
-    # Populate dictionaries
+    # Verbose finish
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Populating protein-to-CIDs and CID-to-proteins dictionaries.' % str(timeStamp))
-        count = len(listOfLinks)
-        bar = ChargingBar('', max = count)
+        print('\n[%s] Done running \'makeLinksTable\' function.\nTotal elapsed time was %s (h:mm:ss)\nPeak memory use was %0.1f MB' % (str(timeStamp), str(TicSum), getPeakMemory() / 2**20))
+
+    return linksTable, registry
+
+def getDicEntries(builder, table, registry=None):
+    '''
+    Returns the entries that the rows of a table add to the dictionaries of an incremental builder (see makeDicsIncremental), as { dicName : (keys, values) }. The entries are the same, and in the same order, as those added by makeCpiDic, makeLinksDic and makeProtSynsDic.
+    '''
+    if builder == 'cpi':
+        cids, prots = getChemProtColumns(table, registry)
+        cids, prots = cids.tolist(), prots.tolist()
+        return {'cpiDic': (cids, prots), 'cpiRDic': (prots, cids)}
+    elif builder == 'links':
+        names = ['item_id_a', 'item_id_b']
+        if registry is None:
+            A, B = [decodeColumn(table, name).tolist() for name in names]
+        else:
+            ids = registry.encodeVocab(table, names)
+            A, B = [ids[name].tolist() for name in names]
+        labelIsCid = np.fromiter((isCid(label) for label in table['vocab']), dtype=np.bool_, count=len(table['vocab']))
+        AIsCid = labelIsCid[table['columns']['item_id_a']]
+        links = list(zip(*[decodeColumn(table, name).tolist() for name in ['mode', 'action', 'a_is_acting']], [str(score) for score in table['columns']['score'].tolist()]))
+        ctop, ptoc = np.flatnonzero(AIsCid).tolist(), np.flatnonzero(~AIsCid).tolist()
+        return {'ctopDic': ([A[i] for i in ctop], [B[i] for i in ctop]),
+                'ptocDic': ([A[i] for i in ptoc], [B[i] for i in ptoc]),
+                'pairsToLinksDic': (list(zip(A, B)), links)}
+    elif builder == 'protSyns':
+        names, aliases, sources = [decodeColumn(table, name).tolist() for name in table['header'][:3]]
+        if registry is not None:
+            name = table['header'][0]
+            names = registry.encodeVocab(table, [name])[name].tolist()
+        return {'protSynsDic': (names, list(zip(aliases, sources))), 'protSynsRDic': (aliases, list(zip(names, sources)))}
+    else:
+        raise ValueError('builder must be one of %s, not %s.' % (', '.join(INCREMENTAL_BUILDERS), builder))
+
+def makeDicsIncremental(DIR, dataDir, fname, builder='cpi', verbose=0, registry=None, storeFormat='pickle', avgChunkLines=4096):
+    '''
+    Builds the dictionaries of 'builder' from the file DIR + dataDir + fname, or updates the dictionaries of the last build by reprocessing only the parts of the file that changed (see cpidelta.py).
+
+    builder   | input file                      | dictionaries
+    ============================================================================
+    cpi       | 9606.protein_chemical.links.tsv | cpiDic, cpiRDic
+    links     | 9606.actions.tsv                | ctopDic, ptocDic, pairsToLinksDic
+    protSyns  | 9606.protein.aliases.txt        | protSynsDic, protSynsRDic
+
+    The first run parses the whole file. Later runs, after an edit of the file or with the file of a new release, load the saved dictionaries, take out the rows of the chunks that are gone, put in the rows of the new chunks, and save the dictionaries again. Every key has the same values as after a full rebuild, though not always in the same order.
+
+    The dictionaries are saved to DIR + builder + 'Dics/', not to DIR like those of makeCpiDic, makeLinksDic and makeProtSynsDic, so that a full or quickMode build into DIR does not change the dictionaries the next update starts from. Load them with loadDic(DIR + builder + 'Dics/', dicName). The build manifest is saved to DIR + builder + 'Manifest.json' and the chunks of the file to DIR + builder + 'Chunks/'. If the saved dictionaries do not match the manifest anyway, e.g. they were replaced by hand, a row of a removed chunk is not found in them, and they are rebuilt from the whole file.
+
+    INPUT:  registry, an IdRegistry, optional. It must be the same registry for every build (see IdRegistry.save and IdRegistry.load).
+            storeFormat, a string, 'pickle' or 'mapped' (see saveDic).
+            avgChunkLines, integer, the average number of lines per chunk. Smaller chunks reprocess less around an edit, but make more files.
+    OUTPUT: dics, a dictionary { dicName : dic }
+    '''
+    # Verbose start
+    if verbose > 0:
+        TicSum = datetime.timedelta(0,0,0)
+        timeStamp = ts()
+        print('\n[%s] Running \'makeDicsIncremental\' function.' % str(timeStamp))
         Tic = tic()
-    for line in listOfLinks:
-        A, B, link, action, bool, score = line[0], line[1], line[2], line[3], line[4], line[5]
-        if isCid(A):
-            ctopDic[A].append(B)
+    dicNames, dtypes = INCREMENTAL_BUILDERS[builder]
+    fpath = DIR + dataDir + fname
+    manifestPath = DIR + builder + 'Manifest.json'
+    dicDir = DIR + builder + 'Dics/'
+    os.makedirs(dicDir, exist_ok=True)
+    store = ChunkStore(DIR + builder + 'Chunks')
+
+    # Fingerprint file
+    newManifest = fingerprintFile(fpath, avgChunkLines)
+    oldManifest = loadManifest(manifestPath)
+    if oldManifest is not None and not all(os.path.exists(dicDir + dicName + '.pickle') or os.path.isdir(dicDir + dicName) for dicName in dicNames):
+        oldManifest = None
+    if oldManifest is not None and oldManifest['header'] != newManifest['header']:
+        oldManifest = None # iterDelta adds every chunk of a file with a new header, so start from empty dictionaries
+
+    # Previous dictionaries
+    dics = {}
+    for dicName in dicNames:
+        if oldManifest is None:
+            dics[dicName] = {}
         else:
-            ptocDic[A].append(B)
-        pairsToLinksDic[(A,B)].append((link, action, bool, score))
-        if verbose > 0:
-            bar.next()
+            dic = loadDic(dicDir, dicName)
+            if isinstance(dic, MappedDic):
+                dic = dic.toDic()
+            dics[dicName] = dic
     if verbose > 0:
-        bar.finish()
         Toc = toc(Tic)
         TicSum += Toc
 
-    # Pickle dictionaries
+    # Apply changes
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Pickling dictionaries.' % str(timeStamp))
+        if oldManifest is None:
+            print('\n[%s] No previous build, processing all %d chunks.' % (str(timeStamp), len(newManifest['chunks'])))
+        else:
+            removed, added = diffManifests(oldManifest, newManifest)
+            print('\n[%s] %d of %d chunks changed: %d removed, %d added.' % (str(timeStamp), len(added), len(newManifest['chunks']), len(removed), len(added)))
+        spinner = Spinner('')
         Tic = tic()
-    pname = DIR + 'ptocDic.pickle'
-    with open(pname, 'wb') as handle:
-        pickle.dump(ptocDic, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    pname = DIR + 'ctopDic.pickle'
-    with open(pname, 'wb') as handle:
-        pickle.dump(ctopDic, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    pname = DIR + 'pairsToLinksDic.pickle'
-    with open(pname, 'wb') as handle:
-        pickle.dump(pairsToLinksDic, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    Toc = toc(Tic)
-    TicSum += Toc
+    def applyDelta(oldManifest):
+        numRows = {-1: 0, 1: 0}
+        for sign, table in iterDelta(fpath, oldManifest, newManifest, store, dtypes):
+            numRows[sign] += len(table['columns'][table['header'][0]])
+            for dicName, (keys, values) in getDicEntries(builder, table, registry).items():
+                applyEntries(dics[dicName], keys, values, sign)
+            if verbose > 0:
+                spinner.next()
+        return numRows
+    try:
+        numRows = applyDelta(oldManifest)
+    except (KeyError, ValueError) as error:
+        if oldManifest is None:
+            raise
+        # A removed row is not in the saved dictionaries, so they were not built from the chunks of the manifest
+        timeStamp = ts()
+        print('\n[%s] The saved dictionaries do not match the last build (%s: %s). Rebuilding them from the whole file.' % (str(timeStamp), type(error).__name__, error))
+        oldManifest = None
+        dics = {dicName: {} for dicName in dicNames}
+        numRows = applyDelta(oldManifest)
+    if verbose > 0:
+        spinner.finish()
+        print('\nRows removed: %d, rows added: %d' % (numRows[-1], numRows[1]))
+        Toc = toc(Tic)
+        TicSum += Toc
 
-    # Verbose exit
+    # Nothing to save if the file has not changed
+    if oldManifest is not None and numRows[-1] == 0 and numRows[1] == 0 and oldManifest['chunks'] == newManifest['chunks']:
+        if verbose > 0:
+            timeStamp = ts()
+            print('\n[%s] Done running \'makeDicsIncremental\' function, the file has not changed.\nTotal elapsed time was %s (h:mm:ss)' % (str(timeStamp), str(TicSum)))
+        return dics
+
+    # Save dictionaries and manifest. The old manifest is removed first, so an interrupted save leads to a full rebuild next time.
     if verbose > 0:
         timeStamp = ts()
-        print('\n[%s] Done running \'makeProtSynsDic\' function.\nTotal elapsed time was %s (h:mm:ss)' % (str(timeStamp), str(TicSum)))
-    if not quickMode and verbose:
-        beep()
+        print('\n[%s] Saving dictionaries.' % str(timeStamp))
+        Tic = tic()
+    if os.path.exists(manifestPath):
+        os.remove(manifestPath)
+    for dicName in dicNames:
+        saveDic(dics[dicName], dicDir, dicName, storeFormat)
+    saveManifest(newManifest, manifestPath, builder=builder, dics=dicNames, rowsRemoved=numRows[-1], rowsAdded=numRows[1])
+    store.prune(chunk[2] for chunk in newManifest['chunks'])
+    if verbose > 0:
+        Toc = toc(Tic)
+        TicSum += Toc
 
-    # Return statement
-    return ctopDic, ptocDic, pairsToLinksDic
+    # Verbose exit
+    if verbose > 0:
+        timeStamp = ts()
+        print('\n[%s] Done running \'makeDicsIncremental\' function.\nTotal elapsed time was %s (h:mm:ss)' % (str(timeStamp), str(TicSum)))
 
+    return dics
 
 '''
 ################################################################################
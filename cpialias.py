@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+from cpistore import makeStringTable, StringTable
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpialias.py
+
+File Description
+----------------
+
+    Compact index of the STRING protein aliases file.
+
+    'makeProtSynsDic' stores an (alias, source) tuple per row in protSynsDic and a (protein, source) tuple per row in protSynsRDic. For the human file that is tens of millions of tuples, and long source strings like 'BLAST_UniProt_DE Ensembl_HGNC_UniProt_ID(supplied_by_UniProt)_DE' are referenced from every one of them. An AliasIndex instead stores every protein, alias and source string once, in three interned string tables, and the rows as integer codes into those tables:
+
+        prots   = ['9606.ENSP00000000233', '9606.ENSP00000000412', ...]    # sorted
+        aliases = ['(2E,6E)-farnesyl diphosphate synthase', 'A1BG', ...]   # sorted
+        sources = ['BLAST_UniProt_DE Ensembl_UniProt_DE', 'Ensembl_EntrezGene', ...]
+
+        indptr      = [0, 3, 5, ...]   # aliases of prots[i] are rows indptr[i]:indptr[i+1]
+        aliasCodes  = [7, 1, 9, ...]   # codes into 'aliases'
+        sourceCodes = [0, 1, 0, ...]   # codes into 'sources'
+
+    and the same in the reverse direction, from aliases to proteins. Rows keep the order of the file. Each row costs 16 bytes, and the string tables are small, so the whole human aliases file fits in a fraction of the memory of the dictionaries.
+'''
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def internColumn(table, name):
+    '''
+    Returns the sorted distinct strings of a 'code' column of a table made by cpiio.loadColumns, and the column as int32 codes into them.
+    '''
+    used, inverse = np.unique(table['columns'][name], return_inverse=True)
+    strings = np.array(table['vocab'], dtype=object)[used]
+    order = np.argsort(strings, kind='stable') # Python string order is the order of the UTF-8 bytes, which StringTable.find relies on
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    return strings[order].tolist(), rank[inverse.reshape(-1)]
+
+def groupRows(keys, numKeys):
+    '''
+    Returns the row order that groups rows by key, keeping the file order within a key, and the pointer array of the groups.
+    '''
+    order = np.argsort(keys, kind='stable')
+    indptr = np.zeros(numKeys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=numKeys), out=indptr[1:])
+    return order, indptr
+
+class AliasIndex:
+    '''
+    Protein aliases in both directions, in the format described in the module description. Look-ups return the same (alias, source) and (protein, source) lists as protSynsDic and protSynsRDic:
+
+    >>> index = AliasIndex.fromTable(loadColumns(DIR + 'STITCH Data/9606.protein.aliases.v10.5.txt'))
+    >>> index.proteins('(2E,6E)-farnesyl diphosphate synthase')
+    [('9606.ENSP00000282841', 'BLAST_UniProt_DE ...'), ('9606.ENSP00000349078', 'BLAST_UniProt_DE ...')]
+    >>> index.aliases('9606.ENSP00000282841')[:2]
+    [('FDPS', 'BLAST_KEGG_NAME ...'), ...]
+    '''
+    names = ['protOffsets', 'protBlob', 'aliasOffsets', 'aliasBlob', 'sourceOffsets', 'sourceBlob', 'indptr', 'aliasCodes', 'sourceCodes', 'rindptr', 'protCodes', 'rsourceCodes']
+
+    def __init__(self, protOffsets, protBlob, aliasOffsets, aliasBlob, sourceOffsets, sourceBlob, indptr, aliasCodes, sourceCodes, rindptr, protCodes, rsourceCodes):
+        self.protOffsets, self.protBlob = protOffsets, protBlob
+        self.aliasOffsets, self.aliasBlob = aliasOffsets, aliasBlob
+        self.sourceOffsets, self.sourceBlob = sourceOffsets, sourceBlob
+        self.indptr, self.aliasCodes, self.sourceCodes = indptr, aliasCodes, sourceCodes
+        self.rindptr, self.protCodes, self.rsourceCodes = rindptr, protCodes, rsourceCodes
+        self.protTable = StringTable(protOffsets, protBlob)
+        self.aliasTable = StringTable(aliasOffsets, aliasBlob)
+        self.sourceTable = StringTable(sourceOffsets, sourceBlob)
+
+    @classmethod
+    def fromTable(cls, table, names=None):
+        '''
+        Builds the index from the aliases file loaded by cpiio.loadColumns.
+
+        INPUT:  names, a list of three column names (protein, alias, source). Defaults to the first three columns of the table.
+        '''
+        if names is None:
+            names = table['header'][:3]
+        prots, prot = internColumn(table, names[0])
+        aliases, alias = internColumn(table, names[1])
+        sources, source = internColumn(table, names[2])
+
+        order, indptr = groupRows(prot, len(prots))
+        rorder, rindptr = groupRows(alias, len(aliases))
+
+        protOffsets, protBlob = makeStringTable(prots)
+        aliasOffsets, aliasBlob = makeStringTable(aliases)
+        sourceOffsets, sourceBlob = makeStringTable(sources)
+        return cls(protOffsets, protBlob, aliasOffsets, aliasBlob, sourceOffsets, sourceBlob, indptr, alias[order], source[order], rindptr, prot[rorder], source[rorder])
+
+    def __len__(self):
+        '''
+        Number of (protein, alias, source) rows.
+        '''
+        return len(self.aliasCodes)
+
+    def aliases(self, prot):
+        '''
+        Returns [(alias1, source1), (alias2, source2), ...] for a protein, like protSynsDic[prot]. Raises KeyError for unknown proteins.
+        '''
+        i = self.protTable.find(prot)
+        if i < 0:
+            raise KeyError(prot)
+        a, b = self.indptr[i], self.indptr[i+1]
+        return [(self.aliasTable[alias], self.sourceTable[source]) for alias, source in zip(self.aliasCodes[a:b].tolist(), self.sourceCodes[a:b].tolist())]
+
+    def proteins(self, alias):
+        '''
+        Returns [(protein1, source1), (protein2, source2), ...] for an alias, like protSynsRDic[alias]. Raises KeyError for unknown aliases.
+        '''
+        i = self.aliasTable.find(alias)
+        if i < 0:
+            raise KeyError(alias)
+        a, b = self.rindptr[i], self.rindptr[i+1]
+        return [(self.protTable[prot], self.sourceTable[source]) for prot, source in zip(self.protCodes[a:b].tolist(), self.rsourceCodes[a:b].tolist())]
+
+    def toDics(self):
+        '''
+        Returns the index as the dictionaries made by makeProtSynsDic, (protSynsDic, protSynsRDic). Meant for small files and for checking results.
+        '''
+        protSynsDic = {self.protTable[i]: self.aliases(self.protTable[i]) for i in range(len(self.protTable))}
+        protSynsRDic = {self.aliasTable[i]: self.proteins(self.aliasTable[i]) for i in range(len(self.aliasTable))}
+        return protSynsDic, protSynsRDic
+
+    def save(self, dirPath):
+        '''
+        Saves each array to 'dirPath' as a .npy file.
+        '''
+        os.makedirs(dirPath, exist_ok=True)
+        for name in self.names:
+            np.save(os.path.join(dirPath, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, dirPath, mmap=True):
+        '''
+        Loads an index saved with 'save', memory-mapped read-only if mmap=True (see CsrGraph.load).
+        '''
+        if mmap:
+            mmapMode = 'r'
+        else:
+            mmapMode = None
+        arrays = [np.load(os.path.join(dirPath, name + '.npy'), mmap_mode=mmapMode) for name in cls.names]
+        return cls(*arrays)
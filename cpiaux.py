@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import datetime, json, os, pickle, re, requests, sys, traceback
+import datetime, itertools, json, os, pickle, re, requests, sys, traceback
 import matplotlib.pyplot as plt
 import numpy as np
 from bs4 import BeautifulSoup
+from cpihash import mixHash
+from cpiids import cidNumber, isStereo, makeCidCode
 from IPython import get_ipython
 from mlFunctions import tic, toc, beep, ts, alarm1, run_from_ipython, getNumLines
 from progress.bar import ChargingBar
@@ -82,11 +84,13 @@ def getName(element):
     OR
     forward         | alias1
     reverse         | entity
+
+    Other values, like the integer codes of dictionaries built with an IdRegistry, are returned as they are.
     '''
-    if isinstance(element, str):
-        return element
-    elif isinstance(element, (tuple, list)):
+    if isinstance(element, (tuple, list)):
         return element[0]
+    else:
+        return element
 
 def checkDics(DIR, dic1name='protSynsDic', dic2name='ptocDic', elements='keys'):
     '''
@@ -120,9 +124,13 @@ def testDicCompleteness(forwardDic, reverseDic, quickMode=0, quickModeLimit=20):
     See if all entity aliases in forwardDic map back to entity using the reverseDic. Pictorially:
     forwardDic[entity] --> alias
     reverseDic[alias] --> entity
+
+    quickMode 0 checks every entry with verifyDics, prints the report and returns it. testDicCompleteness_full is the older check, which asks what to do after every failed look-up.
     '''
     if quickMode == 0:
-        testDicCompleteness_full(forwardDic, reverseDic)
+        report = verifyDics(forwardDic, reverseDic)
+        printDicReport(report)
+        return report
     elif quickMode == 1:
         testDicCompleteness_med(forwardDic, reverseDic, quickModeLimit)
     elif quickMode == 2:
@@ -259,6 +267,86 @@ def testDicCompleteness_full(forwardDic, reverseDic):
     else:
         print('Warning. The dictionaries failed some forward or reverse lookups.')
 
+def asList(value):
+    '''
+    Dictionary values are lists, except in dictionaries that store a single value as is, like chemSynsRDic.
+    '''
+    if isinstance(value, list):
+        return value
+    return [value]
+
+def internPairs(dic, keyVocab, valueVocab):
+    '''
+    Interns the keys of a dictionary and the names (see getName) of its values. 'keyVocab' and 'valueVocab' are dictionaries { string : code }, updated in place. Returns parallel int64 arrays of key codes and value codes, one entry per value, and the codes of the keys.
+    '''
+    keys = list(dic.keys())
+    values = [asList(value) for value in dic.values()]
+    keyCodes = np.fromiter((keyVocab.setdefault(key, len(keyVocab)) for key in keys), dtype=np.int64, count=len(keys))
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    valueCodes = np.fromiter((valueVocab.setdefault(name, len(valueVocab)) for name in map(getName, itertools.chain.from_iterable(values))), dtype=np.int64, count=int(lengths.sum()))
+    return np.repeat(keyCodes, lengths), valueCodes, keyCodes
+
+def verifyDics(forwardDic, reverseDic, sampleSize=10):
+    '''
+    Checks that a forward dictionary { entity : [alias1, alias2, ...] } and its reverse dictionary { alias : [entity1, entity2, ...] } agree, for example ctopDic and ptocDic, protSynsDic and protSynsRDic, or chemSynsDic and chemSynsRDic. Never asks for input, so it can run in batch jobs.
+
+    Every (entity, alias) pair of the forward dictionary should be in the reverse dictionary as (alias, entity), and the other way around. Entities and aliases are interned as integers, and the pairs missing in each direction are found with set operations on integer arrays, not by a look-up per entity.
+
+    OUTPUT: report, a dictionary
+
+        {'complete' : True if both directions agree,
+         'forward'  : {'numKeys'             : number of entities,
+                       'numValues'           : number of aliases of all entities,
+                       'numMisses'           : number of distinct (entity, alias) pairs that do not map back,
+                       'numMissingKeys'      : number of distinct aliases that are not keys of reverseDic at all,
+                       'samples'             : up to 'sampleSize' (entity, alias) pairs that do not map back,
+                       'missingKeySamples'   : up to 'sampleSize' aliases that are not keys of reverseDic},
+         'reverse'  : the same for reverseDic, with (alias, entity) pairs}
+    '''
+    entityVocab = {}
+    aliasVocab = {}
+    fEntities, fAliases, fKeys = internPairs(forwardDic, entityVocab, aliasVocab)
+    rAliases, rEntities, rKeys = internPairs(reverseDic, aliasVocab, entityVocab)
+    numAliases = max(len(aliasVocab), 1)
+    forwardPairs = np.unique(fEntities * numAliases + fAliases)
+    reversePairs = np.unique(rEntities * numAliases + rAliases)
+    entities = list(entityVocab)
+    aliases = list(aliasVocab)
+
+    def getReport(misses, numKeys, numValues, missesByKey, otherKeys, decodeKey, decodeValue):
+        keyCodes, valueCodes = missesByKey(misses)
+        isOtherKey = np.zeros(len(decodeValue), dtype=np.bool_)
+        isOtherKey[otherKeys] = True
+        missingKeys = np.unique(valueCodes[~isOtherKey[valueCodes]])
+        return {'numKeys': numKeys,
+                'numValues': numValues,
+                'numMisses': len(misses),
+                'numMissingKeys': len(missingKeys),
+                'samples': [(decodeKey[key], decodeValue[value]) for key, value in zip(keyCodes[:sampleSize].tolist(), valueCodes[:sampleSize].tolist())],
+                'missingKeySamples': [decodeValue[value] for value in missingKeys[:sampleSize].tolist()]}
+
+    forwardMisses = np.setdiff1d(forwardPairs, reversePairs, assume_unique=True)
+    reverseMisses = np.setdiff1d(reversePairs, forwardPairs, assume_unique=True)
+    report = {'complete': len(forwardMisses) == 0 and len(reverseMisses) == 0,
+              'forward': getReport(forwardMisses, len(fKeys), len(fAliases), lambda pairs: (pairs // numAliases, pairs % numAliases), rKeys, entities, aliases),
+              'reverse': getReport(reverseMisses, len(rKeys), len(rEntities), lambda pairs: (pairs % numAliases, pairs // numAliases), fKeys, aliases, entities)}
+    return report
+
+def printDicReport(report):
+    '''
+    Prints a report made by verifyDics.
+    '''
+    for direction, other in [('forward', 'reverse'), ('reverse', 'forward')]:
+        r = report[direction]
+        print('\nThe %s look-up dictionary has %d entries with %d values.' % (direction, r['numKeys'], r['numValues']))
+        print('%d look-ups failed. %d values are not keys of the %s dictionary.' % (r['numMisses'], r['numMissingKeys'], other))
+        for key, value in r['samples']:
+            print('\t%s --> %s does not map back' % (key, value))
+    if report['complete']:
+        print('The tested dictionaries are complete in both the forward and backward directions.')
+    else:
+        print('Warning. The dictionaries failed some forward or reverse lookups.')
+
 # Test if values for s and m keys are same
 
 def getCidSet(cpiDic):
@@ -357,6 +445,64 @@ def countCidTypes(cpiDic):
 
     return a and b and c
 
+def getOverlap(bag1, bag2):
+    '''
+    Number of CIDs in both bags. Bags are sets of CID strings (getCidBags) or sorted arrays of CID numbers (getCidBagsVectorized).
+    '''
+    if isinstance(bag1, set):
+        return len(bag1 & bag2)
+    else:
+        return len(np.intersect1d(bag1, bag2, assume_unique=True))
+
+def printCidBagSummary(mseqbag, msbag, mbag, sbag, counts, lcs, verbose=1):
+    '''
+    Prints the quality control information and summary tables of getCidBags and getCidBagsVectorized. 'counts' is the tuple (mseq, ms0, m1, s1, ms1) and 'lcs' the number of CID numbers.
+    '''
+    mseq, ms0, m1, s1, ms1 = counts
+    d = lcs - mseq
+
+    # QC
+    if verbose > 0:
+        nmseqm = getOverlap(mseqbag, mbag)
+        nmseqs = getOverlap(mseqbag, sbag)
+        nmseqms = getOverlap(mseqbag, msbag)
+        nms = getOverlap(mbag, sbag)
+        nmms = getOverlap(mbag, msbag)
+        nsms = getOverlap(sbag, msbag)
+        text = '\nintersection of mseqbag and mbag: {}'.format(nmseqm) + \
+               '\nintersection of mseqbag and sbag: {}'.format(nmseqs) + \
+               '\nintersection of mseqbag and msbag: {}'.format(nmseqms) + \
+               '\nintersection of mbag and sbag: {}'.format(nms) + \
+               '\nintersection of mbag and msbag: {}'.format(nmms) + \
+               '\nintersection of sbag and msbag: {}'.format(nsms)
+        print(text)
+
+    # More QC
+    if verbose > 0:
+        print('')
+        print('len(mseqbag) == mseq # {}'.format(len(mseqbag) == mseq))
+        print('len(mbag) == lcs - (mseq + s1 + ms0 + ms1) # {}'.format(len(mbag) == lcs - (mseq + s1 + ms0 + ms1)))
+        print('len(sbag) == lcs - (mseq + m1 + ms0 + ms1) # {}'.format(len(sbag) == lcs - (mseq + m1 + ms0 + ms1)))
+        print('len(msbag) == lcs - (mseq + m1 + s1 + ms0) # {}'.format(len(msbag) == lcs - (mseq + m1 + s1 + ms0)))
+
+    # Summary
+    text = '\n{mseq:>8} | {lcs:>8} | {d:>8} | {mseq} CID numbers out of {lcs}, or {pcnt:.1%}, have equivalent m and s results. That means {d} are unique.'.format(mseq=mseq, lcs=lcs, d=d, pcnt= mseq/lcs)
+    print(text)
+
+    text1 = '\n\
+             Table illustrating the possible values and combinations of m and s-type CID numbers:\n\
+             _______________________________________________________________\n\
+             {:>8} {:>8} | {:>8} | {:>8} | {:>8} | {:>8} |\n\
+             {:>8} {:>8} | {:>8} | {:>8} | {:>8} | {:>8} |\n\n\
+             Table with results of counting each of the above cases\n\
+             _______________________________________________________________\n\
+             {:>8} {:>8} | {:>8} | {:>8} | {:>8} | {:>8} |\n\
+             {:>8} {:>8} | {:>8} | {:>8} | {:>8} | {:>8} |'.format('m:','x','None','x','None','x',\
+                                                                   's:','x','None','None','x','y',\
+                                                                   'var:','mseq','ms0','m1','s1','ms1',\
+                                                                   'count:',str(mseq),str(ms0),str(m1),str(s1),str(ms1))
+    print(text1)
+
 def getCidBags(cpiDic, verbose=1):
     '''
     Returns 4 sets of CID numbers. Each set represents the possible relationship between a CID's m or s label and the proteins it's associated with. The sets are summarized in the table below. Also prints summary tables describing the contents of the bags, and some quality control information to make sure bags were correctly made.
@@ -405,53 +551,127 @@ def getCidBags(cpiDic, verbose=1):
             msbag.add(cid)
             ms1 += 1
     lcs = len(cidSet)
-    d = lcs - mseq
+    printCidBagSummary(mseqbag, msbag, mbag, sbag, (mseq, ms0, m1, s1, ms1), lcs, verbose)
 
-    # QC
-    if verbose > 0:
-        u = set.union(mseqbag, mbag, sbag, msbag)
-        nmseqm = len(set.intersection(mseqbag, mbag))
-        nmseqs = len(set.intersection(mseqbag, sbag))
-        nmseqms = len(set.intersection(mseqbag, msbag))
-        nms = len(set.intersection(mbag, sbag))
-        nmms = len(set.intersection(mbag, msbag))
-        nsms =len(set.intersection(sbag, msbag))
-        text = '\nintersection of mseqbag and mbag: {}'.format(nmseqm) + \
-               '\nintersection of mseqbag and sbag: {}'.format(nmseqs) + \
-               '\nintersection of mseqbag and msbag: {}'.format(nmseqms) + \
-               '\nintersection of mbag and sbag: {}'.format(nms) + \
-               '\nintersection of mbag and msbag: {}'.format(nmms) + \
-               '\nintersection of sbag and msbag: {}'.format(nsms)
-        print(text)
+    return mseqbag, msbag, mbag, sbag
 
-    # More QC
-    if verbose > 0:
-        print('')
-        print('len(mseqbag) == mseq # {}'.format(len(mseqbag) == mseq))
-        print('len(mbag) == lcs - (mseq + s1 + ms0 + ms1) # {}'.format(len(mbag) == lcs - (mseq + s1 + ms0 + ms1)))
-        print('len(sbag) == lcs - (mseq + m1 + ms0 + ms1) # {}'.format(len(sbag) == lcs - (mseq + m1 + ms0 + ms1)))
-        print('len(msbag) == lcs - (mseq + m1 + s1 + ms0) # {}'.format(len(msbag) == lcs - (mseq + m1 + s1 + ms0)))
+def parseCids(cids):
+    '''
+    ['CIDm00010461', 'CIDs00010461'] --> array([10461, 10461]), array([False, True])
 
-    # Summary
-    text = '\n{mseq:>8} | {lcs:>8} | {d:>8} | {mseq} CID numbers out of {lcs}, or {pcnt:.1%}, have equivalent m and s results. That means {d} are unique.'.format(mseq=mseq, lcs=lcs, d=d, pcnt= mseq/lcs)
-    print(text)
+    STITCH CIDs all have 8 digits, so the strings are parsed as one block of bytes. Other lengths are parsed one by one.
+    '''
+    lengths = np.fromiter(map(len, cids), dtype=np.int64, count=len(cids))
+    if len(cids) > 0 and np.all(lengths == lengths[0]):
+        chars = np.frombuffer(''.join(cids).encode('ascii'), dtype=np.uint8).reshape(len(cids), lengths[0])
+        digits = chars[:, 4:].astype(np.int64) - ord('0')
+        numbers = digits @ (10 ** np.arange(lengths[0] - 5, -1, -1, dtype=np.int64))
+        return numbers, chars[:, 3] == ord('s')
+    numbers = np.array([int(cid[4:]) for cid in cids], dtype=np.int64)
+    stereo = np.array([cid[3] == 's' for cid in cids], dtype=np.bool_)
+    return numbers, stereo
+
+def getCidArrays(source):
+    '''
+    Returns the CIDs of a CPI dictionary or CsrGraph as integer arrays, for getCidBagsVectorized and countCidTypesVectorized:
 
-    text1 = '\n\
-             Table illustrating the possible values and combinations of m and s-type CID numbers:\n\
-             _______________________________________________________________\n\
-             {:>8} {:>8} | {:>8} | {:>8} | {:>8} | {:>8} |\n\
-             {:>8} {:>8} | {:>8} | {:>8} | {:>8} | {:>8} |\n\n\
-             Table with results of counting each of the above cases\n\
-             _______________________________________________________________\n\
-             {:>8} {:>8} | {:>8} | {:>8} | {:>8} | {:>8} |\n\
-             {:>8} {:>8} | {:>8} | {:>8} | {:>8} | {:>8} |'.format('m:','x','None','x','None','x',\
-                                                                   's:','x','None','None','x','y',\
-                                                                   'var:','mseq','ms0','m1','s1','ms1',\
-                                                                   'count:',str(mseq),str(ms0),str(m1),str(s1),str(ms1))
-    print(text1)
+        numbers, int64 array, the CID number of every CID key, without the m or s flag
+        stereo, bool array, True for 's' CIDs, False for 'm' CIDs
+        partnerHashes, uint64 array, a hash of the proteins of every CID
 
+    'source' is a cpiDic { 'CIDm00010461' : [protein1, protein2, ...] }, a cpiDic of registry codes made with an IdRegistry (see cpiids.py), or a CsrGraph made by makeCpiGraph, whose arrays are used directly.
+
+    The hash of a CID's proteins is the sum of a 64-bit hash of each protein, mixed with their number. For a cpiDic the hash of a protein is Python's string hash, for a CsrGraph it is a hash of the protein code. It does not depend on the order of the proteins, so it is the same as hashing the sorted protein list, and two CIDs with the same proteins always have the same hash.
+    '''
+    if isinstance(source, dict):
+        keys = list(source.keys())
+        values = list(source.values())
+        if len(keys) > 0 and isinstance(keys[0], (int, np.integer)):
+            codes = np.array(keys, dtype=np.int64) # registry codes
+        else:
+            numbers, stereo = parseCids(keys)
+            codes = makeCidCode(numbers, stereo)
+        # Python's string hash is the same for equal strings within a session, which is all a comparison needs
+        partners = np.fromiter(map(hash, itertools.chain.from_iterable(values)), dtype=np.int64)
+        indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, values), dtype=np.int64, count=len(values)), out=indptr[1:])
+    else:
+        codes = np.asarray(source.cids, dtype=np.int64)
+        indptr = np.asarray(source.indptr, dtype=np.int64)
+        partners = np.asarray(source.indices, dtype=np.int64)
+    partnerHashes = getPartnerHashes(indptr, partners)
+    return cidNumber(codes), isStereo(codes), partnerHashes
+
+def getPartnerHashes(indptr, partners):
+    '''
+    Hashes the partners of every row of a CSR adjacency (indptr, partners). See getCidArrays.
+    '''
+    hashes = np.zeros(len(partners) + 1, dtype=np.uint64)
+    np.cumsum(mixHash(partners.astype(np.uint64)), out=hashes[1:]) # wraps around, which is fine for a hash
+    sums = hashes[indptr[1:]] - hashes[indptr[:-1]]
+    degrees = (indptr[1:] - indptr[:-1]).astype(np.uint64)
+    return mixHash(sums ^ mixHash(degrees))
+
+def classifyCids(numbers, stereo, partnerHashes):
+    '''
+    Splits CID numbers into the four bags of getCidBags with sorted-array joins. Returns sorted int64 arrays of CID numbers:
+
+        mseqbag, numbers with an m and an s CID with the same proteins
+        msbag, numbers with an m and an s CID with different proteins
+        mbag, numbers with only an m CID
+        sbag, numbers with only an s CID
+    '''
+    mOrder = np.argsort(numbers[~stereo], kind='stable')
+    sOrder = np.argsort(numbers[stereo], kind='stable')
+    mNumbers, mHashes = numbers[~stereo][mOrder], partnerHashes[~stereo][mOrder]
+    sNumbers, sHashes = numbers[stereo][sOrder], partnerHashes[stereo][sOrder]
+    both, mIndices, sIndices = np.intersect1d(mNumbers, sNumbers, assume_unique=True, return_indices=True)
+    same = mHashes[mIndices] == sHashes[sIndices]
+    mseqbag = both[same]
+    msbag = both[~same]
+    mbag = np.setdiff1d(mNumbers, both, assume_unique=True)
+    sbag = np.setdiff1d(sNumbers, both, assume_unique=True)
     return mseqbag, msbag, mbag, sbag
 
+def getCidBagsVectorized(source, verbose=1):
+    '''
+    Same as getCidBags, but on integer arrays (see getCidArrays and classifyCids), so it takes seconds for millions of CIDs. 'source' is a cpiDic or a CsrGraph. Prints the same tables.
+
+    Returns the bags as sorted int64 arrays of CID numbers instead of sets of strings: getCidBags gives {'00010461'} where this gives array([10461]). Proteins are compared as sets, so an m and an s CID with the same proteins in a different order are in mseqbag, where getCidBags puts them in msbag.
+    '''
+    numbers, stereo, partnerHashes = getCidArrays(source)
+    mseqbag, msbag, mbag, sbag = classifyCids(numbers, stereo, partnerHashes)
+    mseq, ms1, m1, s1 = len(mseqbag), len(msbag), len(mbag), len(sbag)
+    lcs = mseq + ms1 + m1 + s1
+    printCidBagSummary(mseqbag, msbag, mbag, sbag, (mseq, 0, m1, s1, ms1), lcs, verbose)
+
+    return mseqbag, msbag, mbag, sbag
+
+def countCidTypesVectorized(source):
+    '''
+    Same as countCidTypes, on integer arrays. 'source' is a cpiDic or a CsrGraph.
+    '''
+    numbers, stereo, partnerHashes = getCidArrays(source)
+    mCount = int(np.count_nonzero(~stereo))
+    sCount = int(np.count_nonzero(stereo))
+    tCount = len(numbers)
+    print('mCount: %d\nsCount: %d\ntotal:  %d\nmissing: %d' % (mCount, sCount, tCount, tCount - mCount - sCount))
+    mseqbag, msbag, mbag, sbag = classifyCids(numbers, stereo, partnerHashes)
+    lms = len(mseqbag) + len(msbag)
+    lm = len(mbag)
+    ls = len(sbag)
+    text = \
+    '%d | Number of CIDs that appear just as merged stereo-isomers (\'m\' CIDs)\n\
+%d | Number of CIDs that appear just as stereo isomers (\'s\' CIDs)\n\
+%d | Number of CIDs that appear as both \'m\' and \'s\' CIDs' % (lm, ls, lms)
+    print(text)
+
+    a = mCount == lms+lm
+    b = sCount == lms+ls
+    c = tCount == 2*lms+lm+ls
+
+    return a and b and c
+
 def examineCidProps(cpiDic, chemPropsDic):
     '''
     Creates summary tables for the Computed Physical Properties of each CID number type to see if there's a pattern to the CID m and s labels and their physical properties. Running this for all of species 9606 CP interactions yields no obvious pattern.
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import contextlib, io, json, os, platform, subprocess, sys, time
+import multiprocessing as mp
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpibench.py
+
+File Description
+----------------
+
+    Benchmarks of the functions of cpi.py that build the dictionaries, on synthetic files in the STITCH formats, so that their speed and memory use are recorded as numbers that can be compared between versions.
+
+    Every benchmark runs in a new process, so the peak resident memory it reports is its own. The results are appended to a history file with one JSON record per line:
+
+        {"time": "2018-09-20 14:03:11", "benchmark": "makeLinksDic", "numRows": 1000000, "seconds": 9.8, "rowsPerSecond": 102040.8, "peakRssMB": 1210.4, "baseRssMB": 150.2, "commit": "784bd7a", "host": "saturn", ...}
+
+    'baseRssMB' is the memory of the process before the benchmark starts, after importing cpi.py.
+
+    >>> records = runBenchmarks(DIR + 'bench/', sizes=[10**5, 10**6])
+    >>> regressions = findRegressions(DIR + 'bench/benchmarkHistory.jsonl')
+'''
+
+'''
+Meta Global Variables
+'''
+
+LINKS_FNAME = '9606.protein_chemical.links.v5.0.tsv'
+ACTIONS_FNAME = '9606.actions.v5.0.tsv'
+ALIASES_FNAME = '9606.protein.aliases.v10.5.txt'
+
+MODES = ['activation', 'binding', 'catalysis', 'expression', 'inhibition', 'pred_bind', 'reaction']
+ALIAS_SOURCES = ['BLAST_UniProt_GN Ensembl_EntrezGene', 'Ensembl_UniProt', 'BLAST_KEGG_NAME', 'Ensembl_HGNC_UniProt_ID(supplied_by_UniProt)_GN Ensembl_UniProt_GN']
+
+# Benchmarks in the order they run. Later ones use the pickles saved by earlier ones.
+BENCHMARKS = ['makeCidList', 'makeCpiDic', 'makeCpiDics', 'makeLinksDic', 'makeProtSynsDic', 'loadPickle', 'verifyLinksDics', 'verifyProtSynsDics']
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def getChemicalNames(rng, numChemicals):
+    '''
+    Returns 'numChemicals' STITCH chemical names. About half of the CID numbers appear as both an 'm' and an 's' chemical, as in STITCH.
+    '''
+    numbers = rng.choice(10**8, size=numChemicals, replace=False)
+    numbers[numChemicals // 2:] = numbers[:numChemicals - numChemicals // 2]
+    stereo = np.arange(numChemicals) >= numChemicals // 2
+    return ['CID%s%08d' % ('ms'[s], n) for s, n in zip(stereo.tolist(), numbers.tolist())]
+
+def getProteinNames(numProteins, taxon=9606):
+    return ['%d.ENSP%011d' % (taxon, i) for i in range(numProteins)]
+
+def writeRows(fpath, header, columns):
+    '''
+    Writes parallel lists of strings as a tab-separated file.
+    '''
+    with open(fpath, 'w') as f:
+        f.write(header + '\n')
+        f.write(''.join(['\t'.join(row) + '\n' for row in zip(*columns)]))
+
+def generateStitchFiles(dataDir, numRows, numChemicals=None, numProteins=None, taxon=9606, seed=0):
+    '''
+    Writes synthetic links, actions and protein aliases files with about 'numRows' data rows each, in the formats of the STITCH and STRING downloads, to 'dataDir'. The number of proteins a chemical interacts with follows a heavy-tailed distribution, and the links file is sorted by chemical, as in STITCH.
+
+    INPUT:  numChemicals, integer, defaults to numRows / 10.
+            numProteins, integer, defaults to numRows / 50, and at least 20.
+    OUTPUT: the number of data rows written to each file, { fname : numRows }
+    '''
+    rng = np.random.RandomState(seed)
+    if numChemicals is None:
+        numChemicals = max(numRows // 10, 2)
+    if numProteins is None:
+        numProteins = max(numRows // 50, 20)
+    os.makedirs(dataDir, exist_ok=True)
+    chemicals = getChemicalNames(rng, numChemicals)
+    proteins = getProteinNames(numProteins, taxon)
+
+    # Links: chemical popularity is heavy-tailed, repeated pairs are dropped
+    weights = rng.pareto(1.2, size=numChemicals) + 1
+    cids = rng.choice(numChemicals, size=numRows, p=weights / weights.sum())
+    prots = rng.randint(0, numProteins, size=numRows)
+    pairs = np.unique(cids.astype(np.int64) * numProteins + prots)
+    cids, prots = pairs // numProteins, pairs % numProteins
+    ranks = np.empty(numChemicals, dtype=np.int64)
+    ranks[np.argsort(np.array(chemicals))] = np.arange(numChemicals)
+    order = np.lexsort((prots, ranks[cids]))
+    cids, prots = cids[order], prots[order]
+    scores = rng.randint(150, 1000, size=len(cids))
+    writeRows(os.path.join(dataDir, LINKS_FNAME), 'chemical\tprotein\tcombined_score',
+              [[chemicals[i] for i in cids.tolist()], [proteins[i] for i in prots.tolist()], [str(s) for s in scores.tolist()]])
+
+    # Actions: every interaction is listed in both directions
+    half = numRows // 2
+    rows = rng.randint(0, len(cids), size=half)
+    modes = [MODES[i] for i in rng.randint(0, len(MODES), size=half).tolist()]
+    actions = [('', 'activation', 'inhibition')[i] for i in rng.randint(0, 3, size=half).tolist()]
+    chemicalIds = [chemicals[i] for i in cids[rows].tolist()]
+    proteinIds = [proteins[i] for i in prots[rows].tolist()]
+    actionScores = [str(s) for s in scores[rows].tolist()]
+    writeRows(os.path.join(dataDir, ACTIONS_FNAME), 'item_id_a\titem_id_b\tmode\taction\ta_is_acting\tscore',
+              [chemicalIds + proteinIds, proteinIds + chemicalIds, modes + modes, actions + actions, ['t'] * half + ['f'] * half, actionScores + actionScores])
+
+    # Aliases: every protein has several aliases, and some aliases are shared by several proteins
+    aliasProts = rng.randint(0, numProteins, size=numRows)
+    aliasNames = rng.randint(0, max(numRows // 3, 1), size=numRows)
+    sources = [ALIAS_SOURCES[i] for i in rng.randint(0, len(ALIAS_SOURCES), size=numRows).tolist()]
+    writeRows(os.path.join(dataDir, ALIASES_FNAME), '## string_protein_id ## alias ## source ##',
+              [[proteins[i] for i in aliasProts.tolist()], ['alias%d' % i for i in aliasNames.tolist()], sources])
+
+    return {LINKS_FNAME: len(cids), ACTIONS_FNAME: 2 * half, ALIASES_FNAME: numRows}
+
+def getPeakRss():
+    '''
+    Returns the peak resident memory of this process, in bytes. On Linux ru_maxrss (cpi.getPeakMemory) keeps the peak of the parent process across fork and exec, so the benchmarks read VmHWM, the peak of this process's own memory, from /proc instead.
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import cpi
+    return cpi.getPeakMemory()
+
+def runBenchmark(name, workDir, numRows, numProcs=1):
+    '''
+    Runs one benchmark in the current process and returns its record. Called in a new process by runBenchmarks.
+
+    INPUT:  workDir, string, the directory with the synthetic files in workDir + 'data/'. Pickles are saved to workDir.
+            numRows, dictionary, { fname : number of data rows }, as returned by generateStitchFiles.
+    '''
+    import cpi, cpiaux
+    dataDir = 'data/'
+    baseRss = getPeakRss()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        if name == 'makeCidList':
+            cpi.makeCidList(workDir, workDir + dataDir, workDir, fname=LINKS_FNAME, numProcs=numProcs)
+            rows = numRows[LINKS_FNAME]
+        elif name == 'makeCpiDic':
+            cpi.makeCpiDic(workDir, workDir + dataDir, workDir, fname=LINKS_FNAME, numProcs=numProcs)
+            rows = numRows[LINKS_FNAME]
+        elif name == 'makeCpiDics':
+            cpi.makeCpiDics(workDir, workDir + dataDir, workDir, fname=LINKS_FNAME, numProcs=numProcs)
+            rows = numRows[LINKS_FNAME]
+        elif name == 'makeLinksDic':
+            cpi.makeLinksDic(workDir, dataDir, fname=ACTIONS_FNAME, numProcs=numProcs)
+            rows = numRows[ACTIONS_FNAME]
+        elif name == 'makeProtSynsDic':
+            cpi.makeProtSynsDic(workDir, dataDir, fname=ALIASES_FNAME, numProcs=numProcs)
+            rows = numRows[ALIASES_FNAME]
+        elif name == 'loadPickle':
+            for dicName in ['ctopDic', 'ptocDic', 'pairsToLinksDic', 'protSynsDic', 'protSynsRDic']:
+                cpi.loadPickle(workDir, dicName)
+            rows = numRows[ACTIONS_FNAME] + numRows[ALIASES_FNAME]
+        elif name in ['verifyLinksDics', 'verifyProtSynsDics']:
+            if name == 'verifyLinksDics':
+                dicNames, rows = ['ctopDic', 'ptocDic'], numRows[ACTIONS_FNAME]
+            else:
+                dicNames, rows = ['protSynsDic', 'protSynsRDic'], numRows[ALIASES_FNAME]
+            dics = [cpi.loadPickle(workDir, dicName) for dicName in dicNames]
+            start = time.perf_counter() # loading is timed by the 'loadPickle' benchmark
+            report = cpiaux.verifyDics(*dics)
+            if not report['complete']:
+                raise ValueError('%s and %s are not consistent: %s' % (dicNames[0], dicNames[1], json.dumps(report)))
+        else:
+            raise ValueError('Unknown benchmark %s. Choose from %s.' % (name, ', '.join(BENCHMARKS)))
+        seconds = time.perf_counter() - start
+    return {'benchmark': name,
+            'numRows': rows,
+            'seconds': seconds,
+            'rowsPerSecond': rows / max(seconds, 1e-9),
+            'peakRssMB': getPeakRss() / 2**20,
+            'baseRssMB': baseRss / 2**20,
+            'numProcs': numProcs}
+
+def getCommit():
+    '''
+    Returns the short hash of the git commit of this module, or None outside a git checkout.
+    '''
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        return output.stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def appendHistory(records, historyPath):
+    with open(historyPath, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+def loadHistory(historyPath):
+    with open(historyPath) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def runBenchmarks(workDir, sizes=(10**5,), benchmarks=BENCHMARKS, numProcs=1, historyPath=None, seed=0, verbose=1):
+    '''
+    Generates synthetic files of each size in 'sizes' (rows per file) and runs the benchmarks on them, each in a new process. The files of a size are kept in workDir + '<size>/data/' and reused by later runs with the same seed.
+
+    INPUT:  benchmarks, a list of names from BENCHMARKS. 'loadPickle' and the 'verify' benchmarks need the pickles of makeLinksDic and makeProtSynsDic, from this run or an earlier one.
+            numProcs, integer, passed to the builders.
+            historyPath, string, the file the records are appended to. Defaults to workDir + 'benchmarkHistory.jsonl'.
+    OUTPUT: records, a list of the records of this run.
+    '''
+    if historyPath is None:
+        historyPath = workDir + 'benchmarkHistory.jsonl'
+    os.makedirs(workDir, exist_ok=True)
+    context = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'commit': getCommit(),
+               'host': platform.node(),
+               'python': platform.python_version(),
+               'numCpus': os.cpu_count()}
+    records = []
+    for size in sizes:
+        sizeDir = os.path.join(workDir, '%d' % size) + '/'
+        infoPath = sizeDir + 'data/info.json'
+        try:
+            with open(infoPath) as f:
+                info = json.load(f)
+            if info['seed'] != seed:
+                raise ValueError
+            numRows = info['numRows']
+        except (FileNotFoundError, ValueError, KeyError):
+            numRows = generateStitchFiles(sizeDir + 'data/', size, seed=seed)
+            with open(infoPath, 'w') as f:
+                json.dump({'seed': seed, 'numRows': numRows}, f)
+        for name in benchmarks:
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as pool:
+                record = pool.submit(runBenchmark, name, sizeDir, numRows, numProcs).result()
+            record = dict(context, size=size, **record)
+            records.append(record)
+            appendHistory([record], historyPath)
+            if verbose > 0:
+                printRecords([record], header=len(records) == 1)
+    return records
+
+def printRecords(records, header=True):
+    if header:
+        print('%-20s %10s %10s %14s %12s' % ('benchmark', 'rows', 'seconds', 'rows/s', 'peak MB'))
+    for record in records:
+        print('%-20s %10d %10.2f %14.0f %12.1f' % (record['benchmark'], record['numRows'], record['seconds'], record['rowsPerSecond'], record['peakRssMB']))
+
+def findRegressions(historyPath, tolerance=0.2, window=5):
+    '''
+    Compares the latest record of every benchmark and size in the history with the median of up to 'window' records before it. Returns the records that are more than 'tolerance' (a fraction) slower or use that much more peak memory, with the ratios added as 'timeRatio' and 'memoryRatio'.
+    '''
+    groups = {}
+    for record in loadHistory(historyPath):
+        groups.setdefault((record['benchmark'], record['size'], record.get('numProcs', 1)), []).append(record)
+    regressions = []
+    for key, group in sorted(groups.items()):
+        if len(group) < 2:
+            continue
+        latest, previous = group[-1], group[-1 - window:-1]
+        timeRatio = latest['seconds'] / max(np.median([record['seconds'] for record in previous]), 1e-9)
+        memoryRatio = latest['peakRssMB'] / max(np.median([record['peakRssMB'] for record in previous]), 1e-9)
+        if timeRatio > 1 + tolerance or memoryRatio > 1 + tolerance:
+            regressions.append(dict(latest, timeRatio=timeRatio, memoryRatio=memoryRatio))
+    return regressions
+
+if __name__ == '__main__':
+    # $ python cpibench.py workDir size1 size2 ...
+    workDir = sys.argv[1] if len(sys.argv) > 1 else 'bench/'
+    sizes = [int(size) for size in sys.argv[2:]] or [10**5]
+    runBenchmarks(os.path.join(workDir, ''), sizes)
+    for record in findRegressions(os.path.join(workDir, 'benchmarkHistory.jsonl')):
+        print('Regression: %s with %d rows took %.2fx the time and %.2fx the memory of earlier runs.' % (record['benchmark'], record['numRows'], record['timeRatio'], record['memoryRatio']))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections, io, os, queue, struct, threading, zlib
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpicompress.py
+
+File Description
+----------------
+
+    Reads compressed STITCH and STRING files directly, without decompressing them to disk first. STITCH distributes its files as '.tsv.gz', which for all species is more than 30 GB uncompressed.
+
+    The format is detected from the first bytes of the file, not from its name:
+
+    Format  | Decompression
+    ============================================================================
+    gzip    | one background thread. Files made of several gzip members (e.g. by pigz or cat) are read to the end
+    bgzip   | blocked gzip, as made by 'bgzip' from htslib. The file is a series of independent gzip blocks of at most 64 kB, so blocks are decompressed in parallel by a pool of threads, in batches, and put back in order
+    zstd    | one background thread. Needs the 'zstandard' package
+
+    openInput returns a binary file object that the readers of cpiio.py, cpisample.py, cpishard.py, ... use like an open file. Decompression runs in a background thread that puts the decompressed data in a bounded queue, and the parser takes it from there, so reading the disk, decompressing and parsing overlap, and no more than 'maxBuffered' pieces of data wait in memory. zlib releases the GIL while it works, so the threads run at the same time as the parser.
+
+    A compressed file can only be read from the start. Seeking forward is supported, by decompressing and dropping the data in between, but seeking backward is not, so functions that need random access to a file (e.g. cpisample.offsetSample) raise an error for compressed files, and the parallel readers (cpiio.loadColumnsParallel, cpishard.shardByTaxon) hand blocks of the decompressed stream to their worker processes instead of byte ranges of the file.
+'''
+
+'''
+Meta Global Variables
+'''
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+SUFFIXES = ['.gz', '.bgz', '.zst']
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def getCompression(fpath):
+    '''
+    Returns the compression of a file, 'gzip', 'bgzip' or 'zstd', or None for an uncompressed file.
+    '''
+    with open(fpath, 'rb') as f:
+        start = f.read(18)
+    if start[:2] == GZIP_MAGIC:
+        if isBgzfHeader(start):
+            return 'bgzip'
+        return 'gzip'
+    if start[:4] == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+def isCompressed(fpath):
+    return getCompression(fpath) is not None
+
+def getPlainName(fname):
+    '''
+    Returns a file name without its compression suffix, e.g. 'actions.v5.0.tsv' for 'actions.v5.0.tsv.gz'.
+    '''
+    for suffix in SUFFIXES:
+        if fname.endswith(suffix):
+            return fname[:-len(suffix)]
+    return fname
+
+def isBgzfHeader(header):
+    '''
+    True if the bytes start with the header of a BGZF block: a gzip header with an extra field whose first subfield is 'BC'.
+    '''
+    return len(header) >= 18 and header[:4] == b'\x1f\x8b\x08\x04' and header[12:14] == b'BC'
+
+def iterGzip(f, readSize=2**18):
+    '''
+    Yields the decompressed data of a gzip file, of every member in turn.
+    '''
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    started = False # the current member has been given data
+    while True:
+        data = f.read(readSize)
+        if not data:
+            break
+        while data:
+            started = True
+            output = decompressor.decompress(data)
+            if output:
+                yield output
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                started = False
+            else:
+                data = b''
+    if started:
+        raise EOFError('The gzip file ended before the end of its last member.')
+
+def readBgzfBatch(f, batchSize):
+    '''
+    Reads whole BGZF blocks from a file, about 'batchSize' compressed bytes, and returns them as a list of bytes.
+    '''
+    blocks = []
+    size = 0
+    while size < batchSize:
+        header = f.read(18)
+        if not header:
+            break
+        if not isBgzfHeader(header):
+            raise ValueError('Not a BGZF block at byte %d of the file.' % (f.tell() - len(header)))
+        extraLength = struct.unpack('<H', header[10:12])[0]
+        blockSize = struct.unpack('<H', header[16:18])[0] + 1
+        rest = f.read(blockSize - 18)
+        if len(rest) != blockSize - 18 or extraLength < 6:
+            raise EOFError('The BGZF file ended inside a block.')
+        blocks.append(header + rest)
+        size += blockSize
+    return blocks
+
+def decompressBgzfBatch(blocks):
+    return b''.join([zlib.decompress(block, zlib.MAX_WBITS | 16) for block in blocks])
+
+def iterBgzf(f, numThreads=None, batchSize=2**18):
+    '''
+    Yields the decompressed data of a BGZF file. Batches of about 'batchSize' compressed bytes are decompressed by a pool of 'numThreads' threads, and yielded in file order. No more than 2 * numThreads batches are in flight.
+    '''
+    if numThreads is None:
+        numThreads = min(8, os.cpu_count() or 1)
+    pool = ThreadPoolExecutor(max_workers=numThreads)
+    try:
+        futures = collections.deque()
+        while True:
+            while len(futures) < 2 * numThreads:
+                blocks = readBgzfBatch(f, batchSize)
+                if not blocks:
+                    break
+                futures.append(pool.submit(decompressBgzfBatch, blocks))
+            if not futures:
+                break
+            data = futures.popleft().result()
+            if data:
+                yield data
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True) # if reading stopped early, only the batches already started are finished
+
+def iterZstd(f, readSize=2**18):
+    '''
+    Yields the decompressed data of a zstd file, of every frame in turn.
+    '''
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('Reading zstd files needs the \'zstandard\' package: pip install zstandard')
+    reader = zstandard.ZstdDecompressor().stream_reader(f, read_size=readSize, read_across_frames=True)
+    while True:
+        data = reader.read(readSize)
+        if not data:
+            break
+        yield data
+
+class DecompressedStream(io.RawIOBase):
+    '''
+    Raw binary stream of the decompressed data of a file. A background thread decompresses the file and puts the data in a queue of at most 'maxBuffered' pieces, and 'readinto' takes it from there. Use it through openInput, which adds a buffer, so that it has 'readline', iteration over lines, etc.
+    '''
+    def __init__(self, fpath, compression, numThreads=None, maxBuffered=8):
+        super().__init__()
+        self.fpath = fpath
+        self.compression = compression
+        self.numThreads = numThreads
+        self.queue = queue.Queue(maxsize=maxBuffered)
+        self.stopped = threading.Event()
+        self.position = 0
+        self.current = memoryview(b'')
+        self.finished = False
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        '''
+        Puts an item in the queue, waiting for space, unless the stream is closed. Returns False if it was closed.
+        '''
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(self):
+        try:
+            with open(self.fpath, 'rb') as f:
+                if self.compression == 'gzip':
+                    pieces = iterGzip(f)
+                elif self.compression == 'bgzip':
+                    pieces = iterBgzf(f, self.numThreads)
+                elif self.compression == 'zstd':
+                    pieces = iterZstd(f)
+                else:
+                    raise ValueError('Unknown compression %s.' % self.compression)
+                for data in pieces:
+                    if not self.put(data):
+                        return
+            self.put(None)
+        except BaseException as error:
+            self.put(error)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.current) == 0:
+            if self.finished:
+                return 0
+            item = self.queue.get()
+            if item is None:
+                self.finished = True
+                return 0
+            if isinstance(item, BaseException):
+                self.finished = True
+                raise item
+            self.current = memoryview(item)
+        n = min(len(buffer), len(self.current))
+        buffer[:n] = self.current[:n]
+        self.current = self.current[n:]
+        self.position += n
+        return n
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        '''
+        Seeks forward by reading and dropping data. Seeking backward raises io.UnsupportedOperation.
+        '''
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('Compressed files can only be seeked from the start or the current position.')
+        if offset < self.position:
+            raise io.UnsupportedOperation('Compressed files can only be read forward, so byte %d of %s can not be read again. Open the file again, or use the uncompressed file.' % (offset, self.fpath))
+        buffer = bytearray(min(offset - self.position, 2**22))
+        while self.position < offset:
+            n = self.readinto(memoryview(buffer)[:min(len(buffer), offset - self.position)])
+            if n == 0:
+                break
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.thread.join()
+        super().close()
+
+def openInput(fpath, numThreads=None, maxBuffered=8, bufferSize=2**20):
+    '''
+    Opens a file for reading in binary mode. Compressed files (see getCompression) are decompressed on the fly by background threads, uncompressed files are opened with 'open'.
+
+    INPUT:  numThreads, integer, the number of threads that decompress a bgzip file. Defaults to the number of CPUs, up to 8.
+            maxBuffered, integer, the number of pieces of decompressed data that can wait for the reader.
+    OUTPUT: a binary file object. Use it in a 'with' statement so that the background threads stop if reading stops early.
+
+    >>> with openInput(dataDir + 'actions.v5.0.tsv.gz') as f:
+    ...     header = f.readline()
+    '''
+    compression = getCompression(fpath)
+    if compression is None:
+        return open(fpath, 'rb')
+    return io.BufferedReader(DecompressedStream(fpath, compression, numThreads, maxBuffered), buffer_size=bufferSize)
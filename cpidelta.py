@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections, gzip, hashlib, json, os, time
+import numpy as np
+from cpicompress import openInput
+from cpiio import readHeader, inferDtypes, readBlocks, splitBlock
+from cpihash import getByteWeights
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpidelta.py
+
+File Description
+----------------
+
+    Incremental rebuilds of the dictionaries made by cpi.py (see 'makeDicsIncremental' in cpi.py).
+
+    An input file is cut into chunks of whole lines, and every chunk is fingerprinted by a hash of its contents. Where a chunk ends is decided by the contents of its last line, not by its position in the file, so inserting or deleting lines only changes the chunks around the edit, and the chunks after it keep their fingerprints. Comparing the fingerprints of a build with those of the last one gives the chunks that were removed and the chunks that were added, and only their rows have to be parsed and applied to the stored dictionaries.
+
+    Each build records a manifest, a JSON file with the input file's path, size and header and the byte range and fingerprint of every chunk. The contents of every chunk of the last build are kept in a chunk store, compressed and named by fingerprint, because the rows of a removed chunk are needed to take them out of the dictionaries after the file itself has been edited or replaced by a new release.
+'''
+
+'''
+Meta Global Variables
+'''
+
+HASH_WEIGHTS = getByteWeights(20180601) # fixed seed, so fingerprints agree between runs
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def getChunkEnds(block, avgChunkLines):
+    '''
+    Returns the offsets in a block of whole lines just past the lines that end a chunk. A line ends a chunk if the hash of the whole line is 0 modulo 'avgChunkLines', which makes chunks of about that many lines on average.
+
+    The hash of a line is the sum of its bytes times random weights that depend on the position of the byte in the line, computed for all lines of the block at once.
+    '''
+    array = np.frombuffer(block, dtype=np.uint8)
+    ends = np.flatnonzero(array == 10)
+    if len(ends) == 0:
+        return ends
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    lineLengths = ends + 1 - starts
+    positions = np.arange(len(array), dtype=np.int64) - np.repeat(starts, lineLengths)[:len(array)]
+    values = (array.astype(np.uint64) + np.uint64(1)) * HASH_WEIGHTS[positions % len(HASH_WEIGHTS)]
+    h = np.add.reduceat(values, starts)
+    h ^= h >> np.uint64(29)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(32)
+    return ends[h % np.uint64(avgChunkLines) == 0] + 1
+
+def fingerprintFile(fpath, avgChunkLines=4096, blockSize=2**22):
+    '''
+    Cuts the data rows of a file into content-defined chunks and returns the file's manifest:
+
+        {'fpath'  : fpath,
+         'size'   : size in bytes,
+         'header' : the header line,
+         'chunks' : [[start, end, fingerprint], ...]}   # byte ranges [start, end)
+
+    For compressed files (see cpicompress.py) the size and byte ranges are those of the decompressed data, so recompressing a file does not change its chunks.
+    '''
+    with openInput(fpath) as f:
+        header = f.readline()
+        chunks = []
+        start = f.tell()
+        position = start
+        hasher = hashlib.blake2b(digest_size=16)
+        for block in readBlocks(f, blockSize):
+            blockStart = position
+            position += len(block)
+            a = 0
+            for b in getChunkEnds(block, avgChunkLines).tolist():
+                hasher.update(block[a:b])
+                chunks.append([start, blockStart + b, hasher.hexdigest()])
+                start = blockStart + b
+                hasher = hashlib.blake2b(digest_size=16)
+                a = b
+            hasher.update(block[a:])
+        size = f.tell()
+        end = min(position, size) # readBlocks adds a newline to a last line without one
+        if end > start:
+            chunks.append([start, end, hasher.hexdigest()])
+    return {'fpath': fpath, 'size': size, 'header': header.decode(), 'chunks': chunks}
+
+def diffManifests(oldManifest, newManifest):
+    '''
+    Returns the chunks of 'oldManifest' that are not in 'newManifest' (removed), and the chunks of 'newManifest' that are not in 'oldManifest' (added). Chunks are compared by fingerprint, and a fingerprint that appears n times in one manifest is matched at most n times.
+    '''
+    oldCounts = {}
+    for start, end, digest in oldManifest['chunks']:
+        oldCounts[digest] = oldCounts.get(digest, 0) + 1
+    added = []
+    for chunk in newManifest['chunks']:
+        if oldCounts.get(chunk[2], 0) > 0:
+            oldCounts[chunk[2]] -= 1
+        else:
+            added.append(chunk)
+    removed = []
+    for chunk in oldManifest['chunks']:
+        if oldCounts.get(chunk[2], 0) > 0:
+            oldCounts[chunk[2]] -= 1
+            removed.append(chunk)
+    return removed, added
+
+def loadManifest(fpath):
+    '''
+    Returns the manifest saved at 'fpath', or None if there is none.
+    '''
+    try:
+        with open(fpath) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def saveManifest(manifest, fpath, **info):
+    '''
+    Saves a manifest as JSON. Keyword arguments are recorded with it, e.g. the names of the dictionaries built.
+    '''
+    manifest = dict(manifest, built=time.strftime('%Y-%m-%d %H:%M:%S'), **info)
+    with open(fpath, 'w') as f:
+        json.dump(manifest, f)
+
+class ChunkStore:
+    '''
+    Directory of chunk contents, gzip-compressed and named by fingerprint.
+    '''
+    def __init__(self, dirPath):
+        self.dirPath = dirPath
+        os.makedirs(dirPath, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.dirPath, digest + '.gz')
+
+    def __contains__(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, digest, data):
+        if digest not in self:
+            with open(self.path(digest), 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=1))
+
+    def get(self, digest):
+        with open(self.path(digest), 'rb') as f:
+            return gzip.decompress(f.read())
+
+    def prune(self, digests):
+        '''
+        Deletes the chunks whose fingerprint is not in 'digests'.
+        '''
+        keep = set(digests)
+        for name in os.listdir(self.dirPath):
+            if name.endswith('.gz') and name[:-3] not in keep:
+                os.remove(os.path.join(self.dirPath, name))
+
+def makeTable(data, header, dtypes):
+    '''
+    Parses bytes of whole lines into a table in the format of cpiio.loadColumns.
+    '''
+    vocab = {}
+    columns = splitBlock(data, header, dtypes, vocab)
+    return {'header': header, 'dtypes': dtypes, 'columns': columns, 'vocab': list(vocab)}
+
+def iterDelta(fpath, oldManifest, newManifest, store, dtypes=None, batchBytes=2**25):
+    '''
+    Yields (sign, table) pairs with the rows to take out of the dictionaries (sign -1) and the rows to put in (sign +1), in tables in the format of cpiio.loadColumns. Removed rows are read from the chunk store, added rows from the file, which are then added to the store. Chunks are parsed in batches of about 'batchBytes' bytes.
+
+    If 'oldManifest' is None, or its header differs from the file's, every chunk of the file is added and nothing is removed.
+    '''
+    header = readHeader(fpath)
+    if dtypes is None:
+        dtypes = inferDtypes(fpath, header)
+    if oldManifest is None or oldManifest['header'] != newManifest['header']:
+        removed, added = [], newManifest['chunks']
+    else:
+        removed, added = diffManifests(oldManifest, newManifest)
+
+    def batches(chunks, read):
+        parts, size = [], 0
+        for start, end, digest in chunks:
+            data = read(start, end, digest)
+            if data:
+                if not data.endswith(b'\n'):
+                    data += b'\n' # the last line of a file may have no newline
+                parts.append(data)
+                size += len(data)
+            if size >= batchBytes:
+                yield b''.join(parts)
+                parts, size = [], 0
+        if parts:
+            yield b''.join(parts)
+
+    for data in batches(removed, lambda start, end, digest: store.get(digest)):
+        yield -1, makeTable(data, header, dtypes)
+
+    with openInput(fpath) as f: # the added chunks are in file order, so compressed files are only read forward
+        def read(start, end, digest):
+            f.seek(start)
+            data = f.read(end - start)
+            store.put(digest, data)
+            return data
+        for data in batches(added, read):
+            yield 1, makeTable(data, header, dtypes)
+
+def applyEntries(dic, keys, values, sign):
+    '''
+    Appends value i to dic[key i] if sign is 1, or removes one occurrence of it if sign is -1. Keys left without values are deleted.
+
+    Removals are grouped by key, and the list of every key is rebuilt once, so removing many values of a key with many values (e.g. a protein of ptocDic linked to tens of thousands of CIDs) takes one pass over its list. The first occurrences of a value are removed, like list.remove. Raises KeyError if a key is not in 'dic', and ValueError if a value is not in the list of its key.
+    '''
+    if sign > 0:
+        for key, value in zip(keys, values):
+            try:
+                dic[key].append(value)
+            except KeyError:
+                dic[key] = [value]
+    else:
+        removals = {}
+        for key, value in zip(keys, values):
+            try:
+                removals[key][value] += 1
+            except KeyError:
+                removals[key] = collections.Counter([value])
+        for key, counts in removals.items():
+            entries = []
+            for entry in dic[key]:
+                if counts[entry] > 0:
+                    counts[entry] -= 1
+                else:
+                    entries.append(entry)
+            if sum(counts.values()) > 0:
+                raise ValueError('%d values to remove are not in the list of %s.' % (sum(counts.values()), key))
+            if entries:
+                dic[key] = entries
+            else:
+                del dic[key]
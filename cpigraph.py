@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json, os
+import numpy as np
+from cpiids import isCidCode
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpigraph.py
+
+File Description
+----------------
+
+    Compressed sparse row (CSR) storage of the chemical-protein interaction graph.
+
+    'makeCpiDic' and 'makeLinksDic' return dictionaries of Python lists, one list per CID or protein. For the human files that is millions of lists. A CsrGraph instead keeps the neighbours of every node as one slice of a single shared array:
+
+        cids    = [c0, c1, c2]                 # sorted CID codes
+        indptr  = [0, 2, 3, 5]                 # neighbours of cids[i] are indices[indptr[i]:indptr[i+1]]
+        indices = [p4, p7, p4, p9, p1]         # protein codes
+        scores  = [279, 154, 225, 225, 178]    # combined_score of each edge
+
+    The same is kept in the reverse direction (protein to CIDs). All identifiers are codes from an IdRegistry (see cpiids.py).
+
+    The neighbours of every node are sorted by decreasing score, and by code for equal scores, when the graph is built. The k highest-scoring neighbours of a node are then the first k of its slice, so top-k queries, for one node or for all of them, take no sorting. 'save' records this order in 'meta.json' next to the arrays, and 'load' raises an error for a graph saved without it, whose neighbours are in order of code, so that top-k queries never silently return the wrong neighbours. Such graphs have to be rebuilt, e.g. with makeCpiGraph.
+'''
+
+'''
+Meta Global Variables
+'''
+
+ORDER = 'score' # the order of the adjacency lists, recorded with saved graphs
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def toInt32(codes):
+    '''
+    Casts registry codes to int32, raising an error instead of silently wrapping around.
+    '''
+    info = np.iinfo(np.int32)
+    if len(codes) > 0 and (codes.min() < info.min or codes.max() > info.max):
+        raise OverflowError('Identifier codes do not fit in 32 bits.')
+    return codes.astype(np.int32)
+
+def compress(rows, cols, scores):
+    '''
+    Groups edges by row. Returns the sorted unique row codes, the row pointer array, and the column codes and scores ordered by row, and within a row by decreasing score.
+    '''
+    order = np.lexsort((cols, -scores.astype(np.int32), rows))
+    rows = rows[order]
+    nodes, counts = np.unique(rows, return_counts=True)
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return nodes, indptr, toInt32(cols[order]), scores[order]
+
+def getTopK(nodes, indptr, indices, scores, k, select=None):
+    '''
+    Returns the first k neighbours of every row of a CSR adjacency, which are the k highest-scoring ones if rows are sorted by score, as a smaller CSR adjacency (nodes, indptr, indices, scores). Rows with fewer than k neighbours keep all of them.
+
+    INPUT:  select, an array of node codes, optional. Only these rows are kept, in this order. Raises KeyError for codes that are not nodes.
+    '''
+    if select is None:
+        positions = np.arange(len(nodes), dtype=np.int64)
+    else:
+        select = np.asarray(select, dtype=nodes.dtype)
+        positions = np.searchsorted(nodes, select)
+        found = positions < len(nodes)
+        found[found] = nodes[positions[found]] == select[found]
+        missing = ~found
+        if missing.any():
+            raise KeyError(select[missing][0].item())
+        nodes = select
+    starts = np.asarray(indptr[positions], dtype=np.int64)
+    counts = np.minimum(np.asarray(indptr[positions + 1], dtype=np.int64) - starts, k)
+    topptr = np.zeros(len(positions) + 1, dtype=np.int64)
+    np.cumsum(counts, out=topptr[1:])
+    edges = np.repeat(starts - topptr[:-1], counts) + np.arange(topptr[-1], dtype=np.int64)
+    return np.asarray(nodes), topptr, indices[edges], scores[edges]
+
+class CsrGraph:
+    '''
+    Bipartite chemical-protein graph in CSR format, in both directions.
+
+    Look-ups return views into the shared arrays, so no lists are allocated:
+
+    >>> graph = CsrGraph.fromTable(table, registry)
+    >>> graph.proteins(registry.encode('CIDm91758680'))
+    array([2, 3], dtype=int32)
+    >>> graph.chemicals(registry.encode('9606.ENSP00000257254'))
+    array([-183517361], dtype=int32)
+    '''
+    names = ['cids', 'indptr', 'indices', 'scores', 'prots', 'rindptr', 'rindices', 'rscores']
+
+    def __init__(self, cids, indptr, indices, scores, prots, rindptr, rindices, rscores):
+        self.cids, self.indptr, self.indices, self.scores = cids, indptr, indices, scores
+        self.prots, self.rindptr, self.rindices, self.rscores = prots, rindptr, rindices, rscores
+
+    @classmethod
+    def fromEdges(cls, cidCodes, protCodes, scores):
+        '''
+        Builds the graph from parallel arrays of CID codes, protein codes and scores. Repeated (CID, protein) pairs are merged, keeping the highest score.
+        '''
+        cidCodes = np.asarray(cidCodes, dtype=np.int64)
+        protCodes = np.asarray(protCodes, dtype=np.int64)
+        scores = np.asarray(scores, dtype=np.int16)
+
+        # Merge repeated pairs
+        order = np.lexsort((-scores.astype(np.int32), protCodes, cidCodes))
+        cidCodes, protCodes, scores = cidCodes[order], protCodes[order], scores[order]
+        first = np.ones(len(order), dtype=np.bool_)
+        first[1:] = (cidCodes[1:] != cidCodes[:-1]) | (protCodes[1:] != protCodes[:-1])
+        cidCodes, protCodes, scores = cidCodes[first], protCodes[first], scores[first]
+
+        cids, indptr, indices, edgeScores = compress(cidCodes, protCodes, scores)
+        prots, rindptr, rindices, rscores = compress(protCodes, cidCodes, scores)
+        return cls(cids, indptr, indices, edgeScores, prots, rindptr, rindices, rscores)
+
+    @classmethod
+    def fromTable(cls, table, registry, names=None):
+        '''
+        Builds the graph from a links or actions table made by cpiio.loadColumns.
+
+        INPUT:  table, a dictionary, the loaded file.
+                registry, an IdRegistry, used to encode identifiers.
+                names, a list of three column names (item A, item B, score). Defaults to the first two columns and the last column of the table, which is right for the simple links, detailed links and actions files. Rows may list the chemical in either column, as in the actions file.
+        '''
+        if names is None:
+            names = table['header'][:2] + table['header'][-1:]
+        ids = registry.encodeVocab(table, names[:2])
+        idsA, idsB = ids[names[0]], ids[names[1]]
+        aIsCid = isCidCode(idsA)
+        cidCodes = np.where(aIsCid, idsA, idsB)
+        protCodes = np.where(aIsCid, idsB, idsA)
+        return cls.fromEdges(cidCodes, protCodes, table['columns'][names[2]])
+
+    def __len__(self):
+        '''
+        Number of (CID, protein) edges.
+        '''
+        return len(self.indices)
+
+    def cidPosition(self, cid):
+        i = np.searchsorted(self.cids, cid)
+        if i == len(self.cids) or self.cids[i] != cid:
+            raise KeyError(cid)
+        return i
+
+    def protPosition(self, prot):
+        i = np.searchsorted(self.prots, prot)
+        if i == len(self.prots) or self.prots[i] != prot:
+            raise KeyError(prot)
+        return i
+
+    def proteins(self, cid, withScores=False, k=None):
+        '''
+        Returns the protein codes linked to a CID code, highest score first, and their scores if 'withScores' is True. With k, only the k highest-scoring proteins are returned. Raises KeyError for unknown CIDs, like cpiDic would.
+        '''
+        i = self.cidPosition(cid)
+        a, b = self.indptr[i], self.indptr[i+1]
+        if k is not None:
+            b = min(b, a + k)
+        if withScores:
+            return self.indices[a:b], self.scores[a:b]
+        else:
+            return self.indices[a:b]
+
+    def chemicals(self, prot, withScores=False, k=None):
+        '''
+        Returns the CID codes linked to a protein code, highest score first, and their scores if 'withScores' is True. With k, only the k highest-scoring chemicals are returned. Raises KeyError for unknown proteins, like cpiRDic would.
+        '''
+        i = self.protPosition(prot)
+        a, b = self.rindptr[i], self.rindptr[i+1]
+        if k is not None:
+            b = min(b, a + k)
+        if withScores:
+            return self.rindices[a:b], self.rscores[a:b]
+        else:
+            return self.rindices[a:b]
+
+    def topProteins(self, k, cids=None):
+        '''
+        Batched top-k: the k highest-scoring proteins of every CID, or of the CID codes in 'cids', in one call.
+
+        OUTPUT: cids, indptr, indices, scores, in the CSR format of the graph. The top proteins of cids[i] are indices[indptr[i]:indptr[i+1]], highest score first.
+
+        >>> cids, indptr, indices, scores = graph.topProteins(10)
+        '''
+        return getTopK(self.cids, self.indptr, self.indices, self.scores, k, cids)
+
+    def topChemicals(self, k, prots=None):
+        '''
+        Batched top-k: the k highest-scoring CIDs of every protein, or of the protein codes in 'prots'. Same output as topProteins.
+        '''
+        return getTopK(self.prots, self.rindptr, self.rindices, self.rscores, k, prots)
+
+    def toDics(self, registry=None):
+        '''
+        Returns the graph as the dictionaries made by makeCpiDic, (cpiDic, cpiRDic). Identifiers are decoded to strings if a registry is given. Meant for small graphs and for checking results.
+        '''
+        if registry is None:
+            decode = lambda codes: codes.tolist()
+        else:
+            decode = lambda codes: registry.decodeArray(codes).tolist()
+        cpiDic = {}
+        for cid, proteins in zip(decode(self.cids), np.split(self.indices, self.indptr[1:-1])):
+            cpiDic[cid] = decode(proteins)
+        cpiRDic = {}
+        for prot, chemicals in zip(decode(self.prots), np.split(self.rindices, self.rindptr[1:-1])):
+            cpiRDic[prot] = decode(chemicals)
+        return cpiDic, cpiRDic
+
+    def save(self, dirPath):
+        '''
+        Saves each array to 'dirPath' as a .npy file, and the order of the adjacency lists to 'meta.json'.
+        '''
+        os.makedirs(dirPath, exist_ok=True)
+        for name in self.names:
+            np.save(os.path.join(dirPath, name + '.npy'), getattr(self, name))
+        with open(os.path.join(dirPath, 'meta.json'), 'w') as f:
+            json.dump({'order': ORDER}, f)
+
+    @classmethod
+    def load(cls, dirPath, mmap=True):
+        '''
+        Loads a graph saved with 'save'. With mmap=True the arrays are memory-mapped read-only, so loading is instant, only the pages that are used are read from disk, and processes that load the same graph share one copy in the page cache.
+
+        Raises ValueError for a graph whose adjacency lists are not sorted by score (see File Description).
+        '''
+        try:
+            with open(os.path.join(dirPath, 'meta.json')) as f:
+                order = json.load(f).get('order')
+        except FileNotFoundError:
+            order = None
+        if order != ORDER:
+            raise ValueError('The graph at %s was saved with its neighbours in order of code, not by score, so top-k queries on it would be wrong. Rebuild it, e.g. with makeCpiGraph.' % dirPath)
+        if mmap:
+            mmapMode = 'r'
+        else:
+            mmapMode = None
+        arrays = [np.load(os.path.join(dirPath, name + '.npy'), mmap_mode=mmapMode) for name in cls.names]
+        return cls(*arrays)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpihash.py
+
+File Description
+----------------
+
+    Integer hash helpers shared by the sampling (cpisample.py), the chunking of incremental rebuilds (cpidelta.py) and the fingerprints of CID bags (cpiaux.py). They only need numpy, so these modules can use them without importing each other.
+'''
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def getByteWeights(seed, size=256):
+    '''
+    Returns 'size' random nonzero uint64 weights from a fixed seed, for hashes that weight the bytes of a line or field by their position (see cpisample.getFieldHashes and cpidelta.getChunkEnds). The same seed gives the same weights in every run, so the hashes can be saved and compared.
+    '''
+    return np.random.RandomState(seed).randint(1, 2**63, size=size, dtype=np.int64).astype(np.uint64)
+
+def mixHash(values):
+    '''
+    64-bit finalizer of splitmix64, applied to a uint64 array. Returns a new array.
+    '''
+    values = values ^ (values >> np.uint64(30))
+    values *= np.uint64(0xBF58476D1CE4E5B9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94D049BB133111EB)
+    values ^= values >> np.uint64(31)
+    return values
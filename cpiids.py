@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pickle
+import numpy as np
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpiids.py
+
+File Description
+----------------
+
+    Integer identifiers for STITCH chemicals and STRING proteins.
+
+    The dictionaries made in cpi.py repeat strings like 'CIDm91758680' and '9606.ENSP00000257254' tens of millions of times. The registry in this module replaces them by integers that round-trip back to the same strings:
+
+    Identifier            | Code
+    ============================================================
+    CIDm91758680          | -(2 * 91758680 + 0) - 1 = -183517361
+    CIDs91758680          | -(2 * 91758680 + 1) - 1 = -183517362
+    9606.ENSP00000257254  | 0, 1, 2, ... in order of first appearance
+
+    CID codes are negative and protein codes are not, so a code alone says what kind of entity it is and a pair (A, B) from the actions file is never ambiguous. CID codes need no look-up table, the CID number and the stereo ('s') or merged ('m') flag are packed into the integer. Protein codes are dense, so they can index arrays directly.
+'''
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def encodeCid(string):
+    '''
+    'CIDm00010461' --> -20923, 'CIDs00010461' --> -20924
+    '''
+    if string[:3] != 'CID' or string[3] not in 'ms':
+        raise ValueError('%s is not a STITCH chemical identifier.' % string)
+    return -(2 * int(string[4:]) + (string[3] == 's')) - 1
+
+def decodeCid(code):
+    '''
+    -20923 --> 'CIDm00010461', -20924 --> 'CIDs00010461'
+    '''
+    packed = -int(code) - 1
+    return 'CID%s%08d' % ('ms'[packed & 1], packed >> 1)
+
+def isCidCode(code):
+    '''
+    True for chemical codes. Works on integers and Numpy arrays.
+    '''
+    return code < 0
+
+def cidNumber(code):
+    '''
+    Returns the CID number of a chemical code, without the 'm' or 's' flag. Works on integers and Numpy arrays.
+    '''
+    return (-code - 1) >> 1
+
+def isStereo(code):
+    '''
+    True if a chemical code is an 's' (stereo-specific) CID, False if it is an 'm' (merged stereo-isomers) CID. Works on integers and Numpy arrays.
+    '''
+    return ((-code - 1) & 1) == 1
+
+def makeCidCode(number, stereo):
+    '''
+    Inverse of cidNumber and isStereo. Works on integers and Numpy arrays.
+    '''
+    return -(2 * number + stereo) - 1
+
+class IdRegistry:
+    '''
+    Maps STITCH chemical and STRING protein identifiers to integers and back. See the module description for the encoding.
+
+    >>> registry = IdRegistry()
+    >>> registry.encode('9606.ENSP00000257254'), registry.encode('CIDm91758680')
+    (0, -183517361)
+    >>> registry.decode(0), registry.decode(-183517361)
+    ('9606.ENSP00000257254', 'CIDm91758680')
+    '''
+    def __init__(self, prots=()):
+        self.prots = []
+        self.protCodes = {}
+        for prot in prots:
+            self.encode(prot)
+
+    def __len__(self):
+        return len(self.prots)
+
+    def encode(self, string):
+        '''
+        Returns the code of an identifier. Proteins not seen before are added to the registry.
+        '''
+        if string[:3] == 'CID':
+            return encodeCid(string)
+        try:
+            return self.protCodes[string]
+        except KeyError:
+            code = len(self.prots)
+            self.protCodes[string] = code
+            self.prots.append(string)
+            return code
+
+    def decode(self, code):
+        if code < 0:
+            return decodeCid(code)
+        else:
+            return self.prots[code]
+
+    def encodeArray(self, strings):
+        '''
+        Encodes a sequence of identifiers to an int64 array. Each unique string is encoded once.
+        '''
+        strings = np.asarray(strings, dtype=object)
+        if len(strings) == 0:
+            return np.empty(0, dtype=np.int64)
+        uniques, inverse = np.unique(strings, return_inverse=True)
+        lookup = np.array([self.encode(string) for string in uniques], dtype=np.int64)
+        return lookup[inverse.reshape(-1)]
+
+    def decodeArray(self, codes):
+        '''
+        Decodes an array of codes to an object array of strings. Equal codes share a single string object.
+        '''
+        codes = np.asarray(codes, dtype=np.int64)
+        uniques, inverse = np.unique(codes, return_inverse=True)
+        lookup = np.empty(len(uniques), dtype=object)
+        lookup[:] = [self.decode(code) for code in uniques.tolist()]
+        return lookup[inverse.reshape(-1)]
+
+    def encodeVocab(self, table, names):
+        '''
+        Encodes the vocabulary codes used by columns 'names' of a table made by cpiio.loadColumns. Returns a dictionary { name : int64 array of registry codes }.
+
+        Only the vocabulary entries that appear in those columns are registered, so other text columns (like 'mode' in the actions file) do not end up in the registry.
+        '''
+        used = np.unique(np.concatenate([table['columns'][name] for name in names]))
+        vocab = np.array(table['vocab'], dtype=object)
+        lookup = np.zeros(len(vocab), dtype=np.int64)
+        lookup[used] = self.encodeArray(vocab[used])
+        return {name: lookup[table['columns'][name]] for name in names}
+
+    def save(self, fpath):
+        with open(fpath, 'wb') as handle:
+            pickle.dump(self.prots, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fpath):
+        with open(fpath, 'rb') as handle:
+            prots = pickle.load(handle)
+        return cls(prots)
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections, os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from cpicompress import isCompressed, openInput
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpiio.py
+
+File Description
+----------------
+
+    Fast readers for the STITCH and STRING tab-separated files used by cpi.py.
+
+    Instead of building a list of lists one line at a time (see 'loadFile' in cpi.py), files are read in large byte chunks and every column is converted at once into a typed Numpy array. Text columns become integer codes into a vocabulary that is shared by all text columns of the file, and numeric columns become int16 arrays.
+
+    A loaded file is returned as a "table", a dictionary with the format
+
+        table = {'header'  : ['chemical', 'protein', 'combined_score'],
+                 'dtypes'  : {'chemical' : 'code', 'protein' : 'code', 'combined_score' : 'int16'},
+                 'columns' : {'chemical'       : array([0, 0, 1, ...], dtype=int32),
+                              'protein'        : array([2, 3, 4, ...], dtype=int32),
+                              'combined_score' : array([279, 154, 225, ...], dtype=int16)},
+                 'vocab'   : ['CIDm91758680', 'CIDm91758408', '9606.ENSP00000257254', ...]}
+
+    so that table['vocab'][table['columns']['chemical'][0]] is 'CIDm91758680'.
+
+    The STITCH and STRING files used by cpi.py are recognized by their header (see FILE_ORIGINS and getFileOrigin). Each has a fixed schema: the type of every column, which columns are the identifiers and which are scores. Other files still load, with column types guessed from their first row.
+'''
+
+'''
+Meta Global Variables
+'''
+
+# Schemas of the files read by cpi.py, by file origin.
+#   items, the identifier columns.
+#   score, the combined score, None if the file has no score.
+#   subscores, the evidence channels the combined score is computed from.
+#   chemicalColumn, the item column that always holds the chemical. None if the chemical can be in either column, as in the actions file, or if there is no chemical.
+FILE_ORIGINS = {'simpleLinks': {'header': ['chemical', 'protein', 'combined_score'],
+                                'dtypes': {'chemical': 'code', 'protein': 'code', 'combined_score': 'int16'},
+                                'items': ['chemical', 'protein'],
+                                'score': 'combined_score',
+                                'subscores': [],
+                                'chemicalColumn': 'chemical'},
+                'detailedLinks': {'header': ['chemical', 'protein', 'experimental', 'prediction', 'database', 'textmining', 'combined_score'],
+                                  'dtypes': {'chemical': 'code', 'protein': 'code', 'experimental': 'int16', 'prediction': 'int16', 'database': 'int16', 'textmining': 'int16', 'combined_score': 'int16'},
+                                  'items': ['chemical', 'protein'],
+                                  'score': 'combined_score',
+                                  'subscores': ['experimental', 'prediction', 'database', 'textmining'],
+                                  'chemicalColumn': 'chemical'},
+                'actions': {'header': ['item_id_a', 'item_id_b', 'mode', 'action', 'a_is_acting', 'score'],
+                            'dtypes': {'item_id_a': 'code', 'item_id_b': 'code', 'mode': 'code', 'action': 'code', 'a_is_acting': 'code', 'score': 'int16'},
+                            'items': ['item_id_a', 'item_id_b'],
+                            'score': 'score',
+                            'subscores': [],
+                            'chemicalColumn': None},
+                'proteinAliases': {'header': ['string_protein_id', 'alias', 'source'],
+                                   'dtypes': {'string_protein_id': 'code', 'alias': 'code', 'source': 'code'},
+                                   'items': ['string_protein_id'],
+                                   'score': None,
+                                   'subscores': [],
+                                   'chemicalColumn': None}}
+
+INT_WIDTH = 5 # digits read by parseIntColumns, enough for int16
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def readHeader(fpath):
+    '''
+    Returns the column names of a STITCH or STRING file.
+
+    Most files have a tab-separated header, but the protein aliases file has a header in the format '## string_protein_id ## alias ## source ##'. Both are handled.
+    '''
+    with openInput(fpath) as f:
+        line = f.readline().decode().rstrip('\r\n')
+    if line.startswith('##'):
+        return [name.strip() for name in line.split('##') if name.strip()]
+    else:
+        return line.split('\t')
+
+def getFileOrigin(header):
+    '''
+    Returns the file origin (a key of FILE_ORIGINS) of a file from its column names, as returned by readHeader, or None if the header is not one of them.
+    '''
+    for fileOrigin, schema in FILE_ORIGINS.items():
+        if header == schema['header']:
+            return fileOrigin
+    return None
+
+def getSchema(fpath, header=None):
+    '''
+    Returns the schema of a STITCH or STRING file (see FILE_ORIGINS), with its origin under 'fileOrigin'. Raises ValueError for files with another header.
+    '''
+    if header is None:
+        header = readHeader(fpath)
+    fileOrigin = getFileOrigin(header)
+    if fileOrigin is None:
+        raise ValueError('Unknown file type of %s, with columns %s. Known file types are %s.' % (fpath, ', '.join(header), ', '.join(FILE_ORIGINS)))
+    schema = dict(FILE_ORIGINS[fileOrigin])
+    schema['fileOrigin'] = fileOrigin
+    return schema
+
+def inferDtypes(fpath, header):
+    '''
+    Returns the type of each column. Files with a known header get the types of their schema (see FILE_ORIGINS). For other files the types are guessed from the first row of data: columns with only digits are 'int16', everything else is 'code'.
+    '''
+    fileOrigin = getFileOrigin(header)
+    if fileOrigin is not None:
+        return dict(FILE_ORIGINS[fileOrigin]['dtypes'])
+    with openInput(fpath) as f:
+        f.readline()
+        row = f.readline().decode().rstrip('\r\n').split('\t')
+    dtypes = {}
+    for name, field in zip(header, row):
+        if field.isdigit():
+            dtypes[name] = 'int16'
+        else:
+            dtypes[name] = 'code'
+    return dtypes
+
+def readBlocks(f, chunkSize, maxRows=None, end=None):
+    '''
+    Yields byte blocks of roughly 'chunkSize' bytes from an open binary file. Every block ends on a line boundary. If 'maxRows' is given, no more than 'maxRows' lines are yielded in total. If 'end' is given, reading stops at that byte offset, which must be the start of a line (see getShards).
+    '''
+    numRows = 0
+    while True:
+        if end is not None:
+            block = f.read(max(0, min(chunkSize, end - f.tell())))
+        else:
+            block = f.read(chunkSize)
+        if not block:
+            break
+        if not block.endswith(b'\n'):
+            block += f.readline()
+            if not block.endswith(b'\n'):
+                block += b'\n'
+        if maxRows is not None:
+            n = block.count(b'\n')
+            if numRows + n >= maxRows:
+                lines = block.split(b'\n', maxRows - numRows)
+                block = b'\n'.join(lines[:maxRows - numRows]) + b'\n'
+                yield block
+                break
+            numRows += n
+        yield block
+
+class Numbering(dict):
+    '''
+    Dictionary that numbers its keys in order of first look-up: numbering[key] is len(numbering) the first time 'key' is looked up. Keys seen before are looked up without running any Python code.
+    '''
+    def __missing__(self, key):
+        value = self[key] = len(self)
+        return value
+
+def encodeColumn(fields, vocab):
+    '''
+    Converts a list of byte strings to an int32 array of codes. 'vocab' is a dictionary { string : code } that is updated in place with strings not seen before, in order of first appearance.
+
+    The fields are numbered with a Numbering local to the column, and only its distinct values are decoded and looked up in 'vocab'. This is about twice as fast as numbering them with Numpy's sort (np.unique), which has to compare fixed-width byte strings.
+    '''
+    local = Numbering()
+    codes = np.fromiter(map(local.__getitem__, fields), dtype=np.int32, count=len(fields))
+    lookup = np.array([vocab.setdefault(value.decode(), len(vocab)) for value in local], dtype=np.int32)
+    return lookup[codes]
+
+def parseIntColumns(block, numCols, cols, width=INT_WIDTH):
+    '''
+    Parses columns 'cols' of a block of whole tab-separated lines as non-negative integers, straight from the bytes of the block. Returns an int32 array with one row per line and one column per entry of 'cols', or None if a field is not 1 to 'width' digits, in which case the caller should convert the fields one by one.
+
+    Every field is read as the last 'width' bytes before its separator, with the bytes before the field masked out, so there is no Python loop over fields.
+    '''
+    array = np.frombuffer(block, dtype=np.uint8)
+    separators = np.flatnonzero((array == 9) | (array == 10))
+    if len(separators) % numCols != 0:
+        raise ValueError('Expected %d tab-separated columns per line. The block has %d fields.' % (numCols, len(separators)))
+    ends = separators.reshape(-1, numCols)
+    padded = np.concatenate([np.full(width, ord('0'), dtype=np.uint8), array]) # so that windows of the first field do not wrap around
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int32)
+    values = np.empty((len(ends), len(cols)), dtype=np.int32)
+    for j, col in enumerate(cols):
+        if col == 0:
+            starts = np.concatenate([[0], ends[:-1, -1] + 1])
+        else:
+            starts = ends[:, col - 1] + 1
+        lengths = ends[:, col] - starts
+        if len(lengths) > 0 and (lengths.min() < 1 or lengths.max() > width):
+            return None
+        digits = padded[ends[:, col, None] + np.arange(width)].astype(np.int32) - ord('0')
+        digits[np.arange(width) < (width - lengths)[:, None]] = 0
+        if len(digits) > 0 and (digits.min() < 0 or digits.max() > 9):
+            return None
+        values[:, j] = digits @ powers
+    return values
+
+def splitBlock(block, header, dtypes, vocab):
+    '''
+    Splits a block of tab-separated lines into a dictionary of typed column arrays.
+
+    Integer columns are parsed from the bytes of the block with parseIntColumns, which is several times faster than converting a list of byte strings with Numpy. Fields it cannot parse are converted one by one, which raises an error for fields that are not numbers.
+    '''
+    numCols = len(header)
+    block = block.replace(b'\r', b'')
+    fields = block.rstrip(b'\n').replace(b'\n', b'\t').split(b'\t')
+    if len(fields) % numCols != 0:
+        raise ValueError('Expected %d tab-separated columns per line. The block has %d fields.' % (numCols, len(fields)))
+    intCols = [i for i, name in enumerate(header) if dtypes[name] != 'code' and np.dtype(dtypes[name]).kind in 'iu']
+    ints = None
+    if len(intCols) > 0 and len(fields) > 1:
+        if not block.endswith(b'\n'):
+            block += b'\n'
+        ints = parseIntColumns(block, numCols, intCols)
+    columns = {}
+    for i, name in enumerate(header):
+        column = fields[i::numCols]
+        if dtypes[name] == 'code':
+            columns[name] = encodeColumn(column, vocab)
+        elif ints is not None and i in intCols:
+            values = ints[:, intCols.index(i)]
+            info = np.iinfo(dtypes[name])
+            if values.max(initial=0) > info.max:
+                raise OverflowError('Column %s has values above %d, the largest %s.' % (name, info.max, dtypes[name]))
+            columns[name] = values.astype(dtypes[name])
+        else:
+            columns[name] = np.array(column).astype(dtypes[name])
+    return columns
+
+def iterColumns(fpath, dtypes=None, vocab=None, chunkSize=2**25, maxRows=None):
+    '''
+    Yields the file at 'fpath' as a sequence of column dictionaries, one per chunk of about 'chunkSize' bytes. Only one chunk is held in memory at a time.
+
+    INPUT:  fpath, string, path to a STITCH or STRING tab-separated file with a header, uncompressed or compressed (see cpicompress.py).
+            dtypes, dictionary, { column name : 'code' or a Numpy dtype }. Inferred from the first row if not given.
+            vocab, dictionary, { string : code } shared by all 'code' columns. Updated in place.
+            chunkSize, integer, the number of bytes to read per chunk.
+            maxRows, integer, the number of data rows to read. Reads the whole file if None.
+    OUTPUT: a generator of dictionaries { column name : array }
+    '''
+    header = readHeader(fpath)
+    if dtypes is None:
+        dtypes = inferDtypes(fpath, header)
+    if vocab is None:
+        vocab = {}
+    with openInput(fpath) as f:
+        f.readline()
+        for block in readBlocks(f, chunkSize, maxRows):
+            yield splitBlock(block, header, dtypes, vocab)
+
+def loadColumns(fpath, dtypes=None, chunkSize=2**25, maxRows=None):
+    '''
+    Reads a whole tab-separated file into a table. See the module description for the table format. Arguments are the same as for 'iterColumns'.
+
+    Each chunk is split with a single call to bytes.split and each column is converted by one Numpy call, so there is no Python-level loop over rows.
+    '''
+    header = readHeader(fpath)
+    if dtypes is None:
+        dtypes = inferDtypes(fpath, header)
+    vocab = {}
+    chunks = list(iterColumns(fpath, dtypes=dtypes, vocab=vocab, chunkSize=chunkSize, maxRows=maxRows))
+    columns = {}
+    for name in header:
+        if dtypes[name] == 'code':
+            dtype = np.int32
+        else:
+            dtype = dtypes[name]
+        columns[name] = np.concatenate([chunk[name] for chunk in chunks] + [np.empty(0, dtype=dtype)])
+    table = {'header': header, 'dtypes': dtypes, 'columns': columns, 'vocab': list(vocab)}
+    return table
+
+def decodeColumn(table, name):
+    '''
+    Returns column 'name' of a table as an object array of strings. Equal strings share a single Python object, which saves a great deal of memory over one string per row.
+    '''
+    column = table['columns'][name]
+    if table['dtypes'][name] == 'code':
+        vocab = np.array(table['vocab'], dtype=object)
+        return vocab[column]
+    else:
+        return column
+
+def mergeTables(tables):
+    '''
+    Concatenates tables that were loaded with separate vocabularies, for example one per shard, into one table with a single vocabulary.
+    '''
+    header, dtypes = tables[0]['header'], tables[0]['dtypes']
+    vocab = {}
+    parts = {name: [] for name in header}
+    for table in tables:
+        remap = np.array([vocab.setdefault(string, len(vocab)) for string in table['vocab']], dtype=np.int32)
+        for name in header:
+            if dtypes[name] == 'code':
+                parts[name].append(remap[table['columns'][name]])
+            else:
+                parts[name].append(table['columns'][name])
+    columns = {name: np.concatenate(parts[name]) for name in header}
+    return {'header': header, 'dtypes': dtypes, 'columns': columns, 'vocab': list(vocab)}
+
+def getShards(fpath, numShards):
+    '''
+    Splits the data rows of a file into about 'numShards' byte ranges [start, end). Every range starts at the beginning of a line, so shards can be parsed independently. The header line is not part of any shard.
+    '''
+    size = os.path.getsize(fpath)
+    with open(fpath, 'rb') as f:
+        f.readline()
+        offsets = [f.tell()]
+        for i in range(1, numShards):
+            f.seek(max(offsets[0], size * i // numShards))
+            f.readline()
+            offsets.append(min(f.tell(), size))
+    offsets.append(size)
+    offsets = sorted(set(offsets))
+    return list(zip(offsets[:-1], offsets[1:]))
+
+def readShard(fpath, start, end, dtypes=None, chunkSize=2**25):
+    '''
+    Loads the rows in the byte range [start, end) of a file as a table with its own vocabulary. Used by the worker processes of loadColumnsParallel.
+    '''
+    header = readHeader(fpath)
+    if dtypes is None:
+        dtypes = inferDtypes(fpath, header)
+    vocab = {}
+    chunks = []
+    with open(fpath, 'rb') as f:
+        f.seek(start)
+        for block in readBlocks(f, chunkSize, end=end):
+            chunks.append(splitBlock(block, header, dtypes, vocab))
+    return chunksToTable(chunks, header, dtypes, vocab)
+
+def chunksToTable(chunks, header, dtypes, vocab):
+    '''
+    Concatenates the column dictionaries of splitBlock into a table.
+    '''
+    columns = {}
+    for name in header:
+        if dtypes[name] == 'code':
+            dtype = np.int32
+        else:
+            dtype = dtypes[name]
+        columns[name] = np.concatenate([chunk[name] for chunk in chunks] + [np.empty(0, dtype=dtype)])
+    return {'header': header, 'dtypes': dtypes, 'columns': columns, 'vocab': list(vocab)}
+
+def readBlock(block, header, dtypes):
+    '''
+    Loads a byte block of whole lines as a table with its own vocabulary. Used by the worker processes of loadColumnsParallel for compressed files.
+    '''
+    vocab = {}
+    return chunksToTable([splitBlock(block, header, dtypes, vocab)], header, dtypes, vocab)
+
+def loadBlocksParallel(fpath, header, dtypes, numProcs, chunkSize):
+    '''
+    loadColumnsParallel for compressed files, which can not be split into byte ranges. The file is decompressed in the background (see cpicompress.openInput) and its blocks are parsed in a process pool as they come. No more than 2 * numProcs blocks wait for a worker, so memory stays bounded however large the file.
+    '''
+    tables = []
+    with ProcessPoolExecutor(max_workers=numProcs) as pool, openInput(fpath) as f:
+        f.readline()
+        futures = collections.deque()
+        for block in readBlocks(f, chunkSize):
+            futures.append(pool.submit(readBlock, block, header, dtypes))
+            if len(futures) >= 2 * numProcs:
+                tables.append(futures.popleft().result())
+        tables.extend(future.result() for future in futures)
+    if len(tables) == 0:
+        return chunksToTable([], header, dtypes, {})
+    return mergeTables(tables)
+
+def loadColumnsParallel(fpath, dtypes=None, numProcs=None, chunkSize=2**25, lineIndex=None):
+    '''
+    Same as loadColumns, but the file is split into one shard per process (see getShards) and the shards are parsed in a process pool. The partial tables are merged with mergeTables, so the result has the same format and row order as loadColumns.
+
+    INPUT:  numProcs, integer, the number of worker processes. Defaults to the number of CPUs.
+            lineIndex, a LineIndex of the file, optional (see cpilines.py). If given, the shards have the same number of rows rather than the same number of bytes.
+
+    Compressed files are decompressed as a stream and parsed block by block instead (see loadBlocksParallel), and 'lineIndex' is not used.
+    '''
+    if numProcs is None:
+        numProcs = os.cpu_count()
+    header = readHeader(fpath)
+    if dtypes is None:
+        dtypes = inferDtypes(fpath, header)
+    if isCompressed(fpath):
+        return loadBlocksParallel(fpath, header, dtypes, numProcs, chunkSize)
+    if lineIndex is None:
+        shards = getShards(fpath, numProcs)
+    else:
+        shards = lineIndex.getShards(numProcs)
+    if len(shards) == 0:
+        return readShard(fpath, 0, 0, dtypes)
+    with ProcessPoolExecutor(max_workers=numProcs) as pool:
+        futures = [pool.submit(readShard, fpath, start, end, dtypes, chunkSize) for start, end in shards]
+        tables = [future.result() for future in futures]
+    return mergeTables(tables)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, zipfile
+import numpy as np
+from cpicompress import openInput
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpilines.py
+
+File Description
+----------------
+
+    Line index of an input file, saved next to it as a sidecar file, e.g. '9606.actions.v5.0.tsv.lines.npz'. The index is built once with one pass of large reads, and then gives
+
+        - the number of lines, without reading the file,
+        - random access to line or row k,
+        - byte ranges with the same number of rows, for parsing a file in parallel (see cpiio.loadColumnsParallel).
+
+    Only the byte offset of every 'stride'-th line is kept, so the index of a file with 1.5 billion lines takes 12 MB instead of 12 GB. Line k is found by seeking to line k - k % stride and reading fewer than 'stride' lines from there.
+
+    The sidecar records the size and modification time of the file, and is rebuilt when they change.
+
+    Compressed files (see cpicompress.py) are indexed too. Their offsets are positions in the decompressed data, which can only be read forward from the start, so getting a line means decompressing the file up to it. The index still gives the number of lines without reading the file.
+'''
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def getIndexPath(fpath):
+    return fpath + '.lines.npz'
+
+def scanLines(fpath, stride=1024, blockSize=2**24):
+    '''
+    Reads the file once and returns the number of lines, the byte offsets of lines 0, stride, 2 * stride, ... as an int64 array, and the size of the data, which for compressed files is the decompressed size. A last line without a newline is counted.
+    '''
+    parts = [np.zeros(1, dtype=np.int64)]
+    numNewlines = 0
+    position = 0
+    lastByte = b'\n'
+    buffer = bytearray(blockSize)
+    with openInput(fpath) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            newlines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8, count=n) == 10)
+            # Line i starts after newline i - 1, so line j * stride starts after newline j * stride - 1
+            first = (-(numNewlines + 1)) % stride
+            parts.append(newlines[first::stride] + position + 1)
+            numNewlines += len(newlines)
+            position += n
+            lastByte = buffer[n-1:n]
+    size = position
+    offsets = np.concatenate(parts)
+    if size > 0 and offsets[-1] == size:
+        offsets = offsets[:-1] # the file ends with a newline, there is no line after it
+    numLines = numNewlines + (lastByte != b'\n')
+    return numLines, offsets, size
+
+class LineIndex:
+    '''
+    Line index of a file. See the module description.
+
+    >>> index = getLineIndex(dataDir + '9606.actions.v5.0.tsv')
+    >>> index.numRows
+    22365356
+    >>> index.getRow(0)
+    '9606.ENSP00000170630\\tCIDs00003038\\tactivation\\t\\tf\\t150'
+    >>> index.getShards(4)
+    [(57, 240127210), (240127210, 480264316), ...]
+    '''
+    def __init__(self, fpath, numLines, offsets, stride, size, mtime, fileSize=None):
+        self.fpath = fpath
+        self.numLines = numLines
+        self.offsets = offsets
+        self.stride = stride
+        self.size = size # of the data, decompressed if the file is compressed
+        self.mtime = mtime
+        if fileSize is None:
+            fileSize = size
+        self.fileSize = fileSize
+
+    @classmethod
+    def build(cls, fpath, stride=1024, blockSize=2**24):
+        stat = os.stat(fpath)
+        numLines, offsets, size = scanLines(fpath, stride, blockSize)
+        return cls(fpath, numLines, offsets, stride, size, stat.st_mtime_ns, stat.st_size)
+
+    def save(self, indexPath=None):
+        if indexPath is None:
+            indexPath = getIndexPath(self.fpath)
+        with open(indexPath, 'wb') as f:
+            np.savez(f, numLines=self.numLines, offsets=self.offsets, stride=self.stride, size=self.size, mtime=self.mtime, fileSize=self.fileSize)
+
+    @classmethod
+    def load(cls, fpath, indexPath=None):
+        if indexPath is None:
+            indexPath = getIndexPath(fpath)
+        with np.load(indexPath) as arrays:
+            return cls(fpath, int(arrays['numLines']), arrays['offsets'], int(arrays['stride']), int(arrays['size']), int(arrays['mtime']), int(arrays['fileSize']))
+
+    def isCurrent(self):
+        '''
+        True if the file has the size and modification time it had when the index was built.
+        '''
+        stat = os.stat(self.fpath)
+        return stat.st_size == self.fileSize and stat.st_mtime_ns == self.mtime
+
+    def __len__(self):
+        return self.numLines
+
+    @property
+    def numRows(self):
+        '''
+        Number of data rows, all lines but the header.
+        '''
+        return max(self.numLines - 1, 0)
+
+    def getOffset(self, k, f=None):
+        '''
+        Returns the byte offset of line k. Line numLines is the end of the file.
+        '''
+        if k < 0 or k > self.numLines:
+            raise IndexError('Line %d is out of range, the file has %d lines.' % (k, self.numLines))
+        if k == self.numLines:
+            return self.size
+        if f is None:
+            with openInput(self.fpath) as f:
+                return self.getOffset(k, f)
+        f.seek(int(self.offsets[k // self.stride]))
+        for _ in range(k % self.stride):
+            f.readline()
+        return f.tell()
+
+    def getLines(self, start, stop):
+        '''
+        Returns lines start to stop - 1 as a list of strings, without newlines.
+        '''
+        start, stop = max(start, 0), min(stop, self.numLines)
+        if start >= stop:
+            return []
+        with openInput(self.fpath) as f:
+            f.seek(self.getOffset(start, f))
+            return [f.readline().decode().rstrip('\r\n') for _ in range(stop - start)]
+
+    def getLine(self, k):
+        lines = self.getLines(k, k + 1)
+        if len(lines) == 0:
+            raise IndexError('Line %d is out of range, the file has %d lines.' % (k, self.numLines))
+        return lines[0]
+
+    def getRow(self, k):
+        '''
+        Returns data row k, which is line k + 1.
+        '''
+        return self.getLine(k + 1)
+
+    def getRows(self, start, stop):
+        return self.getLines(start + 1, stop + 1)
+
+    def getShards(self, numShards):
+        '''
+        Splits the data rows into about 'numShards' byte ranges [start, end) with the same number of rows, give or take 'stride'. Same format as cpiio.getShards.
+        '''
+        if self.numRows == 0:
+            return []
+        # Shards start at indexed lines, so no lines need to be read to find them
+        blocks = np.round(np.linspace(0, self.numLines, numShards + 1)[1:-1] / self.stride).astype(np.int64)
+        offsets = [self.getOffset(1)] + [int(self.offsets[block]) for block in blocks.tolist() if block * self.stride > 1 and block < len(self.offsets)] + [self.size]
+        offsets = sorted(set(offsets))
+        return list(zip(offsets[:-1], offsets[1:]))
+
+def getLineIndex(fpath, stride=1024, save=True):
+    '''
+    Returns the line index of a file. The sidecar file is loaded if it is current, otherwise, or if it can not be read, the index is built, and saved if 'save' is True and the directory is writable.
+    '''
+    try:
+        index = LineIndex.load(fpath)
+        if index.isCurrent():
+            return index
+    except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile): # missing, old or damaged sidecar
+        pass
+    index = LineIndex.build(fpath, stride)
+    if save:
+        try:
+            index.save()
+        except OSError:
+            pass
+    return index
+
+def countLines(fpath):
+    '''
+    Number of lines of a file, including the header, from its line index.
+    '''
+    return getLineIndex(fpath).numLines
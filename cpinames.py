@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json, os, zlib
+import numpy as np
+from cpistore import makeStringTable, StringTable, saveMappedDic, MappedDic
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpinames.py
+
+File Description
+----------------
+
+    Name index over the reverse dictionaries, chemSynsRDic and protSynsRDic, for exact, case-insensitive and prefix look-ups of chemical and protein names.
+
+    A name index is a memory-mapped dictionary (see cpistore.py) with a few more arrays:
+
+    File              | Contents
+    ============================================================================
+    keyPrefixes.npy   | the first PREFIX_WIDTH bytes of every key, as a fixed-width Numpy bytes array
+    foldOffsets.npy   | the case-folded keys, sorted, as a string table
+    foldBlob.npy      |
+    foldPrefixes.npy  | the first PREFIX_WIDTH bytes of every case-folded key
+    foldOrder.npy     | the key row of every case-folded key
+    keyHashes.npy     | the CRC-32 of every key, sorted
+    hashOrder.npy     | the key row of every hash
+
+    Exact look-ups of many names at once ('positions') hash the names and find them with np.searchsorted on the sorted hashes, then check the candidates against the names byte by byte, all in Numpy. Prefix and case-insensitive searches are narrowed with np.searchsorted on the fixed-width prefixes, and only names longer than the prefixes need a few more comparisons on the full strings.
+'''
+
+'''
+Meta Global Variables
+'''
+
+PREFIX_WIDTH = 16
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def toPrefixArray(encoded):
+    '''
+    Converts a list of byte strings to a fixed-width Numpy bytes array of their first PREFIX_WIDTH bytes. The array is in the same order as the byte strings, so it can be searched in their place.
+    '''
+    return np.array(encoded, dtype='S%d' % PREFIX_WIDTH)
+
+def saveNameIndex(dic, dirPath):
+    '''
+    Writes a dictionary { name : [value1, value2, ...] } to 'dirPath' as a name index. Load it with loadNameIndex. 'dic' can also be a MappedDic.
+    '''
+    saveMappedDic(dic, dirPath)
+    with open(os.path.join(dirPath, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['keyType'] != 'str':
+        raise ValueError('A name index needs string keys, not %s.' % meta['keyType'])
+    keyTable = StringTable(np.load(os.path.join(dirPath, 'keyOffsets.npy')), np.load(os.path.join(dirPath, 'keyBlob.npy')))
+    keys = [keyTable.getBytes(i) for i in range(len(keyTable))]
+    np.save(os.path.join(dirPath, 'keyPrefixes.npy'), toPrefixArray(keys))
+    hashes = np.array([zlib.crc32(key) for key in keys], dtype=np.uint32)
+    hashOrder = np.argsort(hashes, kind='stable')
+    np.save(os.path.join(dirPath, 'keyHashes.npy'), hashes[hashOrder])
+    np.save(os.path.join(dirPath, 'hashOrder.npy'), hashOrder.astype(np.int64))
+
+    folded = [key.decode().casefold().encode() for key in keys]
+    foldOrder = np.array(sorted(range(len(folded)), key=folded.__getitem__), dtype=np.int64)
+    folded = [folded[i] for i in foldOrder]
+    foldOffsets, foldBlob = makeStringTable([key.decode() for key in folded])
+    np.save(os.path.join(dirPath, 'foldOffsets.npy'), foldOffsets)
+    np.save(os.path.join(dirPath, 'foldBlob.npy'), foldBlob)
+    np.save(os.path.join(dirPath, 'foldPrefixes.npy'), toPrefixArray(folded))
+    np.save(os.path.join(dirPath, 'foldOrder.npy'), foldOrder)
+
+    meta['nameIndex'] = True
+    with open(os.path.join(dirPath, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+class NameIndex(MappedDic):
+    '''
+    Memory-mapped reverse dictionary with exact, case-insensitive and prefix look-ups. It is also a MappedDic, so index[name] works as with the dictionary it was made from.
+
+    >>> saveNameIndex(protSynsRDic, DIR + 'protSynsNames')
+    >>> names = loadNameIndex(DIR + 'protSynsNames')
+    >>> names.prefix('(2E,6E)-farnesyl')
+    ['(2E,6E)-farnesyl diphosphate synthase', '(2E,6E)-farnesyl diphosphate synthetase']
+    >>> names.lookupFolded('FDPS')
+    {'FDPS': [('9606.ENSP00000349078', 'BLAST_KEGG_NAME ...'), ...], 'fdps': [...]}
+    >>> names.positions(['FDPS', 'not a protein'])
+    array([ 2085, -1])
+    '''
+    def __init__(self, dirPath):
+        MappedDic.__init__(self, dirPath)
+        load = lambda name: np.load(os.path.join(dirPath, name + '.npy'), mmap_mode='r')
+        self.keyPrefixes = load('keyPrefixes')
+        self.foldTable = StringTable(load('foldOffsets'), load('foldBlob'))
+        self.foldPrefixes = load('foldPrefixes')
+        self.foldOrder = load('foldOrder')
+        self.keyHashes = load('keyHashes')
+        self.hashOrder = load('hashOrder')
+
+    def searchRange(self, table, target, lo, hi, upper):
+        '''
+        Refines the range [lo, hi) of 'table', found from the fixed-width prefixes, to the rows with full bytes < target (upper=False) or <= target (upper=True). Returns the first row past those.
+        '''
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key = table.getBytes(mid)
+            if key < target or (upper and key == target):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def equalRange(self, table, prefixes, target):
+        '''
+        Returns the range [lo, hi) of rows of 'table' equal to 'target' (bytes).
+        '''
+        lo = int(np.searchsorted(prefixes, target[:PREFIX_WIDTH], 'left'))
+        hi = int(np.searchsorted(prefixes, target[:PREFIX_WIDTH], 'right'))
+        if len(target) < PREFIX_WIDTH:
+            # Rows with a shorter prefix than PREFIX_WIDTH are the whole key, so they are all equal to 'target'
+            return lo, hi
+        return self.searchRange(table, target, lo, hi, False), self.searchRange(table, target, lo, hi, True)
+
+    def prefixRange(self, table, prefixes, target):
+        '''
+        Returns the range [lo, hi) of rows of 'table' that start with 'target' (bytes).
+        '''
+        if len(target) < PREFIX_WIDTH:
+            # b'\xff' is never part of UTF-8, so target + b'\xff' sorts after every key that starts with target
+            lo = int(np.searchsorted(prefixes, target, 'left'))
+            hi = int(np.searchsorted(prefixes, target + b'\xff', 'left'))
+            return lo, hi
+        lo = int(np.searchsorted(prefixes, target[:PREFIX_WIDTH], 'left'))
+        hi = int(np.searchsorted(prefixes, target[:PREFIX_WIDTH], 'right'))
+        return self.searchRange(table, target, lo, hi, False), self.searchRange(table, target + b'\xff', lo, hi, False)
+
+    def position(self, key):
+        lo, hi = self.equalRange(self.keyTable, self.keyPrefixes, key.encode())
+        if lo < hi:
+            return lo
+        return -1
+
+    def positions(self, names):
+        '''
+        Returns the rows of a list of names as an array, -1 for names not in the index. The whole list is searched at once, so this is much faster per name than 'position'.
+        '''
+        encoded = [name.encode() for name in names]
+        hashes = np.fromiter((zlib.crc32(target) for target in encoded), dtype=np.uint32, count=len(encoded))
+        results = np.full(len(encoded), -1, dtype=np.int64)
+        if len(encoded) == 0 or len(self.keyHashes) == 0:
+            return results
+
+        # Searching for the hashes in sorted order keeps the reads of keyHashes close together
+        order = np.argsort(hashes)
+        los = np.empty(len(hashes), dtype=np.int64)
+        los[order] = np.searchsorted(self.keyHashes, hashes[order])
+        lastRow = len(self.keyHashes) - 1
+        found = (los <= lastRow) & (self.keyHashes[np.minimum(los, lastRow)] == hashes)
+        nextHashes = self.keyHashes[np.minimum(los + 1, lastRow)]
+        collided = found & (los < lastRow) & (nextHashes == hashes)
+
+        # Names whose hash matches one key: compare lengths, then all bytes at once
+        single = np.flatnonzero(found & ~collided)
+        rows = np.asarray(self.hashOrder[los[single]])
+        offsets = self.keyTable.offsets
+        starts = np.asarray(offsets[rows])
+        lengths = np.array([len(encoded[i]) for i in single.tolist()], dtype=np.int64)
+        sameLength = np.asarray(offsets[rows + 1]) - starts == lengths
+        single, rows, starts, lengths = single[sameLength], rows[sameLength], starts[sameLength], lengths[sameLength]
+        queryBlob = np.frombuffer(b''.join([encoded[i] for i in single.tolist()]), dtype=np.uint8)
+        queryStarts = np.zeros(len(single), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=queryStarts[1:])
+        keyBytes = self.keyTable.blob[np.repeat(starts - queryStarts, lengths) + np.arange(len(queryBlob))]
+        mismatches = np.zeros(len(queryBlob) + 1, dtype=np.int64)
+        np.cumsum(keyBytes != queryBlob, out=mismatches[1:])
+        equal = mismatches[queryStarts + lengths] == mismatches[queryStarts]
+        results[single[equal]] = rows[equal]
+
+        # Hash collisions are rare, and are searched one by one
+        for i in np.flatnonzero(collided).tolist():
+            results[i] = self.position(names[i])
+        return results
+
+    def lookup(self, name):
+        '''
+        Exact look-up. Returns the values of 'name', or an empty list if it is not in the index.
+        '''
+        return self.get(name, [])
+
+    def lookupMany(self, names):
+        '''
+        Exact look-up of a list of names. Returns a list with the values of each name, or None for names not in the index.
+        '''
+        return [self.valuesAt(i) if i >= 0 else None for i in self.positions(names).tolist()]
+
+    def foldedRows(self, lo, hi):
+        return sorted(self.foldOrder[lo:hi].tolist())
+
+    def lookupFolded(self, name):
+        '''
+        Case-insensitive look-up. Returns a dictionary { name in the index : values } of every name that is equal to 'name' when both are case-folded.
+        '''
+        lo, hi = self.equalRange(self.foldTable, self.foldPrefixes, name.casefold().encode())
+        return {self.decodeKey(i): self.valuesAt(i) for i in self.foldedRows(lo, hi)}
+
+    def prefix(self, prefix, caseSensitive=True, limit=None):
+        '''
+        Returns the names in the index that start with 'prefix', in sorted order, and no more than 'limit' of them if given. With caseSensitive=False the names are compared case-folded.
+        '''
+        if caseSensitive:
+            lo, hi = self.prefixRange(self.keyTable, self.keyPrefixes, prefix.encode())
+            rows = range(lo, hi)
+        else:
+            lo, hi = self.prefixRange(self.foldTable, self.foldPrefixes, prefix.casefold().encode())
+            rows = self.foldedRows(lo, hi)
+        if limit is not None:
+            rows = rows[:limit]
+        return [self.decodeKey(i) for i in rows]
+
+    def prefixItems(self, prefix, caseSensitive=True, limit=None):
+        '''
+        Same as 'prefix', but returns a dictionary { name : values }.
+        '''
+        return {name: self[name] for name in self.prefix(prefix, caseSensitive, limit)}
+
+def loadNameIndex(dirPath):
+    return NameIndex(dirPath)
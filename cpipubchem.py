@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio, functools, io, sqlite3, time
+import xml.etree.ElementTree as ET
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpipubchem.py
+
+File Description
+----------------
+
+    Helpers for downloading CID synonyms and properties from PubChem's PUG REST utility (see 'downloadCidSyns' in cpi.py).
+
+    CIDs are sent either in the URL of GET requests, about 190 per request, or in the body of POST requests in batches sized by 'BatchSizer' from the latency and size of earlier responses.
+
+    Requests are made concurrently by 'fetchAll', which keeps a fixed number of requests in flight while a token bucket holds the request rate to PubChem's usage policy (no more than 5 requests per second). Failed requests (503 "server busy" and the like) are retried with exponential backoff.
+
+    Responses are parsed incrementally by 'parseRecords' into (cid, values) records, so no document tree is kept.
+
+    Responses are kept in a local cache on disk, one entry per CID and mine type ('synonyms' or 'properties'). A run only requests the CIDs that are not in the cache yet, and because every chunk is written to the cache as soon as it arrives, a run that crashes resumes after the last completed chunk.
+'''
+
+'''
+Meta Global Variables
+'''
+
+PUG_REST_URL = 'https://pubchem.ncbi.nlm.nih.gov/rest/pug/'
+RETRY_STATUS = (429, 500, 502, 503, 504)
+PROPERTIES = 'AtomStereoCount,DefinedAtomStereoCount,UndefinedAtomStereoCount,BondStereoCount,DefinedBondStereoCount,UndefinedBondStereoCount'
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def getPugUrl(cidChunk, mineType, baseUrl=PUG_REST_URL):
+    '''
+    Returns the PUG REST URL for a comma-separated string of CID numbers. 'baseUrl' can point to a local server for testing. If 'cidChunk' is None the URL has no CIDs, for POST requests that send them in the request body (see getPostData).
+    '''
+    if cidChunk is None:
+        url = baseUrl + 'compound/cid/'
+    else:
+        url = baseUrl + 'compound/cid/' + cidChunk + '/'
+    if mineType == 'synonyms':
+        return url + 'synonyms/XML'
+    elif mineType == 'properties':
+        return url + 'property/' + PROPERTIES + '/XML'
+    else:
+        raise ValueError('mineType must be \'synonyms\' or \'properties\', not %s.' % mineType)
+
+def getPostData(cidChunk):
+    '''
+    Returns the body of a POST request for a comma-separated string of CID numbers.
+    '''
+    return {'cid': cidChunk}
+
+class BatchSizer:
+    '''
+    Chooses the number of CIDs per POST request from the responses seen so far.
+
+    A GET request has to fit its CIDs in the URL, which allows about 190 per request. A POST request has no such limit, but a batch that is too large takes long enough to hit PubChem's time-out, and its response can be tens of megabytes. After each response the time and bytes per CID are measured, and the next batch is sized to take about 'targetLatency' seconds and return no more than 'maxBytes' bytes. The size at most doubles or halves from one batch to the next, and is halved after a failed request.
+
+    Every batch is recorded in 'history' as a dictionary {'batchSize', 'latency', 'bytes', 'status'}, so the sizes chosen and the latencies seen can be examined after a run:
+
+    >>> sizer = BatchSizer()
+    >>> chemSynsDic, chemSynsRDic = makeChemSynsDic(DIR, outDir, cidList, method='post', sizer=sizer)
+    >>> sizer.summary()
+    {'numBatches': 57, 'numCids': 115011, 'meanBatchSize': 2017.7, 'maxBatchSize': 4000, 'meanLatency': 3.9, 'maxLatency': 7.2}
+    '''
+    def __init__(self, size=500, minSize=10, maxSize=10000, targetLatency=5.0, maxBytes=2**23):
+        self.size = size
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.targetLatency = targetLatency
+        self.maxBytes = maxBytes
+        self.history = []
+
+    def update(self, batchSize, latency, numBytes, status):
+        '''
+        Records a finished batch and sets the size of the next one.
+        '''
+        self.history.append({'batchSize': batchSize, 'latency': latency, 'bytes': numBytes, 'status': status})
+        if status not in (200, 404):
+            newSize = self.size // 2
+        else:
+            secondsPerCid = max(latency, 1e-3) / batchSize
+            bytesPerCid = max(numBytes, 1) / batchSize
+            newSize = int(min(self.targetLatency / secondsPerCid, self.maxBytes / bytesPerCid))
+            newSize = min(max(newSize, self.size // 2), self.size * 2)
+        self.size = min(max(newSize, self.minSize), self.maxSize)
+
+    def summary(self):
+        '''
+        Returns the number of batches and CIDs, and the mean and largest batch size and latency, in seconds.
+        '''
+        if len(self.history) == 0:
+            return {'numBatches': 0, 'numCids': 0}
+        sizes = [record['batchSize'] for record in self.history]
+        latencies = [record['latency'] for record in self.history]
+        return {'numBatches': len(sizes),
+                'numCids': sum(sizes),
+                'meanBatchSize': sum(sizes) / len(sizes),
+                'maxBatchSize': max(sizes),
+                'meanLatency': sum(latencies) / len(latencies),
+                'maxLatency': max(latencies)}
+
+class ResponseCache:
+    '''
+    Persistent cache of PubChem responses, stored in an SQLite database at 'dbPath'.
+
+    Each entry is the XML of one CID's <Information> (synonyms) or <Properties> (properties) element, which parseRecords reads back. CIDs that PubChem had no record for are stored with an empty body, so they are not requested again.
+
+    Eviction policy:
+        maxAge, float, seconds. Entries fetched longer ago than this are dropped. None keeps entries forever.
+        maxEntries, integer. When there are more entries than this, the least recently used ones are dropped. None sets no limit.
+
+    >>> cache = ResponseCache(DIR + 'pubchemCache.sqlite', maxAge=30*24*3600)
+    >>> chemSynsDic, chemSynsRDic = makeChemSynsDic(DIR, outDir, cidList, cache=cache)
+    '''
+    def __init__(self, dbPath, maxEntries=None, maxAge=None):
+        self.dbPath = dbPath
+        self.maxEntries = maxEntries
+        self.maxAge = maxAge
+        self.connection = sqlite3.connect(dbPath, check_same_thread=False) # downloadCidSyns writes to it from its download thread
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (mineType TEXT, cid INTEGER, body TEXT, fetched REAL, accessed REAL, PRIMARY KEY (mineType, cid))')
+        self.connection.commit()
+        self.evict()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get(self, mineType, cids):
+        '''
+        Returns a dictionary { cid : body } of the cached entries among 'cids'.
+        '''
+        results = {}
+        now = time.time()
+        cids = list(cids)
+        for i in range(0, len(cids), 500):
+            chunk = cids[i:i+500]
+            marks = ','.join('?' * len(chunk))
+            rows = self.connection.execute('SELECT cid, body FROM responses WHERE mineType = ? AND cid IN (%s)' % marks, [mineType] + chunk)
+            results.update(rows)
+            self.connection.execute('UPDATE responses SET accessed = ? WHERE mineType = ? AND cid IN (%s)' % marks, [now, mineType] + chunk)
+        self.connection.commit()
+        return results
+
+    def missing(self, mineType, cids):
+        '''
+        Returns the CIDs in 'cids' that are not cached, in their original order.
+        '''
+        cids = list(cids)
+        cached = set()
+        for i in range(0, len(cids), 500):
+            chunk = cids[i:i+500]
+            marks = ','.join('?' * len(chunk))
+            rows = self.connection.execute('SELECT cid FROM responses WHERE mineType = ? AND cid IN (%s)' % marks, [mineType] + chunk)
+            cached.update(row[0] for row in rows)
+        return [cid for cid in cids if cid not in cached]
+
+    def put(self, mineType, bodies):
+        '''
+        Stores a dictionary { cid : body } and commits it, so it survives a crash later in the run.
+        '''
+        now = time.time()
+        self.connection.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', [(mineType, cid, body, now, now) for cid, body in bodies.items()])
+        self.connection.commit()
+
+    def evict(self):
+        '''
+        Applies the eviction policy. Called when the cache is opened and by downloadCidSyns at the end of a run.
+        '''
+        if self.maxAge is not None:
+            self.connection.execute('DELETE FROM responses WHERE fetched < ?', (time.time() - self.maxAge,))
+        if self.maxEntries is not None:
+            excess = len(self) - self.maxEntries
+            if excess > 0:
+                self.connection.execute('DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY accessed LIMIT ?)', (excess,))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+class TokenBucket:
+    '''
+    Token bucket rate limiter for asyncio. Tokens are added at 'rate' per second up to 'capacity', and every request takes one.
+
+    The default capacity of 1 spaces requests evenly, 1/rate seconds apart, so no one-second window ever holds more than 'rate' requests. A larger capacity allows bursts, which PubChem's policy does not.
+    '''
+    def __init__(self, rate=5, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+async def requestWithRetries(loop, executor, session, bucket, url, headers=None, maxRetries=5, backoff=1.0, timeout=60, data=None):
+    '''
+    GETs 'url' through the rate limiter, or POSTs 'data' to it if 'data' is given. Connection errors and the statuses in RETRY_STATUS are retried up to 'maxRetries' times, waiting backoff, 2*backoff, 4*backoff, ... seconds, or as long as the server's Retry-After header asks. Returns the last response, or raises the last connection error.
+
+    The time taken by the last attempt, including reading the body, is stored in the response as 'response.latency', in seconds.
+    '''
+    if data is None:
+        call = functools.partial(session.get, url, headers=headers, timeout=timeout)
+    else:
+        call = functools.partial(session.post, url, data=data, headers=headers, timeout=timeout)
+    for attempt in range(maxRetries + 1):
+        await bucket.acquire()
+        start = time.monotonic()
+        try:
+            response = await loop.run_in_executor(executor, call)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == maxRetries:
+                raise
+            response = None
+        if response is not None and (response.status_code not in RETRY_STATUS or attempt == maxRetries):
+            response.latency = time.monotonic() - start
+            return response
+        delay = backoff * 2**attempt
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            delay = max(delay, int(response.headers['Retry-After']))
+        await asyncio.sleep(delay)
+
+async def fetchAllAsync(requestList, onResponse, rate=5, maxInFlight=5, queueSize=None, headers=None, maxRetries=5, backoff=1.0, parse=None):
+    '''
+    Coroutine behind fetchAll. See fetchAll.
+    '''
+    loop = asyncio.get_running_loop()
+    bucket = TokenBucket(rate)
+    if queueSize is None:
+        queueSize = 2 * maxInFlight
+    queue = asyncio.Queue(maxsize=queueSize)
+
+    # Connection pool with one connection per request in flight
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=maxInFlight)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            key, url = item[:2]
+            if len(item) > 2:
+                data = item[2]
+            else:
+                data = None
+            response = await requestWithRetries(loop, executor, session, bucket, url, headers, maxRetries, backoff, data=data)
+            if parse is None:
+                onResponse(key, response)
+            else:
+                onResponse(key, await loop.run_in_executor(executor, parse, response))
+
+    async def produce():
+        for item in requestList:
+            await queue.put(item) # waits while the queue is full, so requests are made lazily
+        for _ in workers:
+            await queue.put(None)
+
+    with ThreadPoolExecutor(max_workers=maxInFlight) as executor:
+        workers = [asyncio.ensure_future(worker()) for _ in range(maxInFlight)]
+        tasks = workers + [asyncio.ensure_future(produce())]
+        try:
+            # A worker that raises stops taking items from the queue, so the producer would wait on a full queue forever. Stop at the first error instead.
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in tasks:
+                if task in done and not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            session.close()
+
+def fetchAll(requestList, onResponse, rate=5, maxInFlight=5, queueSize=None, headers=None, maxRetries=5, backoff=1.0, parse=None):
+    '''
+    Fetches many URLs concurrently within a rate limit.
+
+    INPUT:  requestList, an iterable of (key, url) pairs, or (key, url, data) triples for POST requests. It is consumed lazily through a bounded queue, so it can be a generator, and it can adapt later requests to the responses seen so far.
+            onResponse, a function called as onResponse(key, response) for each finished request, in the calling thread, in order of completion. If it raises, or a request still fails with a connection error after 'maxRetries' retries, the other requests are cancelled and the error is raised by fetchAll.
+            parse, a function, optional. If given, parse(response) is run in the worker threads and onResponse receives its result instead of the response.
+            rate, float, the maximum number of requests started per second. PubChem allows 5.
+            maxInFlight, integer, the number of requests kept open at once.
+            queueSize, integer, the number of pending requests held in the queue. Defaults to 2 * maxInFlight.
+            maxRetries, backoff, see requestWithRetries.
+    '''
+    asyncio.run(fetchAllAsync(requestList, onResponse, rate, maxInFlight, queueSize, headers, maxRetries, backoff, parse))
+
+def localName(tag):
+    '''
+    '{http://pubchem.ncbi.nlm.nih.gov/pug_rest}Synonym' --> 'synonym'. Lowercase, so elements cached as lowercase HTML by BeautifulSoup are read as well.
+    '''
+    return tag.rsplit('}', 1)[-1].lower()
+
+def parseRecords(source, mineType, withBodies=False):
+    '''
+    Parses a PUG REST XML response incrementally and yields one record per CID:
+
+    mineType    | record
+    ============================================================================
+    synonyms    | (cid, [synonym1, synonym2, ...])
+    properties  | (cid, (AtomStereoCount, DefinedAtomStereoCount, ...)), in the order of PROPERTIES
+
+    Each element is cleared as soon as its record is made, so memory does not grow with the size of the response. If 'withBodies' is True, records are (cid, values, xml) where xml is the element's XML, as stored by ResponseCache. Responses that are not XML, like the error pages of an overloaded server, or that were cut off, raise xml.etree.ElementTree.ParseError after the records read before the error (see parseResponse).
+
+    INPUT:  source, a file-like object, bytes, or a string.
+    '''
+    if isinstance(source, str):
+        source = source.encode()
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    if mineType == 'synonyms':
+        recordName = 'information'
+    elif mineType == 'properties':
+        recordName = 'properties'
+    propertyNames = [name.lower() for name in PROPERTIES.split(',')]
+    for event, element in ET.iterparse(source, events=('end',)):
+        if localName(element.tag) != recordName:
+            continue
+        cid = None
+        synonyms = []
+        properties = {}
+        for child in element:
+            name = localName(child.tag)
+            if name == 'cid':
+                cid = int(child.text)
+            elif name == 'synonym':
+                synonyms.append(child.text)
+            elif name in propertyNames:
+                properties[name] = child.text
+        if mineType == 'synonyms':
+            values = synonyms
+        else:
+            values = tuple(properties.get(name) for name in propertyNames)
+        if withBodies:
+            yield cid, values, ET.tostring(element, encoding='unicode')
+        else:
+            yield cid, values
+        element.clear()
+
+def parseResponse(source, mineType):
+    '''
+    Returns the records of a response, with bodies (see parseRecords), and whether the whole response was read. A response that is not XML or was cut off gives the records read before the error and False, so the CIDs after it are not taken as having no record.
+    '''
+    records = []
+    try:
+        for record in parseRecords(source, mineType, withBodies=True):
+            records.append(record)
+    except ET.ParseError:
+        return records, False
+    return records, True
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time, unicodedata
+import numpy as np
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpiresolve.py
+
+File Description
+----------------
+
+    Batch resolution of chemical and protein names (mentions found by text mining) to STITCH and STRING identifiers, using the reverse dictionaries chemSynsRDic and protSynsRDic.
+
+    Names are normalized before they are compared, so that 'Alpha-Synuclein', ' alpha-synuclein' and 'α-synuclein' are all found, as are 'tumor  necrosis factor' and 'Tumor necrosis factor':
+
+        1. Unicode compatibility forms are unified (NFKC), e.g. the micro sign 'µ' becomes the Greek letter 'μ'.
+        2. Case is folded.
+        3. Greek letters are spelled out, 'α' becomes 'alpha'.
+        4. Runs of whitespace become one space, and leading and trailing whitespace is removed.
+
+    A NameResolver normalizes every name of the dictionary once, when it is built. A batch of mentions is reduced to its unique names first, so each distinct mention is normalized and looked up once however often it occurs. Every name is resolved to one of
+
+    Status      | Meaning
+    ============================================================================
+    RESOLVED    | the name belongs to exactly one entity
+    AMBIGUOUS   | the name belongs to several entities (see NameResolver.candidates)
+    MISSING     | the name is not in the dictionary
+'''
+
+'''
+Meta Global Variables
+'''
+
+RESOLVED, AMBIGUOUS, MISSING = 0, 1, 2
+
+GREEK_LETTERS = {'α': 'alpha', 'β': 'beta', 'γ': 'gamma', 'δ': 'delta', 'ε': 'epsilon', 'ζ': 'zeta', 'η': 'eta', 'θ': 'theta', 'ι': 'iota', 'κ': 'kappa', 'λ': 'lambda', 'μ': 'mu', 'ν': 'nu', 'ξ': 'xi', 'ο': 'omicron', 'π': 'pi', 'ρ': 'rho', 'σ': 'sigma', 'τ': 'tau', 'υ': 'upsilon', 'φ': 'phi', 'χ': 'chi', 'ψ': 'psi', 'ω': 'omega', 'ϑ': 'theta', 'ϕ': 'phi', 'ϵ': 'epsilon'}
+GREEK_TABLE = str.maketrans(GREEK_LETTERS)
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def normalizeName(name):
+    '''
+    'Α-Synuclein ' --> 'alpha-synuclein'. See the module description for the steps.
+    '''
+    if name.isascii():
+        return ' '.join(name.casefold().split()) # nothing to unify or spell out
+    name = unicodedata.normalize('NFKC', name).casefold().translate(GREEK_TABLE)
+    return ' '.join(name.split())
+
+def getEntity(value):
+    '''
+    Returns the entity of a value of a reverse dictionary, which is a string or integer in chemSynsRDic and a (protein, source) tuple in protSynsRDic. Same as cpiaux.getName.
+    '''
+    if isinstance(value, (tuple, list)):
+        return value[0]
+    return value
+
+class NameResolver:
+    '''
+    Resolves batches of names to entity identifiers with a reverse dictionary { name : [entity1, entity2, ...] } like chemSynsRDic or protSynsRDic. The dictionary may also be a MappedDic or NameIndex (see cpistore.py and cpinames.py).
+
+    >>> resolver = NameResolver(protSynsRDic)
+    >>> codes, status = resolver.resolve(['FDPS', 'fdps', 'farnesyl', 'kinase'])
+    >>> resolver.decode(codes)
+    array(['9606.ENSP00000349078', '9606.ENSP00000349078', None, None], dtype=object)
+    >>> status
+    array([0, 0, 2, 1], dtype=int8)
+    '''
+    def __init__(self, rdic, normalize=normalizeName):
+        self.normalize = normalize
+        self.rows = {}        # normalized name : row
+        entityCodes = {}      # entity : code
+        candidates = []       # row : set of entity codes
+        for name, values in rdic.items():
+            key = normalize(name)
+            try:
+                row = self.rows[key]
+            except KeyError:
+                row = len(candidates)
+                self.rows[key] = row
+                candidates.append(set())
+            for value in values:
+                candidates[row].add(entityCodes.setdefault(getEntity(value), len(entityCodes)))
+
+        self.entities = np.empty(len(entityCodes), dtype=object)
+        self.entities[:] = list(entityCodes)
+        counts = np.array([len(codes) for codes in candidates], dtype=np.int64)
+        self.indptr = np.zeros(len(candidates) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.candidateCodes = np.array([code for codes in candidates for code in sorted(codes)], dtype=np.int64)
+        self.rowEntity = np.full(len(candidates) + 1, -1, dtype=np.int64) # the extra last entry is for missing names
+        unique = np.flatnonzero(counts == 1)
+        self.rowEntity[unique] = self.candidateCodes[self.indptr[unique]]
+        self.rowStatus = np.full(len(candidates) + 1, MISSING, dtype=np.int8)
+        self.rowStatus[:-1] = np.where(counts == 1, RESOLVED, AMBIGUOUS)
+
+    def __len__(self):
+        '''
+        Number of distinct normalized names.
+        '''
+        return len(self.rows)
+
+    def resolve(self, names):
+        '''
+        Resolves a sequence of names, which can be a list, a Numpy array or an iterator.
+
+        OUTPUT: codes, an int64 array with the code of each name's entity, or -1 for ambiguous and missing names. resolver.entities[code] or resolver.decode(codes) gives the identifiers.
+                status, an int8 array with RESOLVED, AMBIGUOUS or MISSING for each name.
+        '''
+        uniques = {}
+        inverse = np.fromiter((uniques.setdefault(name, len(uniques)) for name in names), dtype=np.int64)
+        missingRow = len(self.rowStatus) - 1
+        uniqueRows = np.fromiter((self.rows.get(self.normalize(name), missingRow) for name in uniques), dtype=np.int64, count=len(uniques))
+        rows = uniqueRows[inverse]
+        return self.rowEntity[rows], self.rowStatus[rows]
+
+    def decode(self, codes):
+        '''
+        Returns the identifiers of entity codes as an object array, None for -1.
+        '''
+        codes = np.asarray(codes)
+        ids = np.empty(len(codes), dtype=object)
+        found = codes >= 0
+        ids[found] = self.entities[codes[found]]
+        return ids
+
+    def candidates(self, name):
+        '''
+        Returns every entity of a name, for example to choose between the entities of an ambiguous name. Empty if the name is missing.
+        '''
+        try:
+            row = self.rows[self.normalize(name)]
+        except KeyError:
+            return []
+        return self.entities[self.candidateCodes[self.indptr[row]:self.indptr[row+1]]].tolist()
+
+def naiveResolve(rdic, names, normalize=None):
+    '''
+    The Python loop that NameResolver replaces: one dictionary look-up per name and getName unwrapping of the values. If 'normalize' is given, the dictionary must have normalized keys and every name is normalized, once per occurrence. Returns the same status codes as NameResolver.resolve, and a list of identifiers (None when unresolved).
+    '''
+    ids = []
+    status = []
+    for name in names:
+        if normalize is not None:
+            name = normalize(name)
+        try:
+            entities = {getEntity(value) for value in rdic[name]}
+        except KeyError:
+            ids.append(None)
+            status.append(MISSING)
+            continue
+        if len(entities) == 1:
+            ids.append(entities.pop())
+            status.append(RESOLVED)
+        else:
+            ids.append(None)
+            status.append(AMBIGUOUS)
+    return ids, status
+
+def benchmarkResolver(rdic, names, resolver=None):
+    '''
+    Times NameResolver.resolve against naiveResolve on the list 'names', with and without normalization. Returns a dictionary of seconds and names per second, and checks that both give the same answers.
+
+    >>> mentions = [name for name in protSynsRDic for _ in range(10)]
+    >>> benchmarkResolver(protSynsRDic, mentions)
+    '''
+    results = {'numNames': len(names), 'numUniqueNames': len(set(names))}
+    if resolver is None:
+        start = time.perf_counter()
+        resolver = NameResolver(rdic)
+        results['buildSeconds'] = time.perf_counter() - start
+    normalizedDic = {}
+    for name, values in rdic.items():
+        normalizedDic.setdefault(resolver.normalize(name), []).extend(values)
+
+    start = time.perf_counter()
+    naiveIds, naiveStatus = naiveResolve(rdic, names)
+    results['naiveSeconds'] = time.perf_counter() - start
+    start = time.perf_counter()
+    naiveIds, naiveStatus = naiveResolve(normalizedDic, names, resolver.normalize)
+    results['naiveNormalizedSeconds'] = time.perf_counter() - start
+    start = time.perf_counter()
+    codes, status = resolver.resolve(names)
+    results['batchSeconds'] = time.perf_counter() - start
+
+    for key in ['naive', 'naiveNormalized', 'batch']:
+        results[key + 'Rate'] = len(names) / max(results[key + 'Seconds'], 1e-9)
+    # Compared with the normalized loop, which should give exactly the same answers
+    results['sameAnswers'] = status.tolist() == naiveStatus and resolver.decode(codes).tolist() == naiveIds
+    return results
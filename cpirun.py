@@ -37,6 +37,8 @@ if False:
         import cpiaux
     from cpi import *
     from cpiaux import *
+    from cpibench import runBenchmarks, findRegressions
+    from cpilines import getLineIndex
 
     #
     # Current workspace
@@ -49,23 +51,43 @@ if False:
     #
     cpiDic, cpiRDic = makeCpiDic(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv', verbose=1, quickMode=False, quickModeLimit=.1)
 
+    cpiGraph, registry = makeCpiGraph(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv', verbose=1)
+    devGraph, devRegistry = makeCpiGraph(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv', verbose=1, quickMode=True, quickModeLimit=0.01, sampleMode='hash') # every link of 1% of the chemicals, and an estimate of the full build time
+    cpiGraph.save(outDir + '9606cpiGraph')
+    topCids, topIndptr, topProts, topScores = cpiGraph.topProteins(10) # the 10 highest-scoring proteins of every CID; cpiGraph.topChemicals(10) for the reverse, cpiGraph.proteins(cid, withScores=True, k=10) for one CID
+    registry.save(outDir + '9606registry.pickle')
+    gzGraph, gzRegistry = makeCpiGraph(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv.gz', verbose=1) # every builder reads .gz, bgzip and .zst files as they are (see cpicompress.py); bgzip files are decompressed in parallel
+    speciesShards = makeSpeciesGraphs(DIR, dataDir, outDir, fname='protein_chemical.links.v5.0.tsv', actionsFname='actions.v5.0.tsv', verbose=1) # all species from the full STITCH dump, saved as outDir + '<taxon>cpiGraph'
+
     cidList = makeCidList(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv', verbose=1, quickMode=False, quickModeLimit=500)
+    cpiResults = makeCpiDics(DIR, dataDir, outDir, fname='9606.protein_chemical.links.v5.0.tsv', outputs=['cidList', 'cpiDic', 'cpiRDic', 'scoreStats'], verbose=1) # one read for all four; add 'cpiGraph' with registry=IdRegistry()
+    detailedResults = makeCpiDics(DIR, dataDir, outDir, fname='9606.protein_chemical.links.detailed.v5.0.tsv', outputs=['scoreStats', 'linkScores']) # file type from the header; detailedResults['scoreStats']['subscores']['experimental'], detailedResults['linkScores']['textmining']
+    linkLines = getLineIndex(dataDir + '9606.protein_chemical.links.v5.0.tsv') # from cpilines; linkLines.numRows, linkLines.getRow(k), linkLines.getShards(8)
+    benchRecords = runBenchmarks(DIR + 'bench/', sizes=[10**5, 10**6]) # from cpibench; findRegressions(DIR + 'bench/benchmarkHistory.jsonl') lists what got slower or bigger
 
     chemSynsDic, chemSynsRDic = makeChemSynsDic(DIR, outDir, cidList, verbose=1)
 
     protSynsDic, protSynsRDic = makeProtSynsDic(DIR, dataDir='STITCH Data/', fname='9606.protein.aliases.v10.5.txt', verbose=1, quickMode=True, quickModeLimit=500)
+    protSynsIndex = makeProtSynsIndex(DIR, dataDir='STITCH Data/', fname='9606.protein.aliases.v10.5.txt', verbose=1)
+    protSynsIndex.save(DIR + 'protSynsIndex')
 
     ctopDic, ptocDic, pairsToLinksDic = makeLinksDic(DIR, dataDir='STITCH Data/', fname='9606.actions.v5.0.tsv', verbose=1, quickMode=True, quickModeLimit=500)
+    dics = makeDicsIncremental(DIR, dataDir='STITCH Data/', fname='9606.actions.v5.0.tsv', builder='links', verbose=1) # only re-parses the chunks of the file that changed since the last build; dics['ctopDic'], dics['ptocDic'], ..., saved to DIR + 'linksDics/'
+    linksTable, registry = makeLinksTable(DIR, dataDir, outDir, fname='9606.actions.v5.0.tsv', verbose=1) # columnar pairsToLinksDic; linksTable.toFrame(linksTable.query(mode='binding', minScore=700, actor='chemical'), registry)
 
 if False:
     # Test dictionaries
     chemSynsDic, chemSynsRDic = loadPickle(DIR,'chemSynsDic'), loadPickle(DIR,'chemSynsRDic')
     protSynsDic, protSynsRDic = loadPickle(DIR,'protSynsDic'), loadPickle(DIR,'protSynsRDic')
+    # protSynsDic, protSynsRDic = loadDic(DIR,'protSynsDic'), loadDic(DIR,'protSynsRDic') # if made with storeFormat='mapped'
+    # saveDic(protSynsRDic, DIR, 'protSynsNames', 'index'); protSynsNames = loadDic(DIR, 'protSynsNames') # exact, case-insensitive and prefix look-ups, e.g. protSynsNames.prefix('(2E,6E)-farnesyl')
+    # from cpiresolve import NameResolver, benchmarkResolver; protResolver = NameResolver(protSynsRDic); codes, status = protResolver.resolve(mentions) # batch name resolution, see benchmarkResolver(protSynsRDic, mentions)
     cpiDic = loadPickle(DIR+'9606Pickles/','9606cpiDic') # need cpiRDic
     ctopDic, ptocDic = loadPickle(DIR,'ctopDic'), loadPickle(DIR,'ptocDic')
-    testDicCompleteness(chemSynsDic, chemSynsRDic, 0)
+    testDicCompleteness(chemSynsDic, chemSynsRDic, 0) # returns the report of verifyDics; report = verifyDics(ctopDic, ptocDic) to skip printing
     testDicCompleteness(protSynsDic, protSynsRDic, 0)
     testDicCompleteness(ctopDic, ptocDic, 0)
+    mseqbag, msbag, mbag, sbag = getCidBagsVectorized(CsrGraph.load(outDir + '9606cpiGraph')) # or getCidBagsVectorized(cpiDic); getCidBags(cpiDic) for the original loop
 
 if False:
     # Pickle Dictionaries
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import itertools, os
+import numpy as np
+from cpicompress import isCompressed, openInput
+from cpihash import getByteWeights, mixHash
+from cpiio import readHeader, inferDtypes, readBlocks, splitBlock
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpisample.py
+
+File Description
+----------------
+
+    Random samples of the rows of STITCH and STRING files, to build small graphs and dictionaries that look like the full ones. quickMode reads the first rows of a file instead, and because STITCH files are sorted by chemical those rows are a few chemicals with unusual identifiers, not a sample.
+
+    Method      | Reads          | Sample
+    ============================================================================
+    reservoir   | the whole file | exactly 'size' rows, every row equally likely
+    hash        | the whole file | every row whose key columns hash below 'size' (a fraction); keyed on the chemical it keeps every link of the chosen chemicals, so degrees are those of the full graph
+    offsets     | 'size' lines   | the line after each of 'size' random byte offsets. Only small parts of the file are read, so it takes seconds on the 30 GB files, but long lines are more likely to follow a random offset than short ones
+
+    The hash of a field only depends on its bytes and the seed, so hash samples with the same seed and fraction choose the same chemicals in every file and every release.
+'''
+
+'''
+Meta Global Variables
+'''
+
+FIELD_WEIGHTS = getByteWeights(20180915)
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def getFieldHashes(block, numCols):
+    '''
+    Returns a (lines, columns) uint64 array with a hash of every field of a block of whole tab-separated lines.
+    '''
+    array = np.frombuffer(block, dtype=np.uint8)
+    separators = np.flatnonzero((array == 9) | (array == 10))
+    if len(separators) % numCols != 0:
+        raise ValueError('Expected %d tab-separated columns per line. The block has %d fields.' % (numCols, len(separators)))
+    if len(separators) == 0:
+        return np.empty((0, numCols), dtype=np.uint64)
+    starts = np.concatenate([[0], separators[:-1] + 1])
+    positions = np.arange(len(array), dtype=np.int64) - np.repeat(starts, separators + 1 - starts)
+    values = (array.astype(np.uint64) + np.uint64(1)) * FIELD_WEIGHTS[positions % len(FIELD_WEIGHTS)]
+    values[separators] = 0
+    sums = np.zeros(len(array) + 1, dtype=np.uint64)
+    np.cumsum(values, out=sums[1:])
+    hashes = sums[separators + 1] - sums[starts]
+    return hashes.reshape(-1, numCols)
+
+def reservoirSample(fpath, numRows, seed=0, chunkSize=2**24):
+    '''
+    Reads the file once and returns a uniform random sample of 'numRows' data rows, in file order, as bytes of whole lines, and the number of data rows of the file.
+
+    Every row gets a random key and the rows with the 'numRows' smallest keys are kept. Rows with a key above the largest kept key are dropped with Numpy, so once the reservoir is full only a few rows per block reach Python.
+    '''
+    rng = np.random.RandomState(seed)
+    keys = np.empty(0, dtype=np.float64)
+    rowIds = np.empty(0, dtype=np.int64)
+    kept = {} # row number : line
+    numSeen = 0
+    with openInput(fpath) as f:
+        f.readline()
+        for block in readBlocks(f, chunkSize):
+            lines = block.split(b'\n')
+            lines.pop()
+            blockKeys = rng.random_sample(len(lines))
+            if numRows <= 0:
+                candidates = np.empty(0, dtype=np.int64)
+            elif len(keys) >= numRows:
+                candidates = np.flatnonzero(blockKeys < keys.max())
+            else:
+                candidates = np.arange(len(lines))
+            for i in candidates.tolist():
+                kept[numSeen + i] = lines[i]
+            keys = np.concatenate([keys, blockKeys[candidates]])
+            rowIds = np.concatenate([rowIds, numSeen + candidates])
+            if len(keys) > numRows:
+                order = np.argpartition(keys, numRows - 1)
+                for rowId in rowIds[order[numRows:]].tolist():
+                    del kept[rowId]
+                keys, rowIds = keys[order[:numRows]], rowIds[order[:numRows]]
+            numSeen += len(lines)
+    data = b''.join([kept[rowId] + b'\n' for rowId in np.sort(rowIds).tolist()])
+    return data, numSeen
+
+def hashSample(fpath, fraction, keyColumns=None, seed=0, chunkSize=2**24):
+    '''
+    Reads the file once and returns the rows whose key hashes below 'fraction', in file order, as bytes of whole lines, and the number of data rows of the file.
+
+    INPUT:  keyColumns, a list of column names. The key of a row is the sum of the hashes of these fields, so the order of the fields does not matter: with ['item_id_a', 'item_id_b'] the rows (A, B) and (B, A) of the actions file are kept together. If None, the whole row is the key.
+    '''
+    header = readHeader(fpath)
+    if keyColumns is None:
+        keyColumns = header
+    columns = [header.index(name) for name in keyColumns]
+    threshold = np.uint64(min(int(fraction * 2**64), 2**64 - 1))
+    seed = np.uint64(seed)
+    parts = []
+    numSeen = 0
+    with openInput(fpath) as f:
+        f.readline()
+        for block in readBlocks(f, chunkSize):
+            fieldHashes = getFieldHashes(block.replace(b'\r', b''), len(header))
+            rowHashes = mixHash(fieldHashes[:, columns].sum(axis=1, dtype=np.uint64) ^ seed)
+            lines = block.split(b'\n')
+            lines.pop()
+            chosen = list(itertools.compress(lines, (rowHashes < threshold).tolist()))
+            if chosen:
+                parts.append(b'\n'.join(chosen) + b'\n')
+            numSeen += len(lines)
+    return b''.join(parts), numSeen
+
+def offsetSample(fpath, numRows, seed=0):
+    '''
+    Returns the lines that follow 'numRows' random byte offsets of the file, in file order and without repeats, as bytes of whole lines, and an estimate of the number of data rows of the file from the mean length of the lines read.
+
+    Only about 'numRows' lines are read, whatever the size of the file. A line is chosen if the offset falls in the line before it, so lines after long lines are over-represented.
+
+    Needs random access to the file, so compressed files raise a ValueError. Use 'reservoir' or 'hash' for them.
+    '''
+    if isCompressed(fpath):
+        raise ValueError('%s is compressed, and offset sampling needs an uncompressed file. Use the \'reservoir\' or \'hash\' method.' % fpath)
+    rng = np.random.RandomState(seed)
+    size = os.path.getsize(fpath)
+    with open(fpath, 'rb') as f:
+        f.readline()
+        dataStart = f.tell()
+        if dataStart >= size:
+            return b'', 0
+        offsets = np.sort(rng.randint(dataStart, size, size=numRows, dtype=np.int64))
+        lines = {}
+        for offset in offsets.tolist():
+            if offset == dataStart:
+                f.seek(offset)
+            else:
+                f.seek(offset - 1)
+                f.readline() # skip to the start of the next line
+            start = f.tell()
+            if start in lines:
+                continue
+            line = f.readline()
+            if line:
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                lines[start] = line
+    data = b''.join([lines[start] for start in sorted(lines)])
+    if len(lines) == 0:
+        return data, 0
+    return data, int(round((size - dataStart) * len(lines) / len(data)))
+
+def loadSample(fpath, method='hash', size=0.01, dtypes=None, keyColumns=None, seed=0, chunkSize=2**24):
+    '''
+    Loads a random sample of the rows of a file as a table in the format of cpiio.loadColumns.
+
+    INPUT:  method, 'reservoir', 'hash' or 'offsets' (see the module description).
+            size, the number of rows for 'reservoir' and 'offsets', the fraction of rows for 'hash'.
+            keyColumns, a list of column names for 'hash', e.g. ['chemical'] for the links files.
+            seed, integer. The same seed gives the same sample.
+    OUTPUT: table, the sample.
+            info, a dictionary {'method', 'numRows' : rows in the sample, 'totalRows' : rows in the file (estimated for 'offsets'), 'fraction' : numRows / totalRows}
+    '''
+    header = readHeader(fpath)
+    if dtypes is None:
+        dtypes = inferDtypes(fpath, header)
+    if method == 'reservoir':
+        data, totalRows = reservoirSample(fpath, int(size), seed, chunkSize)
+    elif method == 'hash':
+        if not 0 < size <= 1:
+            raise ValueError('The size of a \'hash\' sample is the fraction of the rows to keep, in (0, 1], not %s.' % size)
+        data, totalRows = hashSample(fpath, float(size), keyColumns, seed, chunkSize)
+    elif method == 'offsets':
+        data, totalRows = offsetSample(fpath, int(size), seed)
+    else:
+        raise ValueError('Unknown sampling method %s. Use \'reservoir\', \'hash\' or \'offsets\'.' % method)
+    vocab = {}
+    if data:
+        columns = splitBlock(data, header, dtypes, vocab)
+    else:
+        columns = {name: np.empty(0, dtype=np.int32 if dtypes[name] == 'code' else dtypes[name]) for name in header}
+    table = {'header': header, 'dtypes': dtypes, 'columns': columns, 'vocab': list(vocab)}
+    numRows = data.count(b'\n')
+    info = {'method': method, 'numRows': numRows, 'totalRows': totalRows, 'fraction': numRows / max(totalRows, 1)}
+    return table, info
+
+def extrapolateTime(seconds, info):
+    '''
+    Estimates the time of a full build from the time of a build on a sample, assuming it grows linearly with the number of rows.
+    '''
+    return seconds / max(info['fraction'], 1e-12)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import itertools
+import numpy as np
+from cpigraph import CsrGraph
+from cpiio import getSchema, iterColumns
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpiscan.py
+
+File Description
+----------------
+
+    One pass over a links or actions file that feeds several consumers at once. 'makeCidList' and 'makeCpiDic' used to read the links file once each, and to count its lines first. Now the file is parsed once, chunk by chunk (see cpiio.iterColumns), and every chunk is handed to each of the consumers that were asked for:
+
+    Name        | Result
+    ============================================================================
+    cidList     | the unique CIDs, in order of first appearance
+    cpiDic      | { CID : [proteins] }
+    cpiRDic     | { protein : [CIDs] }
+    scoreStats  | {'numLinks', 'min', 'max', 'mean', 'histogram', 'subscores'}, the histogram is a bincount of the scores. 'subscores' has the same for each evidence score of the detailed links file
+    linkScores  | {'cids', 'prots', 'combined_score', ...}, every link and its scores as columns, including the evidence scores of the detailed links file
+    cpiGraph    | a CsrGraph (see cpigraph.py), with scores. Needs an IdRegistry
+
+    Consumers see the chemicals and proteins of a chunk as vocabulary codes (see cpiio.py), one int32 array each, and the scores as an int array, so nothing is decoded to strings row by row. The identifiers are decoded once, after the last chunk, to strings or to registry codes. The dictionaries have the same keys and lists, in the same order, as the row-by-row loops that built them before.
+
+    A new consumer is a subclass of ScanConsumer with 'update' and 'finish' methods, and can be passed to scanLinks with the named ones:
+
+    >>> results = scanLinks(fpath, ['cidList', 'cpiDic', 'cpiRDic', MyConsumer()])
+'''
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+class ScanConsumer:
+    '''
+    Base class of the consumers of scanLinks.
+
+    update(cids, prots, scores, subscores) is called once per chunk with parallel arrays, one entry per row. cids and prots are vocabulary codes. subscores is a dictionary { name : array } of the evidence scores of the detailed links file ('experimental', 'prediction', 'database', 'textmining'), empty for the other files.
+    finish(decode) is called after the last chunk and returns the result. decode(codes) maps an array of vocabulary codes to an array of identifiers, strings or registry codes.
+    '''
+    name = None
+
+    def update(self, cids, prots, scores, subscores):
+        pass
+
+    def finish(self, decode):
+        return None
+
+class CidList(ScanConsumer):
+    name = 'cidList'
+
+    def __init__(self):
+        self.parts = []
+
+    def update(self, cids, prots, scores, subscores):
+        _, first = np.unique(cids, return_index=True)
+        self.parts.append(cids[np.sort(first)])
+
+    def finish(self, decode):
+        codes = np.concatenate(self.parts + [np.empty(0, dtype=np.int32)])
+        _, first = np.unique(codes, return_index=True)
+        return decode(codes[np.sort(first)]).tolist()
+
+class AdjacencyDic(ScanConsumer):
+    '''
+    Collects the (key, value) pairs of every chunk and groups them into a dictionary of lists at the end, with keys in order of first appearance and values in file order.
+    '''
+    def __init__(self, name, reverse=False):
+        self.name = name
+        self.reverse = reverse
+        self.keys = []
+        self.values = []
+
+    def update(self, cids, prots, scores, subscores):
+        if self.reverse:
+            cids, prots = prots, cids
+        self.keys.append(cids)
+        self.values.append(prots)
+
+    def finish(self, decode):
+        keys = np.concatenate(self.keys + [np.empty(0, dtype=np.int32)])
+        values = np.concatenate(self.values + [np.empty(0, dtype=np.int32)])
+        order = np.argsort(keys, kind='stable')
+        sortedKeys = keys[order]
+        starts = np.flatnonzero(np.concatenate([[True], sortedKeys[1:] != sortedKeys[:-1]])) if len(keys) > 0 else np.empty(0, dtype=np.int64)
+        ends = np.append(starts[1:], len(keys))
+        keyOrder = np.argsort(order[starts]) # the sort is stable, so the first row of a group is the first appearance of its key
+        values = decode(values[order]).tolist()
+        keys = decode(sortedKeys[starts]).tolist()
+        starts, ends = starts.tolist(), ends.tolist()
+        dic = {}
+        for i in keyOrder.tolist():
+            dic[keys[i]] = values[starts[i]:ends[i]]
+        return dic
+
+def getHistogramStats(histogram):
+    '''
+    Returns the number, minimum, maximum and mean of the values counted by a bincount histogram.
+    '''
+    count = int(histogram.sum())
+    if count == 0:
+        return {'numLinks': 0, 'min': None, 'max': None, 'mean': None, 'histogram': histogram}
+    used = np.flatnonzero(histogram)
+    mean = float(np.dot(np.arange(len(histogram)), histogram) / count)
+    return {'numLinks': count, 'min': int(used[0]), 'max': int(used[-1]), 'mean': mean, 'histogram': histogram}
+
+class ScoreStats(ScanConsumer):
+    '''
+    Histograms of the combined score and of the evidence scores. The result has the statistics of the combined score, and those of each evidence score under 'subscores', with 'numNonzero', the number of links with evidence of that kind.
+    '''
+    name = 'scoreStats'
+
+    def __init__(self):
+        self.histograms = {}
+
+    def add(self, name, values):
+        histogram = self.histograms.get(name, np.zeros(0, dtype=np.int64))
+        counts = np.bincount(values.astype(np.int64), minlength=len(histogram))
+        counts[:len(histogram)] += histogram
+        self.histograms[name] = counts
+
+    def update(self, cids, prots, scores, subscores):
+        self.add(None, scores)
+        for name, values in subscores.items():
+            self.add(name, values)
+
+    def finish(self, decode):
+        stats = getHistogramStats(self.histograms.get(None, np.zeros(0, dtype=np.int64)))
+        stats['subscores'] = {}
+        for name, histogram in self.histograms.items():
+            if name is not None:
+                stats['subscores'][name] = getHistogramStats(histogram)
+                stats['subscores'][name]['numNonzero'] = int(histogram[1:].sum())
+        return stats
+
+class LinkScores(ScanConsumer):
+    '''
+    Every link with all of its scores, as columns in file order: {'cids', 'prots', 'combined_score', and the evidence scores of the detailed links file}. Identifiers are arrays of strings, or of registry codes.
+    '''
+    name = 'linkScores'
+
+    def __init__(self):
+        self.parts = {}
+
+    def update(self, cids, prots, scores, subscores):
+        columns = {'cids': cids, 'prots': prots, 'combined_score': scores}
+        columns.update(subscores)
+        for name, values in columns.items():
+            self.parts.setdefault(name, []).append(values)
+
+    def finish(self, decode):
+        if len(self.parts) == 0:
+            return {'cids': decode(np.empty(0, dtype=np.int32)), 'prots': decode(np.empty(0, dtype=np.int32)), 'combined_score': np.empty(0, dtype=np.int16)}
+        columns = {name: np.concatenate(parts) for name, parts in self.parts.items()}
+        columns['cids'], columns['prots'] = decode(columns['cids']), decode(columns['prots'])
+        return columns
+
+class GraphEdges(ScanConsumer):
+    name = 'cpiGraph'
+
+    def __init__(self):
+        self.cids, self.prots, self.scores = [], [], []
+
+    def update(self, cids, prots, scores, subscores):
+        self.cids.append(cids)
+        self.prots.append(prots)
+        self.scores.append(scores)
+
+    def finish(self, decode):
+        parts = [np.concatenate(part + [np.empty(0, dtype=np.int32)]) for part in [self.cids, self.prots, self.scores]]
+        cidCodes, protCodes = decode(parts[0]), decode(parts[1])
+        if cidCodes.dtype == object:
+            raise ValueError('The cpiGraph consumer needs an IdRegistry to encode identifiers.')
+        return CsrGraph.fromEdges(cidCodes, protCodes, parts[2])
+
+CONSUMERS = {'cidList': CidList,
+             'cpiDic': lambda: AdjacencyDic('cpiDic'),
+             'cpiRDic': lambda: AdjacencyDic('cpiRDic', reverse=True),
+             'scoreStats': ScoreStats,
+             'linkScores': LinkScores,
+             'cpiGraph': GraphEdges}
+
+def getConsumers(outputs):
+    '''
+    Returns a list of consumers from a list of consumer names (see CONSUMERS) and ScanConsumer objects.
+    '''
+    consumers = []
+    for output in outputs:
+        if isinstance(output, ScanConsumer):
+            consumers.append(output)
+        elif output in CONSUMERS:
+            consumers.append(CONSUMERS[output]())
+        else:
+            raise ValueError('Unknown output %s. Choose from %s, or pass a ScanConsumer.' % (output, ', '.join(CONSUMERS)))
+    return consumers
+
+def scanLinks(fpath, outputs, registry=None, chunkSize=2**25, maxRows=None, table=None, progress=None):
+    '''
+    Reads a links or actions file once and returns the results of several consumers. See the module description.
+
+    The type of the file is detected from its header (see cpiio.getSchema), which gives the type of every column and the roles of the columns. In the links files the chemical is always the first column, so chemicals and proteins are the first two columns as they are. In the actions file the chemical can be in either column, and every row is flipped as needed.
+
+    INPUT:  fpath, string, path to a simple links, detailed links or actions file.
+            outputs, a list of consumer names and ScanConsumer objects.
+            registry, an IdRegistry, optional. If given, identifiers are registry codes instead of strings.
+            maxRows, integer, the number of data rows to read. Reads the whole file if None.
+            table, optional. The file as returned by cpiio.loadColumns or loadColumnsParallel. If given, the file is not read.
+            progress, optional. An object with a 'next' method, e.g. a Spinner, called once per chunk.
+    OUTPUT: results, a dictionary { consumer name : result }
+    '''
+    consumers = getConsumers(outputs)
+    if table is None:
+        schema = getSchema(fpath)
+        vocab = {}
+        chunks = iterColumns(fpath, dtypes=schema['dtypes'], vocab=vocab, chunkSize=chunkSize, maxRows=maxRows)
+    else:
+        schema = getSchema(fpath, table['header'])
+        vocab = table['vocab']
+        chunks = [table['columns']]
+    if len(schema['items']) != 2 or schema['score'] is None:
+        raise ValueError('%s is a %s file, not a links or actions file.' % (fpath, schema['fileOrigin']))
+    nameA, nameB = schema['items']
+
+    labelIsCid = np.empty(0, dtype=np.bool_)
+    labelIsItem = np.empty(0, dtype=np.bool_) # used in the item columns, not only in e.g. the 'mode' column of the actions file
+    for chunk in chunks:
+
+        # Grow the look-up arrays with the strings first seen in this chunk
+        if len(labelIsItem) < len(vocab):
+            numNew = len(vocab) - len(labelIsItem)
+            if schema['chemicalColumn'] is None:
+                newLabels = itertools.islice(vocab, len(labelIsCid), None)
+                labelIsCid = np.concatenate([labelIsCid, np.fromiter((label[:3] == 'CID' for label in newLabels), dtype=np.bool_, count=numNew)])
+            labelIsItem = np.concatenate([labelIsItem, np.zeros(numNew, dtype=np.bool_)])
+        A, B = chunk[nameA], chunk[nameB]
+        labelIsItem[A] = True
+        labelIsItem[B] = True
+        if schema['chemicalColumn'] is None:
+            aIsCid = labelIsCid[A]
+            cids, prots = np.where(aIsCid, A, B), np.where(aIsCid, B, A)
+        else:
+            cids, prots = A, B
+        subscores = {name: chunk[name] for name in schema['subscores']}
+        for consumer in consumers:
+            consumer.update(cids, prots, chunk[schema['score']], subscores)
+        if progress is not None:
+            progress.next()
+
+    # Decode vocabulary codes once, to strings or registry codes
+    labels = np.array(list(vocab), dtype=object)
+    if registry is None:
+        decode = lambda codes: labels[codes]
+    else:
+        lookup = np.zeros(len(labels), dtype=np.int64)
+        used = np.flatnonzero(labelIsItem)
+        lookup[used] = registry.encodeArray(labels[used])
+        decode = lambda codes: lookup[codes]
+    return {consumer.name: consumer.finish(decode) for consumer in consumers}
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections, os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from cpicompress import getPlainName, isCompressed, openInput
+from cpiio import readHeader, readBlocks, getShards
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpishard.py
+
+File Description
+----------------
+
+    Splits the all-species STITCH files (protein_chemical.links.v5.0.tsv, actions.v5.0.tsv, ...) into one file per species, named like the species files of the STITCH download page, e.g. '9606.protein_chemical.links.v5.0.tsv'. The functions of cpi.py that are written for the human files can then be run on every species.
+
+    STRING proteins are named '<taxon>.<protein>', for example '9606.ENSP00000257254', and chemicals 'CIDm...' or 'CIDs...'. The species of a row is the taxon of the first protein in the row, which for the actions file can be in either of the first two columns.
+
+    The file is read once. Worker processes each read a byte range of the file (see cpiio.getShards), find the taxon of every row with Numpy, and return the rows grouped by species. The main process appends every group to the file of its species, in the order of the ranges, so the rows of each species file are in the same order as in the input file. No more than 'maxInFlight' ranges are read ahead of the writes, and no more than 'maxOpenFiles' species files are open at a time, so memory and file handles stay bounded however large the input is.
+'''
+
+'''
+Meta Global Variables
+'''
+
+TAXON_WIDTH = 9 # NCBI taxonomy identifiers have at most 7 digits
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def getRowTaxa(block, numCols):
+    '''
+    Returns the taxon of every line of a block of whole tab-separated lines as an int64 array, -1 for lines without a protein.
+    '''
+    array = np.frombuffer(block, dtype=np.uint8)
+    ends = np.flatnonzero(array == 10)
+    tabs = np.flatnonzero(array == 9)
+    numLines = len(ends)
+    if len(tabs) != numLines * (numCols - 1):
+        raise ValueError('Expected %d tab-separated columns per line. The block has %d lines and %d tabs.' % (numCols, numLines, len(tabs)))
+    fieldStarts = np.empty((numLines, numCols), dtype=np.int64)
+    fieldStarts[:, 0] = np.concatenate([[0], ends[:-1] + 1])
+    fieldStarts[:, 1:] = (tabs + 1).reshape(numLines, numCols - 1)
+    padded = np.concatenate([array, np.zeros(TAXON_WIDTH + 1, dtype=np.uint8)])
+
+    taxa = np.full(numLines, -1, dtype=np.int64)
+    for col in range(numCols):
+        todo = np.flatnonzero(taxa < 0)
+        if len(todo) == 0:
+            break
+        # A field is a protein if it starts with up to TAXON_WIDTH digits followed by a '.'
+        window = padded[fieldStarts[todo, col][:, None] + np.arange(TAXON_WIDTH + 1)]
+        digits = window.astype(np.int64) - ord('0')
+        isDigit = (digits >= 0) & (digits <= 9)
+        lengths = np.argmin(isDigit, axis=1)
+        isProtein = (lengths > 0) & (window[np.arange(len(todo)), lengths] == ord('.'))
+        values = np.zeros(len(todo), dtype=np.int64)
+        for j in range(TAXON_WIDTH):
+            values = np.where(j < lengths, values * 10 + digits[:, j], values)
+        taxa[todo[isProtein]] = values[isProtein]
+    return taxa
+
+def routeBlock(block, numCols, taxa=None):
+    '''
+    Groups the lines of a block by taxon. Returns a dictionary { taxon : [bytes of its lines, number of lines] }, with the lines in block order. Lines without a protein are under taxon -1. If 'taxa' is given, only those taxa (and -1) are kept.
+    '''
+    rowTaxa = getRowTaxa(block, numCols)
+    lines = block.split(b'\n')
+    order = np.argsort(rowTaxa, kind='stable')
+    boundaries = np.flatnonzero(np.diff(rowTaxa[order])) + 1
+    groups = {}
+    for rows in np.split(order, boundaries):
+        if len(rows) == 0:
+            continue
+        taxon = int(rowTaxa[rows[0]])
+        if taxa is not None and taxon not in taxa and taxon != -1:
+            continue
+        groups[taxon] = [b'\n'.join([lines[i] for i in rows.tolist()]) + b'\n', len(rows)]
+    return groups
+
+def routeShard(fpath, start, end, numCols, taxa=None, chunkSize=2**25):
+    '''
+    Groups the lines in the byte range [start, end) of a file by taxon, in the same format as routeBlock. Used by the worker processes of shardByTaxon.
+    '''
+    parts = {}
+    with open(fpath, 'rb') as f:
+        f.seek(start)
+        for block in readBlocks(f, chunkSize, end=end):
+            for taxon, (data, numRows) in routeBlock(block, numCols, taxa).items():
+                parts.setdefault(taxon, []).append((data, numRows))
+    return {taxon: [b''.join([data for data, numRows in pieces]), sum(numRows for data, numRows in pieces)] for taxon, pieces in parts.items()}
+
+def getShardPath(outDir, taxon, fname):
+    return os.path.join(outDir, '%d.%s' % (taxon, fname))
+
+def shardByTaxon(fpath, outDir, taxa=None, numProcs=None, shardSize=2**26, maxInFlight=None, maxOpenFiles=256):
+    '''
+    Splits a STITCH or STRING file of all species into one file per species in 'outDir'. Every species file has the header of the input file. Existing species files are overwritten.
+
+    INPUT:  fpath, string, path to the input file, e.g. 'protein_chemical.links.v5.0.tsv'. Compressed files (see cpicompress.py), e.g. 'protein_chemical.links.v5.0.tsv.gz', are decompressed in the background and their blocks are handed to the workers as they come, instead of byte ranges of the file.
+            outDir, string, the directory of the species files, which are named '<taxon>.<input file name>'. The species files are not compressed, and their names drop the compression suffix of the input file.
+            taxa, a collection of integer taxa, optional. Only rows of these species are written.
+            numProcs, integer, the number of worker processes. Defaults to the number of CPUs.
+            shardSize, integer, the number of bytes of the input file read by a worker at a time. For compressed files, the number of decompressed bytes in a block.
+            maxInFlight, integer, the number of byte ranges read ahead of the writes. Defaults to 2 * numProcs. Memory use is about 2 * maxInFlight * shardSize bytes.
+            maxOpenFiles, integer, the number of species files kept open at a time.
+    OUTPUT: shards, a dictionary { taxon : {'fpath' : path of the species file, 'numRows' : number of rows} }
+            numSkipped, integer, the number of rows without a protein, which are not written.
+    '''
+    if numProcs is None:
+        numProcs = os.cpu_count()
+    if maxInFlight is None:
+        maxInFlight = 2 * numProcs
+    if taxa is not None:
+        taxa = set(int(taxon) for taxon in taxa)
+    os.makedirs(outDir, exist_ok=True)
+    fname = getPlainName(os.path.basename(fpath))
+    numCols = len(readHeader(fpath))
+    with openInput(fpath) as f:
+        headerLine = f.readline()
+        if not headerLine.endswith(b'\n'):
+            headerLine += b'\n'
+    if isCompressed(fpath):
+        stream = openInput(fpath)
+        stream.readline()
+        tasks = ((routeBlock, block, numCols, taxa) for block in readBlocks(stream, shardSize))
+    else:
+        stream = None
+        tasks = ((routeShard, fpath, start, end, numCols, taxa) for start, end in getShards(fpath, max(1, os.path.getsize(fpath) // shardSize)))
+
+    shards = {}
+    numSkipped = 0
+    openFiles = collections.OrderedDict() # taxon : file, least recently written first
+
+    def write(taxon, data, numRows):
+        try:
+            f = openFiles.pop(taxon)
+        except KeyError:
+            if len(openFiles) >= maxOpenFiles:
+                openFiles.popitem(last=False)[1].close()
+            if taxon in shards:
+                f = open(shards[taxon]['fpath'], 'ab')
+            else:
+                shards[taxon] = {'fpath': getShardPath(outDir, taxon, fname), 'numRows': 0}
+                f = open(shards[taxon]['fpath'], 'wb')
+                f.write(headerLine)
+        openFiles[taxon] = f
+        f.write(data)
+        shards[taxon]['numRows'] += numRows
+
+    try:
+        with ProcessPoolExecutor(max_workers=numProcs) as pool:
+            futures = collections.deque()
+            def submitNext():
+                task = next(tasks, None)
+                if task is not None:
+                    futures.append(pool.submit(*task))
+            for i in range(maxInFlight):
+                submitNext()
+            while futures:
+                groups = futures.popleft().result()
+                submitNext()
+                for taxon, (data, numRows) in sorted(groups.items()):
+                    if taxon == -1:
+                        numSkipped += numRows
+                    else:
+                        write(taxon, data, numRows)
+    finally:
+        for f in openFiles.values():
+            f.close()
+        if stream is not None:
+            stream.close()
+    return shards, numSkipped
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json, os
+import numpy as np
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpistore.py
+
+File Description
+----------------
+
+    Memory-mapped storage of the dictionaries made by cpi.py.
+
+    A pickled dictionary must be fully deserialized into memory before it can be used. The format in this module is instead a directory of flat arrays that are memory-mapped when loaded, so opening a dictionary is instant, a look-up only reads the few pages it touches, and any number of processes that open the same dictionary share one physical copy through the operating system's page cache.
+
+    A dictionary { key : [value1, value2, ...] } is stored as
+
+    File              | Contents
+    ============================================================================
+    keyOffsets.npy    | sorted keys, as a string table (see StringTable)
+    keyBlob.npy       |
+    indptr.npy        | the values of key i are rows indptr[i]:indptr[i+1]
+    field0.npy, ...   | one column per field of the values. Text fields are codes into the value string table, integer fields are stored as they are.
+    valueOffsets.npy  | value string table, each distinct string is stored once
+    valueBlob.npy     |
+    meta.json         | key and field types
+
+    Keys may be strings, integers (e.g. codes from an IdRegistry), or tuples of those (like the (A, B) keys of pairsToLinksDic). Values may be single strings or integers, or tuples of those (like the (alias, source) values of protSynsDic).
+'''
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def makeStringTable(strings):
+    '''
+    Packs a list of strings into (offsets, blob), where string i is blob[offsets[i]:offsets[i+1]] encoded as UTF-8.
+    '''
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return offsets, blob
+
+class StringTable:
+    '''
+    Read-only view of a string table made by makeStringTable. Strings are decoded only when accessed.
+    '''
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def getBytes(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i+1]].tobytes()
+
+    def __getitem__(self, i):
+        return self.getBytes(i).decode()
+
+    def find(self, string):
+        '''
+        Binary search for 'string' in a table sorted by UTF-8 bytes. Returns its index, or -1 if it is not in the table.
+        '''
+        target = string.encode()
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.getBytes(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.getBytes(lo) == target:
+            return lo
+        return -1
+
+def getType(element):
+    if isinstance(element, (int, np.integer)):
+        return 'int'
+    else:
+        return 'str'
+
+def keyToString(key):
+    '''
+    Tuple keys are stored as their fields joined by tabs, the separator used in the STITCH files.
+    '''
+    if isinstance(key, tuple):
+        return '\t'.join(str(field) for field in key)
+    return key
+
+def saveMappedDic(dic, dirPath):
+    '''
+    Writes a dictionary { key : [value1, value2, ...] } to the directory 'dirPath' in the memory-mappable format described in the module description. Load it with loadMappedDic.
+    '''
+    os.makedirs(dirPath, exist_ok=True)
+    meta = {'numKeys': len(dic)}
+
+    # Keys
+    firstKey = next(iter(dic), '')
+    if isinstance(firstKey, tuple):
+        meta['keyType'] = 'tuple'
+        meta['keyFieldTypes'] = [getType(field) for field in firstKey]
+    else:
+        meta['keyType'] = getType(firstKey)
+    if meta['keyType'] == 'int':
+        keys = sorted(dic)
+        np.save(os.path.join(dirPath, 'keys.npy'), np.array(keys, dtype=np.int64))
+    else:
+        keys = sorted(dic, key=lambda key: keyToString(key).encode())
+        keyOffsets, keyBlob = makeStringTable([keyToString(key) for key in keys])
+        np.save(os.path.join(dirPath, 'keyOffsets.npy'), keyOffsets)
+        np.save(os.path.join(dirPath, 'keyBlob.npy'), keyBlob)
+
+    # Row pointers
+    indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum([len(dic[key]) for key in keys], out=indptr[1:])
+    np.save(os.path.join(dirPath, 'indptr.npy'), indptr)
+
+    # Value fields
+    firstValue = next((values[0] for values in dic.values() if len(values) > 0), '')
+    meta['scalar'] = not isinstance(firstValue, tuple)
+    if meta['scalar']:
+        firstValue = (firstValue,)
+    meta['fieldTypes'] = [getType(field) for field in firstValue]
+    valueCodes = {}
+    for i, fieldType in enumerate(meta['fieldTypes']):
+        if meta['scalar']:
+            fields = [value for key in keys for value in dic[key]]
+        else:
+            fields = [value[i] for key in keys for value in dic[key]]
+        if fieldType == 'int':
+            column = np.array(fields, dtype=np.int64)
+        else:
+            column = np.array([valueCodes.setdefault(field, len(valueCodes)) for field in fields], dtype=np.int32)
+        np.save(os.path.join(dirPath, 'field%d.npy' % i), column)
+    valueOffsets, valueBlob = makeStringTable(list(valueCodes))
+    np.save(os.path.join(dirPath, 'valueOffsets.npy'), valueOffsets)
+    np.save(os.path.join(dirPath, 'valueBlob.npy'), valueBlob)
+
+    with open(os.path.join(dirPath, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+class MappedDic:
+    '''
+    Read-only, dictionary-like view of a dictionary saved with saveMappedDic. Nothing is read from disk until it is used, and each look-up only decodes the values of one key.
+
+    >>> protSynsRDic = loadMappedDic(DIR + 'protSynsRDic')
+    >>> protSynsRDic['(2E,6E)-farnesyl diphosphate synthase']
+    [('9606.ENSP00000282841', 'BLAST_UniProt_DE ...'), ('9606.ENSP00000349078', 'BLAST_UniProt_DE ...')]
+    '''
+    def __init__(self, dirPath):
+        load = lambda name: np.load(os.path.join(dirPath, name + '.npy'), mmap_mode='r')
+        with open(os.path.join(dirPath, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['keyType'] == 'int':
+            self.keyArray = load('keys')
+        else:
+            self.keyTable = StringTable(load('keyOffsets'), load('keyBlob'))
+        self.indptr = load('indptr')
+        self.fields = [load('field%d' % i) for i in range(len(self.meta['fieldTypes']))]
+        self.valueTable = StringTable(load('valueOffsets'), load('valueBlob'))
+
+    def __len__(self):
+        return self.meta['numKeys']
+
+    def position(self, key):
+        '''
+        Returns the row of 'key', or -1 if it is not in the dictionary.
+        '''
+        if self.meta['keyType'] == 'int':
+            i = int(np.searchsorted(self.keyArray, key))
+            if i < len(self.keyArray) and self.keyArray[i] == key:
+                return i
+            return -1
+        else:
+            return self.keyTable.find(keyToString(key))
+
+    def decodeKey(self, i):
+        if self.meta['keyType'] == 'int':
+            return int(self.keyArray[i])
+        key = self.keyTable[i]
+        if self.meta['keyType'] == 'tuple':
+            return tuple(int(field) if fieldType == 'int' else field for field, fieldType in zip(key.split('\t'), self.meta['keyFieldTypes']))
+        return key
+
+    def valuesAt(self, i):
+        a, b = self.indptr[i], self.indptr[i+1]
+        columns = []
+        for column, fieldType in zip(self.fields, self.meta['fieldTypes']):
+            if fieldType == 'int':
+                columns.append(column[a:b].tolist())
+            else:
+                columns.append([self.valueTable[code] for code in column[a:b].tolist()])
+        if self.meta['scalar']:
+            return columns[0]
+        else:
+            return list(zip(*columns))
+
+    def __getitem__(self, key):
+        i = self.position(key)
+        if i < 0:
+            raise KeyError(key)
+        return self.valuesAt(i)
+
+    def __contains__(self, key):
+        return self.position(key) >= 0
+
+    def get(self, key, default=None):
+        i = self.position(key)
+        if i < 0:
+            return default
+        return self.valuesAt(i)
+
+    def keys(self):
+        for i in range(len(self)):
+            yield self.decodeKey(i)
+
+    def __iter__(self):
+        return self.keys()
+
+    def items(self):
+        for i in range(len(self)):
+            yield self.decodeKey(i), self.valuesAt(i)
+
+    def values(self):
+        for i in range(len(self)):
+            yield self.valuesAt(i)
+
+    def toDic(self):
+        '''
+        Materializes the whole dictionary in memory.
+        '''
+        return dict(self.items())
+
+def loadMappedDic(dirPath):
+    return MappedDic(dirPath)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+from cpiids import isCidCode
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    cpitable.py
+
+File Description
+----------------
+
+    Columnar storage of the actions file, for filtered queries like "all binding links with score >= 700 where the chemical is acting".
+
+    'makeLinksDic' keeps every row as a tuple of strings, (mode, action, a_is_acting, score), in a list per (A, B) pair of pairsToLinksDic, so a query has to look at every tuple in Python. A LinksTable keeps each column as one typed array instead:
+
+        a         = [c0, p3, c0, ...]          # int64 registry codes of item_id_a (see cpiids.py)
+        b         = [p3, c0, p5, ...]          # int64 registry codes of item_id_b
+        mode      = [1, 1, 4, ...]             # int8 codes into table.modes, e.g. 'binding'
+        action    = [0, 0, 2, ...]             # int8 codes into table.actions, '' if the row has no action
+        aIsActing = [False, True, True, ...]   # a_is_acting == 't'
+        aIsCid    = [True, False, True, ...]   # item_id_a is a chemical
+        score     = [613, 613, 700, ...]       # int16
+
+    The rows are sorted by mode and then by score, and 'modeptr' gives the rows of every mode, like the row pointer of a CsrGraph: rows modeptr[m] to modeptr[m+1] have mode m, in increasing order of score. A query on mode and score is then two binary searches per mode, and the other conditions are Numpy masks over those rows only. 'rowIds' keeps the number of every row in the file.
+'''
+
+'''
+Meta Global Variables
+'''
+
+COLUMNS = ['a', 'b', 'mode', 'action', 'aIsActing', 'aIsCid', 'score']
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def getCategories(table, name):
+    '''
+    Returns the sorted labels used by a text column of a table made by cpiio.loadColumns, and the column as int8 codes into those labels.
+    '''
+    used, codes = np.unique(table['columns'][name], return_inverse=True)
+    if len(used) > np.iinfo(np.int8).max:
+        raise OverflowError('Column %s has %d labels, more than fit in 8 bits.' % (name, len(used)))
+    labels = [table['vocab'][code] for code in used.tolist()]
+    order = np.argsort(np.array(labels, dtype=object))
+    rank = np.empty(len(order), dtype=np.int8)
+    rank[order] = np.arange(len(order))
+    return [labels[i] for i in order.tolist()], rank[codes.reshape(-1)]
+
+class LinksTable:
+    '''
+    Columnar, indexed table of the actions file. See the module description.
+
+    >>> links = LinksTable.fromTable(table, registry)
+    >>> rows = links.query(mode='binding', minScore=700, actor='chemical')
+    >>> links.select(rows, registry)
+    {'a': array(['CIDs00002244', ...], dtype=object), 'b': ..., 'mode': ..., 'score': array([700, 712, ...], dtype=int16), ...}
+    >>> pandas.DataFrame(links.select(rows, registry))
+    '''
+    names = COLUMNS + ['rowIds', 'modeptr']
+
+    def __init__(self, a, b, mode, action, aIsActing, aIsCid, score, rowIds, modeptr, modes, actions):
+        self.a, self.b, self.mode, self.action = a, b, mode, action
+        self.aIsActing, self.aIsCid, self.score = aIsActing, aIsCid, score
+        self.rowIds, self.modeptr = rowIds, modeptr
+        self.modes, self.actions = modes, actions
+
+    @classmethod
+    def fromTable(cls, table, registry):
+        '''
+        Builds the table from the actions file loaded by cpiio.loadColumns, with the column types of cpi.ACTIONS_DTYPES.
+
+        INPUT:  table, a dictionary, the loaded file.
+                registry, an IdRegistry, used to encode identifiers.
+        '''
+        ids = registry.encodeVocab(table, ['item_id_a', 'item_id_b'])
+        modes, mode = getCategories(table, 'mode')
+        actions, action = getCategories(table, 'action')
+        actingLabels, acting = getCategories(table, 'a_is_acting')
+        aIsActing = np.array([label == 't' for label in actingLabels], dtype=np.bool_)[acting]
+        score = table['columns']['score'].astype(np.int16)
+
+        order = np.lexsort((score, mode))
+        mode = mode[order]
+        modeptr = np.searchsorted(mode, np.arange(len(modes) + 1)).astype(np.int64)
+        a = ids['item_id_a'][order]
+        return cls(a, ids['item_id_b'][order], mode, action[order], aIsActing[order], isCidCode(a), score[order], order.astype(np.int64), modeptr, modes, actions)
+
+    def __len__(self):
+        return len(self.score)
+
+    def getCodes(self, labels, values):
+        '''
+        Returns the codes of a label or a list of labels. Labels the table does not have are left out, so they match no rows: not every species has every mode and action.
+        '''
+        if isinstance(values, str):
+            values = [values]
+        return sorted(set(labels.index(value) for value in values if value in labels))
+
+    def getModeRows(self, modes=None, minScore=None, maxScore=None):
+        '''
+        Returns the rows with one of 'modes' (a label or a list of labels, all modes if None) and a score in [minScore, maxScore], from the mode and score index.
+        '''
+        if modes is None:
+            codes = range(len(self.modes))
+        else:
+            codes = self.getCodes(self.modes, modes)
+        parts = []
+        for code in codes:
+            start, end = self.modeptr[code], self.modeptr[code+1]
+            scores = self.score[start:end]
+            if minScore is not None:
+                start += np.searchsorted(scores, minScore, side='left')
+            if maxScore is not None:
+                end = self.modeptr[code] + np.searchsorted(scores, maxScore, side='right')
+            if start < end:
+                parts.append(np.arange(start, end, dtype=np.int64))
+        if len(parts) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+    def query(self, mode=None, minScore=None, maxScore=None, action=None, aIsActing=None, actor=None, cid=None, prot=None):
+        '''
+        Returns the positions of the rows that meet all the given conditions, as an int64 array, sorted by mode and then score. Conditions left as None are not applied.
+
+        INPUT:  mode, a mode label or a list of them, e.g. 'binding'.
+                minScore, maxScore, integers, inclusive bounds on the score.
+                action, an action label or a list of them, e.g. 'inhibition'. '' is the rows without an action.
+                aIsActing, boolean, the a_is_acting column.
+                actor, 'chemical' or 'protein', the rows where that item is acting, i.e. item A is of that kind and a_is_acting is 't'.
+                cid, prot, registry codes. The rows that link this chemical or protein, in either column.
+        OUTPUT: rows, positions to pass to 'select', or to index the column arrays with.
+        '''
+        rows = self.getModeRows(mode, minScore, maxScore)
+        mask = np.ones(len(rows), dtype=np.bool_)
+        if action is not None:
+            mask &= np.isin(self.action[rows], self.getCodes(self.actions, action))
+        if aIsActing is not None:
+            mask &= self.aIsActing[rows] == bool(aIsActing)
+        if actor is not None:
+            if actor not in ['chemical', 'protein']:
+                raise ValueError('actor must be \'chemical\' or \'protein\', not %s.' % actor)
+            mask &= self.aIsActing[rows] & (self.aIsCid[rows] == (actor == 'chemical'))
+        for code in [cid, prot]:
+            if code is not None:
+                mask &= (self.a[rows] == code) | (self.b[rows] == code)
+        return rows[mask]
+
+    def count(self, **conditions):
+        return len(self.query(**conditions))
+
+    def select(self, rows=None, registry=None):
+        '''
+        Returns the given rows (all rows if None) as a dictionary { column name : array }, which pandas.DataFrame accepts as is. Modes and actions are decoded to labels, and identifiers too if a registry is given.
+        '''
+        if rows is None:
+            rows = np.arange(len(self), dtype=np.int64)
+        result = {name: getattr(self, name)[rows] for name in COLUMNS + ['rowIds']}
+        result['mode'] = np.array(self.modes, dtype=object)[result['mode']]
+        result['action'] = np.array(self.actions, dtype=object)[result['action']]
+        if registry is not None:
+            result['a'] = registry.decodeArray(result['a'])
+            result['b'] = registry.decodeArray(result['b'])
+        return result
+
+    def toFrame(self, rows=None, registry=None):
+        '''
+        Returns the given rows as a pandas DataFrame, in file order. Requires pandas.
+        '''
+        import pandas as pd
+        frame = pd.DataFrame(self.select(rows, registry))
+        return frame.sort_values('rowIds').set_index('rowIds')
+
+    def toDic(self, registry=None):
+        '''
+        Returns the table as pairsToLinksDic, with the same tuples of strings in the same order as makeLinksDic. Identifiers are decoded to strings if a registry is given. Meant for small tables and for checking results.
+        '''
+        order = np.argsort(self.rowIds, kind='stable')
+        columns = self.select(order, registry)
+        acting = np.where(columns['aIsActing'], 't', 'f').tolist()
+        scores = [str(score) for score in columns['score'].tolist()]
+        pairsToLinksDic = {}
+        for A, B, link, action, bool, score in zip(columns['a'].tolist(), columns['b'].tolist(), columns['mode'].tolist(), columns['action'].tolist(), acting, scores):
+            try:
+                pairsToLinksDic[(A,B)].append((link, action, bool, score))
+            except KeyError:
+                pairsToLinksDic[(A,B)] = [(link, action, bool, score)]
+        return pairsToLinksDic
+
+    def save(self, dirPath):
+        '''
+        Saves each array to 'dirPath' as a .npy file, and the mode and action labels to a text file.
+        '''
+        os.makedirs(dirPath, exist_ok=True)
+        for name in self.names:
+            np.save(os.path.join(dirPath, name + '.npy'), getattr(self, name))
+        with open(os.path.join(dirPath, 'labels.txt'), 'w') as f:
+            f.write('\t'.join(self.modes) + '\n')
+            f.write('\t'.join(self.actions) + '\n')
+
+    @classmethod
+    def load(cls, dirPath, mmap=True):
+        '''
+        Loads a table saved with 'save'. With mmap=True the arrays are memory-mapped read-only, as in CsrGraph.load.
+        '''
+        if mmap:
+            mmapMode = 'r'
+        else:
+            mmapMode = None
+        arrays = [np.load(os.path.join(dirPath, name + '.npy'), mmap_mode=mmapMode) for name in cls.names]
+        with open(os.path.join(dirPath, 'labels.txt')) as f:
+            modes, actions = [line.rstrip('\n').split('\t') for line in f]
+        return cls(*arrays, modes, actions)
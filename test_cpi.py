@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gzip, os, random
+import numpy as np
+import pytest
+from cpi import makeLinksDic, makeProtSynsDic, makeCpiDic, makeCpiDics, makeDicsIncremental, saveDic
+from cpiaux import getCidBags, getCidBagsVectorized, countCidTypes, countCidTypesVectorized
+from cpigraph import CsrGraph
+from cpiids import IdRegistry
+from cpiio import loadColumns, loadColumnsParallel, decodeColumn
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    test_cpi.py
+
+File Description
+----------------
+
+    Tests that the fast builders give the same results as the code they replace, on small synthetic STITCH and STRING files written to a temporary directory. Run with
+
+    $ python -m pytest test_cpi.py
+'''
+
+'''
+Meta Global Variables
+'''
+
+LINKS = '9606.protein_chemical.links.v5.0.tsv'
+DETAILED = '9606.protein_chemical.links.detailed.v5.0.tsv'
+ACTIONS = '9606.actions.v5.0.tsv'
+ALIASES = '9606.protein.aliases.v10.5.txt'
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def writeFiles(dirPath, seed=0):
+    '''
+    Writes a links, a detailed links, an actions and an aliases file in the STITCH and STRING formats. Some CID numbers have an m and an s CID with the same proteins, some with different proteins, and some only one of the two.
+    '''
+    rng = random.Random(seed)
+    prots = ['9606.ENSP%011d' % rng.randint(1, 10**6) for _ in range(150)]
+    links = []
+    for number in sorted(rng.sample(range(1, 10**7), 400), reverse=True): # STITCH files are sorted by chemical
+        partners = rng.sample(prots, rng.randint(1, 6))
+        kind = rng.choice(['m', 's', 'same', 'different'])
+        if kind in ['m', 'same', 'different']:
+            links.extend(('CIDm%08d' % number, prot, rng.randint(150, 999)) for prot in partners)
+        if kind in ['s', 'same']:
+            links.extend(('CIDs%08d' % number, prot, rng.randint(150, 999)) for prot in partners)
+        elif kind == 'different':
+            links.extend(('CIDs%08d' % number, prot, rng.randint(150, 999)) for prot in rng.sample(prots, rng.randint(1, 6)))
+    with open(dirPath + LINKS, 'w') as f:
+        f.write('chemical\tprotein\tcombined_score\n')
+        f.writelines('%s\t%s\t%d\n' % link for link in links)
+    with open(dirPath + DETAILED, 'w') as f:
+        f.write('chemical\tprotein\texperimental\tprediction\tdatabase\ttextmining\tcombined_score\n')
+        f.writelines('%s\t%s\t0\t%d\t0\t%d\t%d\n' % (cid, prot, rng.randint(0, 300), score - 1, score) for cid, prot, score in links)
+    modes = ['activation', 'binding', 'catalysis', 'expression', 'inhibition', 'reaction']
+    with open(dirPath + ACTIONS, 'w') as f:
+        f.write('item_id_a\titem_id_b\tmode\taction\ta_is_acting\tscore\n')
+        for cid, prot, score in links:
+            mode, action = rng.choice(modes), rng.choice(['', 'activation', 'inhibition'])
+            f.write('%s\t%s\t%s\t%s\tf\t%d\n' % (prot, cid, mode, action, score))
+            f.write('%s\t%s\t%s\t%s\t%s\t%d\n' % (cid, prot, mode, action, rng.choice('tf'), score))
+    sources = ['BLAST_KEGG_NAME', 'BLAST_UniProt_DE Ensembl_HGNC_UniProt_ID(supplied_by_UniProt)_DE Ensembl_UniProt_DE', 'Ensembl_EntrezGene']
+    with open(dirPath + ALIASES, 'w') as f:
+        f.write('## string_protein_id ## alias ## source ##\n')
+        for prot in prots:
+            for i in range(rng.randint(1, 6)):
+                f.write('%s\talias%d %s\t%s\n' % (prot, rng.randint(0, 400), rng.choice(['kinase', 'synthase']), rng.choice(sources)))
+
+@pytest.fixture
+def dataDir(tmp_path):
+    dirPath = str(tmp_path) + '/'
+    writeFiles(dirPath)
+    return dirPath
+
+def getRows(table):
+    '''
+    The rows of a table made by cpiio.loadColumns, with codes decoded to strings, so tables with different vocabularies can be compared.
+    '''
+    columns = []
+    for name in table['header']:
+        if table['dtypes'][name] == 'code':
+            columns.append(decodeColumn(table, name).tolist())
+        else:
+            columns.append(table['columns'][name].tolist())
+    return list(zip(*columns))
+
+@pytest.mark.parametrize('fname', [LINKS, DETAILED, ACTIONS, ALIASES])
+def test_loadColumnsParallel(dataDir, fname):
+    table = loadColumns(dataDir + fname)
+    assert len(table['columns'][table['header'][0]]) > 500 # several shards and chunks
+    for numProcs in [1, 3]:
+        parallel = loadColumnsParallel(dataDir + fname, numProcs=numProcs, chunkSize=2**12)
+        assert parallel['header'] == table['header']
+        assert parallel['dtypes'] == table['dtypes']
+        assert getRows(parallel) == getRows(table)
+
+    # Compressed files are parsed block by block
+    with open(dataDir + fname, 'rb') as f, gzip.open(dataDir + fname + '.gz', 'wb') as g:
+        g.write(f.read())
+    assert getRows(loadColumnsParallel(dataDir + fname + '.gz', numProcs=3, chunkSize=2**12)) == getRows(table)
+
+def test_numProcs(dataDir):
+    assert makeCpiDic(dataDir, dataDir, dataDir, LINKS, numProcs=3) == makeCpiDic(dataDir, dataDir, dataDir, LINKS)
+    assert makeLinksDic(dataDir, '', ACTIONS, numProcs=3) == makeLinksDic(dataDir, '', ACTIONS)
+    assert makeProtSynsDic(dataDir, '', ALIASES, numProcs=3) == makeProtSynsDic(dataDir, '', ALIASES)
+
+def editFile(fpath, seed=0):
+    '''
+    Edits the data rows of a file: deletes some, moves a block, changes one and appends one.
+    '''
+    rng = random.Random(seed)
+    with open(fpath) as f:
+        header, *lines = f.readlines()
+    lines = lines[:100] + lines[300:] + lines[100:200]
+    lines[rng.randrange(len(lines))] = lines[0]
+    lines.append(lines[-1])
+    with open(fpath, 'w') as f:
+        f.writelines([header] + lines)
+
+def normalize(dic):
+    return {key: sorted(values) for key, values in dic.items()}
+
+def buildFull(dirPath, builder, fname):
+    '''
+    The dictionaries of an incremental builder, made by its full builder.
+    '''
+    if builder == 'cpi':
+        dics = makeCpiDic(dirPath, dirPath, dirPath, fname)
+        names = ['cpiDic', 'cpiRDic']
+    elif builder == 'links':
+        dics = makeLinksDic(dirPath, '', fname)
+        names = ['ctopDic', 'ptocDic', 'pairsToLinksDic']
+    else:
+        dics = makeProtSynsDic(dirPath, '', fname)
+        names = ['protSynsDic', 'protSynsRDic']
+    return dict(zip(names, dics))
+
+@pytest.mark.parametrize('builder, fname', [('cpi', LINKS), ('links', ACTIONS), ('protSyns', ALIASES)])
+def test_makeDicsIncremental(dataDir, builder, fname):
+    dics = makeDicsIncremental(dataDir, '', fname, builder, avgChunkLines=32)
+    assert {name: normalize(dic) for name, dic in dics.items()} == {name: normalize(dic) for name, dic in buildFull(dataDir, builder, fname).items()}
+
+    # A full build into the same directory does not change the base of the next update
+    if builder == 'links':
+        makeLinksDic(dataDir, '', fname, quickMode=True, quickModeLimit=500)
+    editFile(dataDir + fname)
+    dics = makeDicsIncremental(dataDir, '', fname, builder, avgChunkLines=32)
+    full = buildFull(dataDir, builder, fname)
+    assert {name: normalize(dic) for name, dic in dics.items()} == {name: normalize(dic) for name, dic in full.items()}
+
+    # Saved dictionaries that do not match the manifest are rebuilt
+    for name in dics:
+        saveDic({}, dataDir + builder + 'Dics/', name)
+    editFile(dataDir + fname, seed=1)
+    dics = makeDicsIncremental(dataDir, '', fname, builder, avgChunkLines=32)
+    full = buildFull(dataDir, builder, fname)
+    assert {name: normalize(dic) for name, dic in dics.items()} == {name: normalize(dic) for name, dic in full.items()}
+    assert sorted(os.listdir(dataDir + builder + 'Dics')) == sorted(name + '.pickle' for name in dics)
+
+def test_cidBagsVectorized(dataDir, capsys):
+    cpiDic = makeCpiDic(dataDir, dataDir, dataDir, LINKS)[0]
+    bags = getCidBags(cpiDic)
+    vectorized = getCidBagsVectorized(cpiDic)
+    assert [sorted(int(cid) for cid in bag) for bag in bags] == [bag.tolist() for bag in vectorized]
+    assert all(len(bag) > 0 for bag in bags)
+
+    # Registry codes and CsrGraphs give the same bags
+    registry = IdRegistry()
+    codedDic = makeCpiDic(dataDir, dataDir, dataDir, LINKS, registry=registry)[0]
+    graph = CsrGraph.fromTable(loadColumns(dataDir + LINKS), registry)
+    for source in [codedDic, graph]:
+        assert all(np.array_equal(a, b) for a, b in zip(getCidBagsVectorized(source), vectorized))
+
+    # Same counts and same printed tables
+    capsys.readouterr()
+    result = countCidTypes(cpiDic)
+    printed = capsys.readouterr().out
+    assert countCidTypesVectorized(cpiDic) == result
+    assert capsys.readouterr().out == printed
+    assert countCidTypesVectorized(graph) == result
+    assert capsys.readouterr().out == printed
+
+def getCpiDicsByLine(fpath, registry=None):
+    '''
+    The CID list, cpiDic and cpiRDic of a links file as makeCidList and makeCpiDic made them before makeCpiDics, in two reads of the file line by line.
+    '''
+    if registry is None:
+        encode = str
+    else:
+        encode = registry.encode
+    with open(fpath) as f:
+        next(f)
+        cidList = list(set(encode(line.split()[0]) for line in f))
+    cpiDic = {}
+    cpiRDic = {}
+    with open(fpath) as f:
+        next(f)
+        for line in f:
+            cid, prot = [encode(field) for field in line.split()[:2]]
+            try:
+                cpiDic[cid].append(prot)
+            except KeyError:
+                cpiDic[cid] = [prot]
+            try:
+                cpiRDic[prot].append(cid)
+            except KeyError:
+                cpiRDic[prot] = [cid]
+    return cidList, cpiDic, cpiRDic
+
+@pytest.mark.parametrize('fname', [LINKS, DETAILED])
+@pytest.mark.parametrize('withRegistry', [False, True])
+def test_makeCpiDics(dataDir, fname, withRegistry):
+    if withRegistry:
+        registry = IdRegistry()
+    else:
+        registry = None
+    results = makeCpiDics(dataDir, dataDir, dataDir, fname, registry=registry)
+    cidList, cpiDic, cpiRDic = getCpiDicsByLine(dataDir + fname, registry)
+    assert sorted(results['cidList']) == sorted(cidList) # the old list came from a set, so it had no order
+    assert len(set(results['cidList'])) == len(results['cidList'])
+    assert results['cpiDic'] == cpiDic and list(results['cpiDic']) == list(cpiDic)
+    assert results['cpiRDic'] == cpiRDic and list(results['cpiRDic']) == list(cpiRDic)
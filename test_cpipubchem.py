@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import http.server, threading, time
+import pytest
+from cpi import downloadCidSyns
+from cpipubchem import ResponseCache
+
+'''
+Project Name
+------------
+
+    cpi -- Chemical-Protein Interaction
+
+File name
+---------
+
+    test_cpipubchem.py
+
+File Description
+----------------
+
+    Tests of the PubChem response cache (see ResponseCache in cpipubchem.py and downloadCidSyns in cpi.py) against a local stand-in for PUG REST, so no requests go to pubchem.ncbi.nlm.nih.gov. Run with
+
+    $ python -m pytest test_cpipubchem.py
+'''
+
+'''
+################################################################################
+##### Functions ################################################################
+################################################################################
+'''
+
+def getSynonymsXml(cids):
+    '''
+    The PUG REST synonyms XML of some CIDs. CIDs that are multiples of 7 have no record, like CIDs PubChem does not know.
+    '''
+    records = ''.join('<Information><CID>%d</CID><Synonym>name%d</Synonym><Synonym>alias%d</Synonym></Information>' % (cid, cid, cid) for cid in cids if cid % 7 != 0)
+    return '<?xml version="1.0"?>\n<InformationList xmlns="http://pubchem.ncbi.nlm.nih.gov/pug_rest">%s</InformationList>' % records
+
+def getExpected(cids):
+    return {cid: ['name%d' % cid, 'alias%d' % cid] for cid in cids if cid % 7 != 0}
+
+class PugHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Answers GET requests for 'compound/cid/<cids>/synonyms/XML', and records the CIDs asked for in server.requested.
+    '''
+    def do_GET(self):
+        cids = [int(cid) for cid in self.path.split('/')[-3].split(',')]
+        self.server.requested.extend(cids)
+        body = getSynonymsXml(cids).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), PugHandler)
+    server.requested = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.baseUrl = 'http://127.0.0.1:%d/' % server.server_port
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def getCidList(cids):
+    return ['CIDm%08d' % cid for cid in cids]
+
+def download(server, cids, cache):
+    return dict(downloadCidSyns(getCidList(cids), cache=cache, baseUrl=server.baseUrl, rate=1000, maxInFlight=1))
+
+def test_cacheMissThenHit(server, tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    cids = list(range(1, 401))
+    assert download(server, cids, cache) == getExpected(cids)
+    assert sorted(server.requested) == cids
+    assert len(cache) == len(cids) # CIDs without a record are cached too
+
+    # Everything is cached: no requests, same records
+    server.requested.clear()
+    assert download(server, cids, cache) == getExpected(cids)
+    assert server.requested == []
+
+    # Only the new CIDs are requested
+    assert download(server, list(range(351, 451)), cache) == getExpected(range(351, 451))
+    assert sorted(server.requested) == list(range(401, 451))
+    cache.close()
+
+class CrashingCache(ResponseCache):
+    '''
+    Cache that fails on its 'crashAt'-th write, like a run that is killed in the middle of a chunk.
+    '''
+    def __init__(self, dbPath, crashAt):
+        super().__init__(dbPath)
+        self.crashAt = crashAt
+        self.numPuts = 0
+
+    def put(self, mineType, bodies):
+        self.numPuts += 1
+        if self.numPuts == self.crashAt:
+            raise RuntimeError('crash while writing chunk %d' % self.numPuts)
+        super().put(mineType, bodies)
+
+def test_resumeAfterInterruptedChunk(server, tmp_path):
+    dbPath = str(tmp_path / 'cache.sqlite')
+    cids = list(range(1, 501)) # 3 GET chunks of up to 190 CIDs
+    cache = CrashingCache(dbPath, crashAt=2)
+    with pytest.raises(RuntimeError):
+        download(server, cids, cache)
+    cache.close()
+
+    # Only the first chunk was completed
+    cache = ResponseCache(dbPath)
+    assert len(cache) == 190
+    assert cache.missing('synonyms', cids) == cids[190:]
+
+    # The next run requests the rest, and returns every record
+    server.requested.clear()
+    assert download(server, cids, cache) == getExpected(cids)
+    assert sorted(server.requested) == cids[190:]
+    assert len(cache) == len(cids)
+    cache.close()
+
+def test_eviction(server, tmp_path):
+    dbPath = str(tmp_path / 'cache.sqlite')
+    cache = ResponseCache(dbPath)
+    download(server, range(1, 11), cache)
+    time.sleep(0.01)
+    cache.get('synonyms', [1, 2, 3]) # the most recently used
+    cache.close()
+
+    # Least recently used entries are dropped first
+    cache = ResponseCache(dbPath, maxEntries=3)
+    assert len(cache) == 3
+    assert cache.missing('synonyms', range(1, 11)) == list(range(4, 11))
+
+    # Entries older than maxAge are dropped, and fetched again
+    cache.connection.execute('UPDATE responses SET fetched = fetched - 7200 WHERE cid = 1')
+    cache.connection.commit()
+    cache.close()
+    cache = ResponseCache(dbPath, maxAge=3600)
+    assert cache.missing('synonyms', [1, 2, 3]) == [1]
+    server.requested.clear()
+    assert download(server, [1, 2, 3], cache) == getExpected([1, 2, 3])
+    assert server.requested == [1]
+    cache.close()